@@ -0,0 +1,85 @@
+# `training.step_downhill`'s meta-gradient engines, per optimizer:
+# how far each is from the reference (`training.AUTODIFF`), and how long a step takes.
+
+from metaoptimizer import feedforward, training
+from metaoptimizer.optimizers import (
+    adam,
+    momentum,
+    nesterov,
+    rmsprop,
+    sgd,
+    swiss_army_knife,
+    weight_decay,
+)
+
+from jax import block_until_ready, jit, nn as jnn, numpy as jnp, random as jrnd
+from jax.tree_util import tree_leaves, tree_map
+from time import perf_counter
+
+
+OPTIMIZERS = {
+    "sgd": sgd,
+    "weight_decay": weight_decay,
+    "momentum": momentum,
+    "nesterov": nesterov,
+    "rmsprop": rmsprop,
+    "adam": adam,
+    "swiss_army_knife": swiss_army_knife,
+}
+WIDTHS = (64, 64, 64, 64)
+BATCH = 256
+STEPS = 100
+
+
+def main() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    w = feedforward.init(WIDTHS, jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init(WIDTHS, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, WIDTHS[0]], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    _, last_dLdw = training.loss_and_grad(w, forward_pass, x, y, power)
+
+    print(f"{STEPS} steps of {WIDTHS} on a batch of {BATCH}")
+    print()
+    print(
+        f"{'optimizer':>18}"
+        + "".join(f"  {e + ' (ms)':>14}" for e in training.DOWNHILL_ENGINES)
+        + f"  {'max |analytic - autodiff|':>26}"
+    )
+    for name, optim in OPTIMIZERS.items():
+        p = optim.defaults(lr=jnp.array(0.001, dtype=jnp.float64))
+        s = optim.init(w, p)
+        out = {}
+        times = {}
+        for engine in training.DOWNHILL_ENGINES:
+            f = jit(
+                lambda w, p, s, g, engine=engine: training.step_downhill(
+                    w, forward_pass, x, y, optim.update, p, s, g, power, engine
+                )
+            )
+            out[engine] = block_until_ready(f(w, p, s, last_dLdw))  # compile
+            t0 = perf_counter()
+            for _ in range(STEPS):
+                o = f(w, p, s, last_dLdw)
+            block_until_ready(o)
+            times[engine] = (perf_counter() - t0) / STEPS
+        # (only the meta-gradient differs, so compare the new `opt_params`)
+        diff = max(
+            tree_leaves(
+                tree_map(
+                    lambda a, b: float(jnp.max(jnp.abs(a - b))),
+                    out[training.ANALYTIC][2],
+                    out[training.AUTODIFF][2],
+                )
+            )
+        )
+        print(
+            f"{name:>18}"
+            + "".join(f"  {1000 * times[e]:>14.3f}" for e in training.DOWNHILL_ENGINES)
+            + f"  {diff:>26.3g}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# `line_search.step` at every step vs. the optimizer alone, & what the search costs:
+# every candidate scale in one `vmap`, against one loss evaluation per candidate.
+
+from metaoptimizer import feedforward, line_search, training
+from metaoptimizer.optimizers import momentum, rmsprop, sgd
+
+from jax import block_until_ready, jit, nn as jnn, numpy as jnp, random as jrnd
+from jax.tree_util import tree_map
+from time import perf_counter
+
+
+OPTIMIZERS = {"sgd": sgd, "momentum": momentum, "rmsprop": rmsprop}
+WIDTHS = (32, 64, 64, 32)
+BATCH = 64
+STEPS = 1000
+REPEATS = 100
+
+
+def main() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    w_ideal = feedforward.init(WIDTHS, jrnd.PRNGKey(1), True)
+    w_init = feedforward.init(WIDTHS, jrnd.PRNGKey(0), False)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    xs = jrnd.normal(jrnd.PRNGKey(2), [STEPS, BATCH, WIDTHS[0]], dtype=jnp.float32)
+    scales = line_search.SCALES
+
+    print(f"{STEPS} training steps of {WIDTHS} on batches of {BATCH}")
+    print(f"{scales.size} candidate scales, {float(scales[0])} to {float(scales[-1])}")
+    print()
+
+    # Cost of the search alone:
+    x = xs[0]
+    y = forward_pass(w_ideal, x)
+    proposed = feedforward.init(WIDTHS, jrnd.PRNGKey(3), False)
+    batched = jit(
+        lambda w, p: line_search.search(w, p, forward_pass, x, y, power, scales)
+    )
+
+    def one_by_one(w, p):
+        at = lambda t: tree_map(lambda a, b: a + t * (b - a), w, p)
+        return jnp.stack(
+            [training.loss(at(t), forward_pass, x, y, power) for t in scales]
+        )
+
+    sequential = jit(one_by_one)
+    for name, f in [("vmapped", batched), ("one by one", sequential)]:
+        block_until_ready(f(w_init, proposed))  # compile
+        t0 = perf_counter()
+        for _ in range(REPEATS):
+            out = f(w_init, proposed)
+        block_until_ready(out)
+        print(f"{name:>10}: {1000 * (perf_counter() - t0) / REPEATS:.3f} ms per search")
+    print()
+
+    print(f"{'optimizer':>10}  {'search':>6}  {'final loss':>10}  {'median scale':>12}")
+    for name, optim in OPTIMIZERS.items():
+        p = optim.defaults(lr=jnp.array(0.001, dtype=jnp.float64))
+        for apply in [False, True]:
+            step = jit(
+                lambda w, s, x, apply=apply: line_search.step(
+                    w,
+                    forward_pass,
+                    x,
+                    forward_pass(w_ideal, x),
+                    optim.update,
+                    p,
+                    s,
+                    power,
+                    scales,
+                    apply,
+                )
+            )
+            w, s = w_init, optim.init(w_init, p)
+            losses, chosen = [], []
+            for x in xs:
+                w, s, L, found = step(w, s, x)
+                losses.append(L)
+                chosen.append(found.scale)
+            loss = float(jnp.mean(jnp.stack(losses[-STEPS // 100 :])))
+            median = float(jnp.median(jnp.stack(chosen)))
+            print(
+                f"{name:>10}  {'yes' if apply else 'no':>6}  {loss:>10.4g}  {median:>12.4g}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# How `metaoptimizer.parallel` scales with the number of (host CPU) devices.
+# The device count is fixed once JAX starts, so this script runs itself
+# in a fresh process per count (`benchmark-parallel.py <devices>`) and tabulates.
+
+import json
+import os
+import subprocess
+import sys
+
+
+DEVICE_COUNTS = [n for n in [1, 2, 4, 8, 16, 32, 64] if n <= (os.cpu_count() or 1)]
+WIDTHS = (16, 32, 32, 16)
+BATCH = 1024  # in total, split across devices (strong scaling)
+TRIALS_PER_DEVICE = 4  # independent trials, more with more devices (weak scaling)
+STEPS = 20
+
+
+def measure(n: int) -> dict:
+    from metaoptimizer import devices
+
+    devices.force_host_devices(n)
+
+    from metaoptimizer import feedforward, parallel, training
+    from metaoptimizer.optimizers import sgd as optim
+
+    from jax import block_until_ready, jit, nn as jnn, numpy as jnp, random as jrnd
+    from jax.tree_util import tree_map
+    from time import perf_counter
+
+    mesh = parallel.mesh(n)
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    power = jnp.array(2.0, dtype=jnp.float32)
+
+    def setup(seed: int):
+        w_ideal = feedforward.init(WIDTHS, jrnd.PRNGKey(seed), True)
+        w = feedforward.init(WIDTHS, jrnd.PRNGKey(seed + 1), True)
+        x = jrnd.normal(jrnd.PRNGKey(seed + 2), [BATCH, WIDTHS[0]], dtype=jnp.float32)
+        p = optim.defaults(lr=jnp.array(0.01, dtype=jnp.float64))
+        return w, optim.init(w, p), p, w_ideal, x, forward_pass(w_ideal, x)
+
+    def timed(f, *args) -> float:
+        block_until_ready(f(*args))  # compile
+        t0 = perf_counter()
+        for _ in range(STEPS):
+            out = f(*args)
+        block_until_ready(out)
+        return (perf_counter() - t0) / STEPS
+
+    w, s, p, w_ideal, x, y = setup(0)
+    data_parallel = jit(parallel.step_global, static_argnums=(0, 2, 5))
+    t_data = timed(
+        data_parallel, mesh, w, forward_pass, x, y, optim.update, p, s, w_ideal, power
+    )
+
+    trials = [setup(10 * i) for i in range(n * TRIALS_PER_DEVICE)]
+    stacked = tree_map(lambda *z: jnp.stack(z), *trials)
+    one_trial = lambda w, s, p, w_ideal, x, y: training.step_global(
+        w, forward_pass, x, y, optim.update, p, s, w_ideal, power
+    )
+    t_trials = timed(jit(parallel.across_trials(mesh, one_trial)), *stacked)
+
+    return {"devices": n, "data": t_data, "trials": t_trials}
+
+
+def main() -> None:
+    results = []
+    for n in DEVICE_COUNTS:
+        print(f"Measuring {n} device(s)...")
+        out = subprocess.run(
+            [sys.executable, __file__, str(n)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    base = results[0]
+    print()
+    print(f"{BATCH} examples per step split across devices (data-parallel),")
+    print(f"and {TRIALS_PER_DEVICE} independent trials per device (trial-parallel):")
+    print()
+    print("devices  data (ms/step)  efficiency  trials (ms/step)  efficiency")
+    for r in results:
+        n = r["devices"]
+        # Strong scaling: ideal is `n` times faster. Weak scaling: ideal is just as fast.
+        e_data = base["data"] / (n * r["data"])
+        e_trials = base["trials"] / r["trials"]
+        print(
+            f"{n:>7}  {1000 * r['data']:>14.2f}  {e_data:>10.0%}"
+            f"  {1000 * r['trials']:>16.2f}  {e_trials:>10.0%}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        print(json.dumps(measure(int(sys.argv[1]))))
+    else:
+        main()
@@ -0,0 +1,63 @@
+# Optimizer state in 8 bits (`metaoptimizer.optimizers.quantized`) vs. float64:
+# how much memory it takes, and how far training drifts from the full-precision path.
+
+from metaoptimizer import feedforward, training
+from metaoptimizer.optimizers import adam, quantized, rmsprop, swiss_army_knife
+
+from jax import jit, nn as jnn, numpy as jnp, random as jrnd
+
+
+OPTIMIZERS = {"adam": adam, "rmsprop": rmsprop, "swiss_army_knife": swiss_army_knife}
+WIDTHS = (32, 64, 64, 32)
+BATCH = 64
+STEPS = 2000
+
+
+def main() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    w_ideal = feedforward.init(WIDTHS, jrnd.PRNGKey(1), True)
+    w_init = feedforward.init(WIDTHS, jrnd.PRNGKey(0), False)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    xs = jrnd.normal(jrnd.PRNGKey(2), [STEPS, BATCH, WIDTHS[0]], dtype=jnp.float32)
+
+    print(f"{STEPS} training steps of {WIDTHS} on batches of {BATCH}")
+    print()
+    print(
+        f"{'optimizer':>18}  {'state':>5}  {'bytes':>8}  {'final loss':>10}"
+        f"  {'final distance':>14}  {'|w - w_f64|':>11}"
+    )
+    for name, optim in OPTIMIZERS.items():
+        finals = {}
+        for kind, update, init in [
+            ("f64", optim.update, optim.init),
+            ("8-bit", quantized.wrap(optim.update), quantized.init(optim.init)),
+        ]:
+            p = optim.defaults(lr=jnp.array(0.001, dtype=jnp.float64))
+            s = init(w_init, p)
+            # (fixed `opt_params`: meta-learning them would amplify any difference)
+            step = jit(
+                lambda w, s, x, update=update: training.step(
+                    w, forward_pass, x, forward_pass(w_ideal, x), update, p, s, power
+                )
+            )
+            w = w_init
+            losses = []
+            for x in xs:
+                w, s, L = step(w, s, x)
+                losses.append(L)
+            finals[kind] = w
+            loss = float(jnp.mean(jnp.stack(losses[-STEPS // 100 :])))
+            distance = sum(
+                [float(jnp.sum(jnp.abs(a - b))) for a, b in zip(w.W, w_ideal.W)]
+            )
+            drift = sum(
+                [float(jnp.sum(jnp.abs(a - b))) for a, b in zip(w.W, finals["f64"].W)]
+            )
+            print(
+                f"{name:>18}  {kind:>5}  {quantized.nbytes(s):>8}  {loss:>10.4g}"
+                f"  {distance:>14.4g}  {drift:>11.3g}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -89,6 +89,18 @@
               ${python} -m coverage run --omit='/nix/*' -m pytest -Werror test.py
               ${python} -m coverage report -m --fail-under=100
             '';
+          benchmark-downhill = ''
+            ${python-with [ default-pkgs ]} $out/benchmark-downhill.py
+          '';
+          benchmark-line-search = ''
+            ${python-with [ default-pkgs ]} $out/benchmark-line-search.py
+          '';
+          benchmark-parallel = ''
+            ${python-with [ default-pkgs ]} $out/benchmark-parallel.py
+          '';
+          benchmark-quantized = ''
+            ${python-with [ default-pkgs ]} $out/benchmark-quantized.py
+          '';
           default = ''
             ${python-with [ default-pkgs ]} $out/main.py
           '';
@@ -98,6 +110,9 @@
           plot-convergence = ''
             ${python-with [ default-pkgs ]} $out/plot-convergence.py
           '';
+          tune = ''
+            ${python-with [ default-pkgs ]} $out/tune.py
+          '';
         };
       in
       {
@@ -3,7 +3,7 @@ print("Importing libraries...")
 
 import plot  # Relative import: `plot.py`
 
-from metaoptimizer import feedforward, trial
+from metaoptimizer import checkpoint, feedforward, saving, trial
 
 from jax import nn as jnn, numpy as jnp, random as jrnd
 
@@ -20,13 +20,16 @@ POWER = jnp.array(2.0, dtype=jnp.float32)  # e.g. 1 for L1 loss, 2 for L2, etc.
 # TODO: make `POWER` learnable
 TRAINING_STEPS = 10000
 INITIAL_DISTANCE = jnp.array(0.5, dtype=jnp.float64)
+# If this gets killed, running it again picks up from the last checkpoint:
+CHECKPOINTS = "checkpoints"
+CHECKPOINT_EVERY = 1000
 from metaoptimizer.optimizers import (
     adam as optim,
     # sgd as optim,
     # swiss_army_knife as optim,
 )
 
-forward_pass = lambda weights, x: feedforward.run(weights, x, NONLINEARITY)
+forward_pass = feedforward.forward_pass(NONLINEARITY)
 shapes = tuple([NDIM for _ in range(LAYERS + 1)])
 w_example = feedforward.init(shapes, jrnd.PRNGKey(42), False)
 optimizer = optim.update
@@ -53,9 +56,18 @@ trial.run(
     POWER,
     INITIAL_DISTANCE,
     "",
+    checkpoint_dir=CHECKPOINTS,
+    checkpoint_every=CHECKPOINT_EVERY,
 )
 
 
+print("Waiting for everything to be saved...")
+
+
+saving.wait()
+checkpoint.clear(CHECKPOINTS)
+
+
 print("Plotting...")
 
 
@@ -0,0 +1,192 @@
+from beartype import beartype
+from beartype.typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from contextlib import contextmanager
+from jaxtyping import jaxtyped, Bool, Float64, Int64
+import fcntl
+import numpy as np
+import os
+
+
+# Per-grid-cell running statistics, updated as each trial finishes,
+# so summaries never have to re-read the trials themselves.
+EXTENSION = ".aggregates.npz"
+
+# Quantile sketch: log-spaced buckets, so any quantile is within
+# `RELATIVE_ACCURACY` of the truth (cf. DDSketch), in constant memory.
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+SKETCH_MIN = 1e-12
+SKETCH_MAX = 1e12
+# [0]: zero (or below `SKETCH_MIN`), [-1]: non-finite, in between: log buckets
+SKETCH_BUCKETS = int(np.ceil(np.log(SKETCH_MAX / SKETCH_MIN) / np.log(GAMMA))) + 2
+
+
+class CellKey(NamedTuple):
+    layers: int
+    ndim: int
+    distance: float
+
+
+class Cell(NamedTuple):
+    trials: List[str]  # which trials are already counted (so updates are idempotent)
+    converged: int
+    # Welford's algorithm, step-by-step over loss curves
+    # (counted per step, since curves can stop early, & only where finite,
+    # since diverged trials are already counted in `final_loss`):
+    counts: Int64[np.ndarray, "steps"]
+    mean: Float64[np.ndarray, "steps"]
+    m2: Float64[np.ndarray, "steps"]
+    final_loss: Int64[np.ndarray, "buckets"]
+    final_distance: Int64[np.ndarray, "buckets"]
+
+
+@jaxtyped(typechecker=beartype)
+def empty() -> Cell:
+    return Cell(
+        trials=[],
+        converged=0,
+        counts=np.zeros([0], dtype=np.int64),
+        mean=np.zeros([0], dtype=np.float64),
+        m2=np.zeros([0], dtype=np.float64),
+        final_loss=np.zeros([SKETCH_BUCKETS], dtype=np.int64),
+        final_distance=np.zeros([SKETCH_BUCKETS], dtype=np.int64),
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def bucket(x: float) -> int:
+    if not np.isfinite(x):
+        return SKETCH_BUCKETS - 1
+    x = abs(x)
+    if x < SKETCH_MIN:
+        return 0
+    i = int(np.ceil(np.log(min(x, SKETCH_MAX) / SKETCH_MIN) / np.log(GAMMA)))
+    return min(1 + i, SKETCH_BUCKETS - 2)
+
+
+@jaxtyped(typechecker=beartype)
+def quantile(sketch: Int64[np.ndarray, "buckets"], q: float) -> float:
+    n = int(np.sum(sketch))
+    if n == 0:
+        return float("nan")
+    i = int(np.searchsorted(np.cumsum(sketch), q * (n - 1), side="right"))
+    if i == 0:
+        return 0.0
+    if i >= SKETCH_BUCKETS - 1:
+        return float("inf")
+    # Midpoint (in relative terms) of `(gamma^(i - 2), gamma^(i - 1)]`:
+    return float(SKETCH_MIN * 2 * GAMMA ** (i - 1) / (GAMMA + 1))
+
+
+@jaxtyped(typechecker=beartype)
+def add(
+    cell: Cell,
+    trial: str,
+    losses: Float64[np.ndarray, "steps"],
+    final_distance: float,
+    converged: bool,
+) -> Cell:
+    if trial in cell.trials:
+        return cell
+    n = max(cell.counts.shape[0], losses.shape[0])
+    grow = lambda x: np.pad(x, (0, n - x.shape[0]))
+    count, mean, m2 = grow(cell.counts), grow(cell.mean), grow(cell.m2)
+    steps = losses.shape[0]
+    finite = np.isfinite(losses)
+    count[:steps] += finite
+    delta = np.where(finite, losses - mean[:steps], 0.0)
+    mean[:steps] += delta / np.maximum(count[:steps], 1)
+    m2[:steps] += delta * np.where(finite, losses - mean[:steps], 0.0)
+    final_loss = cell.final_loss.copy()
+    final_loss[bucket(float(losses[-1]) if steps else float("nan"))] += 1
+    final_dist = cell.final_distance.copy()
+    final_dist[bucket(final_distance)] += 1
+    return Cell(
+        trials=[*cell.trials, trial],
+        converged=cell.converged + int(converged),
+        counts=count,
+        mean=mean,
+        m2=m2,
+        final_loss=final_loss,
+        final_distance=final_dist,
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def variance(cell: Cell) -> Float64[np.ndarray, "steps"]:
+    return cell.m2 / np.maximum(cell.counts - 1, 1)
+
+
+@jaxtyped(typechecker=beartype)
+def convergence(cell: Cell) -> float:
+    return cell.converged / len(cell.trials) if cell.trials else float("nan")
+
+
+@jaxtyped(typechecker=beartype)
+def load(path: str) -> Dict[CellKey, Cell]:
+    if not os.path.isfile(path):
+        return {}
+    cells = {}
+    with np.load(path, allow_pickle=False) as f:
+        for i, (layers, ndim, distance) in enumerate(f["keys"]):
+            p = f"{i}/"
+            cells[CellKey(int(layers), int(ndim), float(distance))] = Cell(
+                trials=[str(t) for t in f[p + "trials"]],
+                converged=int(f[p + "converged"]),
+                counts=f[p + "counts"],
+                mean=f[p + "mean"],
+                m2=f[p + "m2"],
+                final_loss=f[p + "final_loss"],
+                final_distance=f[p + "final_distance"],
+            )
+    return cells
+
+
+@jaxtyped(typechecker=beartype)
+def save(path: str, cells: Dict[CellKey, Cell]) -> None:
+    arrays: Dict[str, Any] = {
+        "keys": np.array([list(k) for k in cells], dtype=np.float64)
+    }
+    for i, cell in enumerate(cells.values()):
+        p = f"{i}/"
+        arrays[p + "trials"] = np.array(cell.trials, dtype=np.str_)
+        arrays[p + "converged"] = np.array(cell.converged)
+        arrays[p + "counts"] = cell.counts
+        arrays[p + "mean"] = cell.mean
+        arrays[p + "m2"] = cell.m2
+        arrays[p + "final_loss"] = cell.final_loss
+        arrays[p + "final_distance"] = cell.final_distance
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def locked(path: str):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@jaxtyped(typechecker=beartype)
+def update(
+    path: str,
+    key: CellKey,
+    trial: str,
+    losses: Float64[np.ndarray, "steps"],
+    final_distance: float,
+    converged: bool,
+) -> None:
+    """Fold one finished trial into its cell (safe to call from many processes)."""
+    with locked(path):
+        cells = load(path)
+        cells[key] = add(
+            cells.get(key, empty()), trial, losses, final_distance, converged
+        )
+        save(path, cells)
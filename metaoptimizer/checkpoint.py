@@ -0,0 +1,206 @@
+from metaoptimizer import metrics, saving, stopping
+from metaoptimizer.optimizers import OptParams, OptState
+from metaoptimizer.weights import Weights
+
+from beartype import beartype
+from beartype.typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from jax import numpy as jnp
+from jax.tree_util import (
+    tree_flatten,
+    tree_leaves,
+    tree_map,
+    tree_structure,
+    tree_unflatten,
+)
+from jaxtyping import jaxtyped, Array, Float32, PyTree, UInt32
+import numpy as np
+import os
+import shutil
+import zlib
+
+
+# Periodic snapshots of a running trial, so a killed process loses at most
+# `CHECKPOINT_EVERY` steps instead of everything.
+# Each snapshot is its own directory, `step-<n>`, written in the background
+# and renamed into place (see `saving.write_directory`), holding the full state
+# at step `n` but only the *new* history since the snapshot before it
+# (so the cost of each one doesn't grow with the trial). Resuming takes the
+# latest snapshot whose predecessors are all there too, & only if it's the same
+# setup (see `fingerprint`): a fixed directory reused after changing, e.g., the
+# optimizer or the learning rate must not silently pick up someone else's state.
+CHECKPOINT_EVERY = 10000
+PREFIX = "step-"
+
+
+class Progress(NamedTuple):
+    # Everything `trial.run` needs to pick a trial back up where it left off
+    # (e.g. to give it a longer budget, cf. `scheduler`, or after a crash):
+    steps: int
+    block_steps: int  # (so resumed data continues the same stream)
+    w: Weights
+    opt_state: OptState
+    opt_params: OptParams
+    permutation: List[UInt32[Array, "_n"]]
+    stop: stopping.State
+    # Histories so far, one entry per step (`None` if not tracked):
+    losses: Optional[List[Float32[Array, ""]]]
+    metrics: List[metrics.Metrics]
+    permutations: Optional[List[List[UInt32[Array, "_n"]]]]
+    opt_params_hist: Optional[List[OptParams]]
+    w_hist: Optional[List[List[Float32[Array, "_n_out _n_in"]]]]
+    b_hist: Optional[List[List[Float32[Array, "_n_out"]]]]
+
+
+# The histories, in the order they're saved:
+HISTORIES = ("losses", "metrics", "permutations", "opt_params_hist", "w_hist", "b_hist")
+
+
+@jaxtyped(typechecker=beartype)
+def state(p: Progress) -> Any:
+    return (p.w, p.opt_state, p.opt_params, p.permutation, p.stop)
+
+
+@jaxtyped(typechecker=beartype)
+def fingerprint(initial: Progress) -> str:
+    """
+    What a trial's checkpoints must match to be resumed: the structure, shapes
+    & dtypes of its state (so the optimizer & the architecture),
+    & the values of its starting `opt_params` (e.g. the learning rate).
+    """
+    leaves = tree_leaves(state(initial))
+    described = [str(tree_structure(state(initial)))]
+    described += [f"{x.shape}{x.dtype}" for x in leaves]
+    values = [np.asarray(x).tobytes() for x in tree_leaves(initial.opt_params)]
+    return (
+        f"{zlib.crc32(' '.join(described).encode()):08x}"
+        f"-{zlib.crc32(b''.join(values)):08x}"
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def save(
+    directory: str, progress: Progress, first: int, key: Array, setup: str
+) -> Dict[str, Any]:
+    """
+    Queue a snapshot of `progress` (with history from step `first` on),
+    from a trial whose `fingerprint` is `setup`.
+    On this thread, only a handful of device ops: the rest is in the background.
+    Returns the new history, stacked (so the trial needn't stack it again).
+    """
+    assert progress.steps > first, f"Nothing new since step {first}"
+    arrays: Dict[str, Any] = {
+        "steps.npy": np.array(progress.steps),
+        "first.npy": np.array(first),
+        "block_steps.npy": np.array(progress.block_steps),
+        "key.npy": key,
+        "setup.npy": np.array(setup),
+        "metric_names.npy": np.array(
+            sorted(progress.metrics[0]) if progress.metrics else [], dtype=np.str_
+        ),
+    }
+    for i, x in enumerate(tree_flatten(state(progress))[0]):
+        arrays[f"state/{i}.npy"] = x
+    stacked = {}
+    for name in HISTORIES:
+        h = getattr(progress, name)
+        if h:
+            stacked[name] = saving.stack(h[first:])
+            for i, x in enumerate(tree_flatten(stacked[name])[0]):
+                arrays[f"{name}/{i}.npy"] = x
+    saving.save(os.path.join(directory, f"{PREFIX}{progress.steps}"), arrays)
+    return stacked
+
+
+@jaxtyped(typechecker=beartype)
+def chain(directory: str) -> List[str]:
+    """Snapshots, oldest first, up to the first gap (e.g. a write that never finished)."""
+    if not os.path.isdir(directory):
+        return []
+    found: Dict[int, Tuple[int, str]] = {}  # first step -> (last step, directory)
+    for d in os.listdir(directory):
+        n = d[len(PREFIX) :]
+        if d.startswith(PREFIX) and n.isdigit():  # (not `*.tmp-*`: half-written)
+            path = os.path.join(directory, d)
+            first = int(np.load(os.path.join(path, "first.npy")))
+            if first not in found or int(n) > found[first][0]:
+                found[first] = (int(n), path)
+    out = []
+    step = 0
+    while step in found:
+        step, path = found[step]
+        out.append(path)
+    return out
+
+
+@jaxtyped(typechecker=beartype)
+def load(directory: str, key: Array, like: Progress) -> Optional[Progress]:
+    """
+    The latest complete snapshot (`None` if there's none yet), structured like `like`,
+    a fresh trial's initial `Progress` (with empty histories), which it must match.
+    """
+    snapshots = chain(directory)
+    if not snapshots:
+        return None
+    last = snapshots[-1]
+    read = lambda d, name: np.load(os.path.join(d, name), allow_pickle=False)
+    saved_key = read(last, "key.npy")
+    assert np.array_equal(
+        saved_key, np.asarray(key)
+    ), f"`{directory}` is a checkpoint of a different trial (key {saved_key})"
+    saved_setup, setup = str(read(last, "setup.npy")), fingerprint(like)
+    assert saved_setup == setup, (
+        f"`{directory}` is a checkpoint of a different setup ({saved_setup}, not"
+        f" {setup}: a different optimizer, architecture or `opt_params`?)"
+    )
+    structure = tree_structure(state(like))
+    n = len(tree_leaves(state(like)))
+    leaves = [jnp.asarray(read(last, f"state/{i}.npy")) for i in range(n)]
+    w, opt_state, opt_params, permutation, stop = tree_unflatten(structure, leaves)
+
+    # Histories stay on the host (a view per step) until the trial stacks them:
+    def history(name: str, example: Any) -> Optional[List[Any]]:
+        if getattr(like, name) is None:
+            return None
+        structure = tree_structure(example)
+        n = len(tree_leaves(example))
+        segments = [
+            [read(d, f"{name}/{i}.npy") for i in range(n)]
+            for d in snapshots
+            if os.path.isdir(os.path.join(d, name))
+        ]
+        columns = [np.concatenate(leaf) for leaf in zip(*segments)]
+        steps = columns[0].shape[0] if columns else 0
+        return [
+            tree_unflatten(structure, [c[i] for c in columns]) for i in range(steps)
+        ]
+
+    examples = {
+        "losses": 0,
+        "metrics": {str(k): 0 for k in read(last, "metric_names.npy")},
+        "permutations": permutation,
+        "opt_params_hist": opt_params,
+        "w_hist": w.W,
+        "b_hist": w.B,
+    }
+    h = {name: history(name, examples[name]) for name in HISTORIES}
+    return Progress(
+        steps=int(read(last, "steps.npy")),
+        block_steps=int(read(last, "block_steps.npy")),
+        w=w,
+        opt_state=opt_state,
+        opt_params=opt_params,
+        permutation=permutation,
+        stop=stop,
+        losses=h["losses"],
+        metrics=h["metrics"] or [],
+        permutations=h["permutations"],
+        opt_params_hist=h["opt_params_hist"],
+        w_hist=h["w_hist"],
+        b_hist=h["b_hist"],
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def clear(directory: str) -> None:
+    """Once a trial's results are safely saved (cf. `saving.wait`)."""
+    shutil.rmtree(directory, ignore_errors=True)
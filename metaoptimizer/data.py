@@ -0,0 +1,140 @@
+from metaoptimizer.training import ForwardPass
+from metaoptimizer.weights import Weights
+
+from beartype import beartype
+from beartype.typing import Iterator, List, NamedTuple, Optional, Tuple
+from check_and_compile import check_and_compile
+from functools import lru_cache
+from jax import device_put, named_scope, numpy as jnp, random as jrnd
+from jax.sharding import Sharding
+from jaxtyping import jaxtyped, Array, Float32, UInt32
+import numpy as np
+import os
+
+
+# Teacher-student data: random inputs `x`, and the teacher's (`w_ideal`'s) outputs `y`.
+# Made (or loaded) a block of many steps at a time, and always one block ahead,
+# so by the time a step needs its batch, it's already on the device.
+# (JAX dispatches asynchronously, so "one block ahead" just means "enqueued early".)
+# Steps index into their block themselves (see `trial.step`): splitting a block
+# into per-step arrays would cost either a dispatch per step or a huge compile.
+
+# Steps per block, unless the caller knows better:
+BLOCK_STEPS = 1000
+
+
+class Block(NamedTuple):
+    x: Float32[Array, "steps batch ndim_in"]
+    y: Float32[Array, "steps batch ndim_out"]
+
+
+@lru_cache
+def indices(n: int) -> List[UInt32[Array, ""]]:
+    # On the device once, instead of a tiny transfer every step:
+    return [jnp.array(i, dtype=jnp.uint32) for i in range(n)]
+
+
+@check_and_compile(2, 3, 4, 5)
+def generate(
+    key: UInt32[Array, "n_keys"],
+    w_ideal: Weights,
+    steps: int,
+    batch: int,
+    ndim: int,
+    forward_pass: ForwardPass,
+) -> Block:
+    with named_scope("teacher"):
+        x = jrnd.normal(key, [steps * batch, ndim], dtype=jnp.float32)
+        # One batched teacher pass for every step in the block:
+        y = forward_pass(w_ideal, x)
+    return Block(x=x.reshape(steps, batch, -1), y=y.reshape(steps, batch, -1))
+
+
+@jaxtyped(typechecker=beartype)
+def stream(
+    key: UInt32[Array, "n_keys"],
+    w_ideal: Weights,
+    batch: int,
+    ndim: int,
+    forward_pass: ForwardPass,
+    block_steps: int = BLOCK_STEPS,
+    sharding: Optional[Sharding] = None,
+    start: int = 0,
+) -> Iterator[Tuple[Block, UInt32[Array, ""]]]:
+    """
+    Endless fresh batches, generated `block_steps` at a time
+    (and placed according to `sharding`, if any; cf. `parallel.sharded`),
+    beginning with step `start` (e.g. to resume a trial).
+    """
+
+    def make(n: int) -> Block:
+        # Each block's key depends only on its index, so resuming can skip ahead:
+        k = jrnd.fold_in(key, n)
+        block = generate(k, w_ideal, block_steps, batch, ndim, forward_pass)
+        return block if sharding is None else device_put(block, sharding)
+
+    n, offset = divmod(start, block_steps)
+    ahead = make(n)
+    while True:
+        current = ahead
+        n += 1
+        ahead = make(n)
+        for i in indices(block_steps)[offset:]:
+            yield current, i
+        offset = 0
+
+
+@jaxtyped(typechecker=beartype)
+def save(directory: str, x: np.ndarray, y: np.ndarray) -> None:
+    """Write a fixed dataset (`[examples, ndim]` each) for `finite`."""
+    assert x.shape[0] == y.shape[0], f"{x.shape[0]} inputs but {y.shape[0]} outputs"
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "x.npy"), x.astype(np.float32))
+    np.save(os.path.join(directory, "y.npy"), y.astype(np.float32))
+
+
+@jaxtyped(typechecker=beartype)
+def load(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    # Memory-mapped: only the block being transferred is ever read from disk.
+    return (
+        np.load(os.path.join(directory, "x.npy"), mmap_mode="r"),
+        np.load(os.path.join(directory, "y.npy"), mmap_mode="r"),
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def finite(
+    directory: str,
+    batch: int,
+    block_steps: int = BLOCK_STEPS,
+    sharding: Optional[Sharding] = None,
+    start: int = 0,
+) -> Iterator[Tuple[Block, UInt32[Array, ""]]]:
+    """
+    Batches from a fixed dataset (see `save`), in order, epoch after epoch
+    (a trailing partial batch is dropped), transferred `block_steps` at a time,
+    beginning with step `start`.
+    """
+    x, y = load(directory)
+    steps = x.shape[0] // batch
+    assert steps > 0, f"`{directory}` has fewer than {batch} examples"
+
+    def put(first: int) -> Block:
+        # Blocks wrap around epochs, so they're all the same shape (one compile):
+        s = (first + np.arange(block_steps)) % steps
+        rows = (s[:, np.newaxis] * batch + np.arange(batch)).ravel()
+        return Block(
+            x=device_put(x[rows].reshape(block_steps, batch, -1), sharding),
+            y=device_put(y[rows].reshape(block_steps, batch, -1), sharding),
+        )
+
+    n, offset = divmod(start, block_steps)
+    first = (n * block_steps) % steps
+    ahead = put(first)
+    while True:
+        current = ahead
+        first = (first + block_steps) % steps
+        ahead = put(first)
+        for i in indices(block_steps)[offset:]:
+            yield current, i
+        offset = 0
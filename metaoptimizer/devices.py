@@ -0,0 +1,27 @@
+from beartype import beartype
+from jax import config
+from jaxtyping import jaxtyped
+import os
+
+
+# JAX sees a CPU as one device, however many cores it has.
+# XLA can pretend it's several, but only if told so before JAX starts its backend,
+# i.e. before the first array is made (which importing most of this package does!),
+# so this module deliberately imports nothing else from `metaoptimizer`.
+FLAG = (
+    "--xla_force_host_platform_device_count"  # (for JAX without `jax_num_cpu_devices`)
+)
+
+
+@jaxtyped(typechecker=beartype)
+def force_host_devices(n: int) -> None:
+    """Split the host CPU into `n` devices (cf. `parallel`). Call first thing."""
+    try:
+        config.update("jax_num_cpu_devices", n)
+        return
+    except AttributeError:
+        pass
+    flags = [
+        f for f in os.environ.get("XLA_FLAGS", "").split() if not f.startswith(FLAG)
+    ]
+    os.environ["XLA_FLAGS"] = " ".join([*flags, f"{FLAG}={n}"])
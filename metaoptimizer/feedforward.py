@@ -3,6 +3,7 @@ from metaoptimizer.weights import Weights
 from beartype import beartype
 from beartype.typing import Callable, Tuple
 from check_and_compile import check_and_compile
+from functools import lru_cache, partial
 from jax import nn as jnn, numpy as jnp, random as jrnd
 from jax.numpy import linalg as jla
 from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree, UInt32
@@ -50,6 +51,17 @@ def run(
     return x
 
 
+@lru_cache
+def forward_pass(
+    nl: Callable[[Float32[Array, "..."]], Float32[Array, "..."]] = jnn.gelu,
+) -> Callable[[Weights, Float32[Array, "batch n_in"]], Float32[Array, "batch n_out"]]:
+    """
+    `run` with `nl` baked in: always the *same* function for the same `nl`,
+    so passing it as a static argument never forces a recompile (cf. `tracing`).
+    """
+    return partial(run, nl=nl)
+
+
 @jaxtyped(typechecker=beartype)
 def init(sizes: Tuple, key: KeyArray, random_biases: bool) -> Weights:
     n = len(sizes)
@@ -66,4 +78,4 @@ def init(sizes: Tuple, key: KeyArray, random_biases: bool) -> Weights:
         else:
             B.append(jnp.zeros([size], dtype=jnp.float64))
         W.append(he(k, [size, sizes[i - 1]], dtype=jnp.float64))
-    return Weights(W=jnp.stack(W), B=jnp.stack(B))
+    return Weights(W=W, B=B)
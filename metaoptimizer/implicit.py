@@ -0,0 +1,128 @@
+from metaoptimizer import training
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
+from metaoptimizer.weights import sizes, Weights
+
+from beartype import beartype
+from beartype.typing import Tuple
+from check_and_compile import check_and_compile
+from jax import jvp, lax, named_scope, numpy as jnp, random as jrnd, vjp
+from jax.scipy.sparse.linalg import cg
+from jax.tree_util import tree_map
+from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree
+
+
+# Meta-gradients by the implicit function theorem, instead of one step ahead
+# (cf. `training.meta_step`) or by unrolling every inner step:
+# once the weights have (roughly) converged to a fixed point of the update,
+#   w* = U(opt_params, w*)  (U: the optimizer's step on the loss gradient),
+# then `(I - dU/dw) dw*/dp = dU/dp`, so for any objective `O(w*)`,
+#   dO/dp = v^T dU/dp, where `(I - dU/dw)^T v = dO/dw`.
+# `v` comes from conjugate gradients on Hessian-vector products only
+# (`dU/dw` has the loss Hessian inside), so memory depends on the size of the weights,
+# never on how many inner steps it took to get there.
+# `I - dU/dw` isn't symmetric for most optimizers (e.g. with a preconditioner),
+# so CG solves the normal equations `A A^T v = A dO/dw` (with `A = I - dU/dw`),
+# which are symmetric & positive definite whatever the optimizer.
+# Optimizer state is held fixed at its converged value (as if it were a constant).
+
+MAXITER = 50
+# Added to `A A^T` (directions the update ignores would make it singular):
+DAMPING = 1e-6
+
+
+@jaxtyped(typechecker=beartype)
+def hypergradient(
+    weights: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    optim_parameterized: Optimizer,
+    opt_params: OptParams,
+    opt_state: OptState,
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    maxiter: int = MAXITER,
+    damping: float = DAMPING,
+) -> Tuple[OptParams, Float32[Array, ""]]:
+    """
+    d(loss at `weights`)/d(`opt_params`), with `weights` taken as a fixed point
+    of the optimizer's update on this batch. Also returns that loss.
+    """
+
+    def update(w, p):
+        dLdw = training.loss_and_grad(w, forward_pass, inputs, ground_truth, power)[1]
+        return optim_parameterized(p, opt_state, w, dLdw)[1]
+
+    L, dOdw = training.loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
+    with named_scope("implicit_solve"):
+        _, U_T = vjp(lambda w: update(w, opt_params), weights)
+        # `A^T x` & `A x`, each a Hessian-vector product (no tape beyond one step's):
+        A_T = lambda x: tree_map(lambda a, b: a - b, x, U_T(x)[0])
+        A = lambda x: tree_map(
+            lambda a, b: a - b,
+            x,
+            jvp(lambda w: update(w, opt_params), (weights,), (x,))[1],
+        )
+        normal = lambda x: tree_map(lambda a, b: a + damping * b, A(A_T(x)), x)
+        v, _ = cg(normal, A(dOdw), maxiter=maxiter)
+    with named_scope("implicit_hypergradient"):
+        _, U_p = vjp(lambda p: update(weights, p), opt_params)
+        (dOdp,) = U_p(v)
+    return dOdp, L
+
+
+@check_and_compile(5, 6, 7, 8, 11, 12)
+def meta_step(
+    weights: PyTree[Float64[Array, "..."]],
+    opt_state: OptState,
+    opt_params: OptParams,
+    w_ideal: Weights,
+    key: Array,
+    inner_steps: int,
+    batch: int,
+    forward_pass: ForwardPass,
+    optimizer: Optimizer,
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    meta_lr: Float64[Array, ""] = training.OPTIMIZER_LR,
+    maxiter: int = MAXITER,
+    damping: float = DAMPING,
+) -> Tuple[
+    PyTree[Float64[Array, "..."]],
+    OptState,
+    OptParams,
+    Float32[Array, ""],
+]:
+    """
+    `inner_steps` plain steps (a loop, not unrolled: nothing is kept for backprop)
+    on fresh teacher data, then one implicit meta-gradient step on `opt_params`
+    (at a fresh batch). Returns the new weights, state & `opt_params`, and that loss.
+    The loss is a sum over the batch, so its hypergradient can be big: cf. `meta_lr`.
+    """
+
+    def teacher(i):
+        x = jrnd.normal(
+            jrnd.fold_in(key, i), [batch, sizes(w_ideal)[0]], dtype=jnp.float32
+        )
+        return x, forward_pass(w_ideal, x)
+
+    def inner(i, carry):
+        w, s = carry
+        x, y = teacher(i)
+        w, s, _ = training.step(w, forward_pass, x, y, optimizer, opt_params, s, power)
+        return w, s
+
+    weights, opt_state = lax.fori_loop(0, inner_steps, inner, (weights, opt_state))
+    x, y = teacher(inner_steps)
+    dOdp, L = hypergradient(
+        weights,
+        forward_pass,
+        x,
+        y,
+        optimizer,
+        opt_params,
+        opt_state,
+        power,
+        maxiter,
+        damping,
+    )
+    opt_params = tree_map(lambda p, d: p - meta_lr * d, opt_params, dOdp)
+    return weights, opt_state, opt_params, L
@@ -0,0 +1,88 @@
+from metaoptimizer import training
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
+
+from beartype import beartype
+from beartype.typing import NamedTuple, Tuple
+from check_and_compile import check_and_compile
+from jax import named_scope, numpy as jnp, vmap
+from jax.tree_util import tree_map
+from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree
+import operator
+
+
+# Step sizes by line search along whatever update the optimizer proposes
+# (`w' - w`, for any `Optimizer`), instead of a sweep of whole trials, one per `lr`:
+# the loss at `w + t (w' - w)` for every candidate scale `t` comes from one `vmap`,
+# i.e. one batched forward pass for all of them, compiled together with the step.
+# `t = 1` is the optimizer's own step, so the best never does worse on this batch;
+# the biggest candidate bounds how far a step can go (a crude trust region).
+# Candidates are relative to the current `lr`, so the chosen scales over a few
+# hundred steps say which way (& roughly how far) to move it before meta-learning.
+SCALES = jnp.exp2(jnp.arange(-4, 5, dtype=jnp.float64))
+
+
+class Search(NamedTuple):
+    losses: Float32[Array, "k"]  # at each candidate scale
+    scale: Float64[Array, ""]  # the best one
+
+
+@jaxtyped(typechecker=beartype)
+def search(
+    weights: PyTree[Float64[Array, "..."]],
+    proposed: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    scales: Float64[Array, "k"] = SCALES,
+) -> Search:
+    direction = tree_map(operator.sub, proposed, weights)
+
+    def at(t: Float64[Array, ""]) -> Float32[Array, ""]:
+        w = tree_map(lambda wi, di: wi + t * di, weights, direction)
+        return training.loss(w, forward_pass, inputs, ground_truth, power)
+
+    losses = vmap(at)(scales)
+    # (diverged candidates never win)
+    best = jnp.argmin(jnp.where(jnp.isfinite(losses), losses, jnp.inf))
+    return Search(losses=losses, scale=scales[best])
+
+
+# @check_and_compile(1, 4, 9)
+@jaxtyped(typechecker=beartype)
+def step(
+    weights: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    optim_parameterized: Optimizer,
+    opt_params: OptParams,
+    opt_state: OptState,
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    scales: Float64[Array, "k"] = SCALES,
+    apply: bool = True,
+) -> Tuple[
+    PyTree[Float64[Array, "..."]],
+    OptState,
+    Float32[Array, ""],
+    Search,
+]:
+    """
+    Like `training.step`, but also searching `scales` of the optimizer's update,
+    & taking the best one if `apply` (otherwise the optimizer's own step).
+    State is always the optimizer's own (e.g. momentum doesn't know about the scale).
+    """
+    L, dLdw = training.loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
+    opt_state_adjusted, proposed = optim_parameterized(
+        opt_params, opt_state, weights, dLdw
+    )
+    with named_scope("line_search"):
+        found = search(
+            weights, proposed, forward_pass, inputs, ground_truth, power, scales
+        )
+    weights_adjusted = (
+        tree_map(lambda w, p: w + found.scale * (p - w), weights, proposed)
+        if apply
+        else proposed
+    )
+    return weights_adjusted, opt_state_adjusted, L, found
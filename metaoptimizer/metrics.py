@@ -0,0 +1,114 @@
+from metaoptimizer import permutations
+from metaoptimizer.weights import wb, Weights
+
+from beartype import beartype
+from beartype.typing import Dict, List, Optional, Tuple
+from check_and_compile import check_and_compile
+from jax import numpy as jnp
+from jaxtyping import jaxtyped, Array, Float32, UInt32
+
+
+# Every metric is one value per layer, so a step's metrics stack into `[layers]`.
+# L1 distance from the goal, as in the original `weight_distances` logs:
+LAYER_DISTANCES = "layer_distances"
+# Same, but after permuting hidden units of the goal to best match (cf. `permutations`):
+PERMUTED_DISTANCES = "permuted_distances"
+# L2 norm of the loss gradient:
+GRAD_NORMS = "grad_norms"
+# L2 norm of the step the optimizer actually took:
+UPDATE_NORMS = "update_norms"
+# From each example's gradient separately (see `training.map_example_grads`),
+# mean & max of their L2 norms:
+EXAMPLE_GRAD_NORMS = "example_grad_norms"
+MAX_EXAMPLE_GRAD_NORMS = "max_example_grad_norms"
+# & the gradient noise scale (McCandlish et al., "An Empirical Model of Large-Batch
+# Training"), `tr(covariance) / |mean|^2` of per-example gradients: roughly the batch
+# size past which bigger batches stop helping. Both parts are unbiased estimates,
+# & one step's ratio is noisy, so averaging each over steps before dividing is better:
+NOISE_SCALES = "noise_scales"
+GRAD_VARIANCES = "grad_variances"  # tr(covariance)
+GRAD_SIGNALS = "grad_signals"  # |mean|^2
+PER_EXAMPLE = (
+    EXAMPLE_GRAD_NORMS,
+    MAX_EXAMPLE_GRAD_NORMS,
+    NOISE_SCALES,
+    GRAD_VARIANCES,
+    GRAD_SIGNALS,
+)
+ALL = (LAYER_DISTANCES, PERMUTED_DISTANCES, GRAD_NORMS, UPDATE_NORMS, *PER_EXAMPLE)
+
+Metrics = Dict[str, Float32[Array, "layers"]]
+
+
+# @check_and_compile(0)
+@jaxtyped(typechecker=beartype)
+def compute(
+    metric_set: Tuple[str, ...],
+    before: Weights,
+    after: Weights,
+    ideal: Weights,
+    permutation: List[UInt32[Array, "_n"]],
+    dLdw: Optional[Weights] = None,
+    example_sq_norms: Optional[Float32[Array, "batch layers"]] = None,
+) -> Metrics:
+    """
+    All requested metrics for one step, one value per layer
+    (no host round-trip: meant to be called inside `trial.step`).
+    `example_sq_norms` are `sq_norms` of each example's gradient.
+    """
+    unknown = set(metric_set) - set(ALL)
+    assert not unknown, f"Unknown metric(s) {unknown} (options: {ALL})"
+    # (layers can all be different shapes, so reduce each, then stack)
+    l1 = lambda xs: jnp.stack([jnp.sum(jnp.abs(x)) for x in xs])
+    l2 = lambda xs: jnp.stack([jnp.sqrt(jnp.sum(jnp.square(x))) for x in xs])
+    minus = lambda xs, ys: [x - y for x, y in zip(xs, ys)]
+    out: Metrics = {}
+    wb_after = wb(after)
+    if LAYER_DISTANCES in metric_set:
+        out[LAYER_DISTANCES] = l1(minus(wb_after, wb(ideal)))
+    if PERMUTED_DISTANCES in metric_set:
+        permuted = permutations.permute_hidden_layers(ideal, permutation)
+        out[PERMUTED_DISTANCES] = l1(minus(wb_after, wb(permuted)))
+    if GRAD_NORMS in metric_set:
+        assert dLdw is not None, f"`{GRAD_NORMS}` needs the gradient"
+        out[GRAD_NORMS] = l2(wb(dLdw))
+    if UPDATE_NORMS in metric_set:
+        out[UPDATE_NORMS] = l2(minus(wb_after, wb(before)))
+    if set(PER_EXAMPLE) & set(metric_set):
+        assert example_sq_norms is not None, "Per-example metrics need their norms"
+        out.update(per_example(metric_set, example_sq_norms, dLdw))
+    return out
+
+
+@jaxtyped(typechecker=beartype)
+def sq_norms(w: Weights) -> Float32[Array, "layers"]:
+    return jnp.stack([jnp.sum(jnp.square(x)) for x in wb(w)])
+
+
+@jaxtyped(typechecker=beartype)
+def per_example(
+    metric_set: Tuple[str, ...],
+    example_sq_norms: Float32[Array, "batch layers"],
+    dLdw: Optional[Weights],
+) -> Metrics:
+    out: Metrics = {}
+    if EXAMPLE_GRAD_NORMS in metric_set:
+        out[EXAMPLE_GRAD_NORMS] = jnp.mean(jnp.sqrt(example_sq_norms), axis=0)
+    if MAX_EXAMPLE_GRAD_NORMS in metric_set:
+        out[MAX_EXAMPLE_GRAD_NORMS] = jnp.sqrt(jnp.max(example_sq_norms, axis=0))
+    if set(metric_set) & {NOISE_SCALES, GRAD_VARIANCES, GRAD_SIGNALS}:
+        assert dLdw is not None, "The gradient noise scale needs the gradient"
+        n = example_sq_norms.shape[0]
+        assert n > 1, "The gradient noise scale needs a batch of at least 2"
+        # (the loss is a sum over the batch, so its gradient is `n` times the mean)
+        mean_sq = sq_norms(dLdw) / n**2
+        variance = (jnp.sum(example_sq_norms, axis=0) - n * mean_sq) / (n - 1)
+        signal = mean_sq - variance / n
+        for name, x in [
+            (NOISE_SCALES, variance / signal),
+            (GRAD_VARIANCES, variance),
+            (GRAD_SIGNALS, signal),
+        ]:
+            if name in metric_set:
+                out[name] = x
+    return out
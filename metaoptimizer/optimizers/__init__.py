@@ -1,15 +1,23 @@
 from beartype import beartype
-from beartype.typing import Callable, Tuple
+from beartype.typing import Callable, Tuple, Union
 from check_and_compile import check_and_compile
 from jax import numpy as jnp
 from jax.experimental.checkify import check
-from jaxtyping import jaxtyped, Array, Float, PyTree
+from jaxtyping import jaxtyped, Array, Float, Float32, Float64, Int8, PyTree
+
+
+# Usually float64 arrays the shape of the weights (& a few scalars),
+# but with 8-bit codes & their float32 scales instead if `quantized`:
+OptState = PyTree[Union[Float[Array, "..."], Int8[Array, "..."], Float32[Array, "_"]]]
+
+# Usually one scalar per hyperparameter, but one per layer or per unit if `granular`:
+OptParams = PyTree[Float64[Array, "..."]]
 
 
 # TODO: Why don't named annotations like "P" & "S" work here?
 Optimizer = Callable[
     [
-        PyTree[Float[Array, ""]],
+        PyTree[Float[Array, "..."]],
         PyTree[Float[Array, "..."]],
         PyTree[Float[Array, "..."]],
         PyTree[Float[Array, "..."]],
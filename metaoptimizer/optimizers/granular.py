@@ -0,0 +1,80 @@
+from metaoptimizer.optimizers import Optimizer, OptParams
+
+from beartype import beartype
+from beartype.typing import Any, Callable, List, Tuple
+from functools import lru_cache
+from jax import numpy as jnp
+from jax.tree_util import tree_flatten, tree_leaves, tree_map, tree_unflatten
+from jaxtyping import jaxtyped, Array, Float, PyTree
+
+
+# How finely any optimizer's hyperparameters are learned:
+# one scalar each, shared by the whole model (as usual),
+GLOBAL = "global"
+# one per array of weights (every layer's `W` & `B` separately),
+PER_LAYER = "per_layer"
+# or one per unit, i.e. per row of every array (its leading axis),
+# shaped to broadcast against it (e.g. `[n_out, 1]` against a `W` of `[n_out, n_in]`).
+PER_UNIT = "per_unit"
+GRANULARITIES = (GLOBAL, PER_LAYER, PER_UNIT)
+# Every field of an optimizer's `Params` becomes a list, one entry per array of weights
+# (in `tree_leaves` order), & `wrap(update)` runs the original update on each array
+# with its own entries (so e.g. `log_lr * moving_average` broadcasts per unit),
+# all in the same compiled step. State is per-array too (scalars like bias corrections
+# become per-layer or per-unit, since they follow the per-layer or per-unit decays).
+# Meta-gradients don't need anything special: `training.meta_step` goes through
+# whatever tree `opt_params` is (and picks reverse mode once there are many of them).
+
+
+@jaxtyped(typechecker=beartype)
+def shape(x: Float[Array, "..."], granularity: str) -> Tuple[int, ...]:
+    """The shape of one hyperparameter for the array of weights `x`."""
+    return () if granularity == PER_LAYER else (x.shape[0], *[1 for _ in x.shape[1:]])
+
+
+@jaxtyped(typechecker=beartype)
+def expand(
+    p: OptParams,
+    weights: PyTree[Float[Array, "..."]],
+    granularity: str,
+) -> OptParams:
+    """Global `opt_params` (e.g. an optimizer's `defaults`), copied out to `granularity`."""
+    assert granularity in GRANULARITIES, f"Unknown {granularity} ({GRANULARITIES})"
+    if granularity == GLOBAL:
+        return p
+    return tree_map(
+        lambda x: [
+            jnp.broadcast_to(x, shape(w, granularity)) for w in tree_leaves(weights)
+        ],
+        p,
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def split(p: OptParams) -> List[Any]:
+    """Expanded `opt_params` -> one `Params` per array of weights."""
+    fields = list(p)
+    return [type(p)(*[f[i] for f in fields]) for i in range(len(fields[0]))]
+
+
+# Cached, so the same optimizer always gets the same wrapper
+# (JAX compares static arguments like these by identity; cf. `tracing`):
+@lru_cache
+def init(original: Callable) -> Callable:
+    """An optimizer module's `init`, taking expanded `opt_params`."""
+    return lambda w, p: [original(wi, pi) for wi, pi in zip(tree_leaves(w), split(p))]
+
+
+@lru_cache
+def wrap(original: Optimizer) -> Optimizer:
+    """An optimizer module's `update`, taking expanded `opt_params`."""
+
+    def update(p, s, w, dLdw):
+        leaves, structure = tree_flatten(w)
+        out = [
+            original(pi, si, wi, di)
+            for pi, si, wi, di in zip(split(p), s, leaves, tree_leaves(dLdw))
+        ]
+        return [si for si, _ in out], tree_unflatten(structure, [wi for _, wi in out])
+
+    return update
@@ -17,8 +17,8 @@ class Params(NamedTuple):
 
 @jaxtyped(typechecker=beartype)
 class State(NamedTuple):
+    # Just the momentum buffer: the weights before overstepping are `true_weights`.
     last_update: PyTree[Float[Array, "..."]]
-    actual: PyTree[Float[Array, "..."]]
 
 
 @jaxtyped(typechecker=beartype)
@@ -36,10 +36,7 @@ def defaults(
 
 @jaxtyped(typechecker=beartype)
 def init(initial_weights: PyTree[Float[Array, "..."]], p: Params) -> State:
-    return State(
-        last_update=tree_map(jnp.zeros_like, initial_weights),
-        actual=tree_map(jnp.zeros_like, initial_weights),
-    )
+    return State(last_update=tree_map(jnp.zeros_like, initial_weights))
 
 
 # @check_and_compile()
@@ -56,6 +53,20 @@ def update(
     update = tree_map(lambda di, lu: lr * di + momentum * lu, dLdw, s.last_update)
     updated = tree_map(lambda wi, ui: wi - ui, w, update)
     return (
-        State(last_update=update, actual=updated),
+        State(last_update=update),
         tree_map(lambda wi, ui: wi - overstep * ui, updated, update),
     )
+
+
+@jaxtyped(typechecker=beartype)
+def true_weights(
+    p: Params,
+    s: State,
+    w: PyTree[Float[Array, "..."]],
+) -> PyTree[Float[Array, "..."]]:
+    """
+    The weights `update` stepped to, before overstepping
+    (from the overstepped ones it returned, e.g. to evaluate them).
+    """
+    overstep = jnp.exp(p.log_overstep)
+    return tree_map(lambda wi, ui: wi + overstep * ui, w, s.last_update)
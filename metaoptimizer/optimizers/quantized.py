@@ -0,0 +1,99 @@
+from metaoptimizer.optimizers import Optimizer
+
+from beartype import beartype
+from beartype.typing import Any, Callable, NamedTuple
+from check_and_compile import check_and_compile
+from functools import lru_cache
+from jax import numpy as jnp
+from jax.lax import stop_gradient
+from jax.tree_util import tree_leaves, tree_map
+from jaxtyping import jaxtyped, Array, Float, Float32, Int8, PyTree
+
+
+# Any optimizer's state, 8 bits per number instead of 64: every array in it
+# (moving averages & the like, each the size of the weights) is cut into blocks of
+# `BLOCK` numbers, each stored as 8-bit codes times one float32 scale per block.
+# Codes are companded (like a crude log scale), since moments span orders of magnitude
+# within a block: a code `c` means `scale * sign(c) * (|c| / LEVELS) ** COMPANDING`.
+# Scalars (e.g. bias corrections) stay as they are.
+# `wrap(update)` dequantizes, runs the original update, & quantizes again,
+# all in the same compiled step, so the full-precision state only ever exists
+# inside XLA's fused kernels.
+
+BLOCK = 256
+LEVELS = 127
+COMPANDING = 4.0
+
+
+class Quantized(NamedTuple):
+    codes: Int8[Array, "*shape"]  # (same shape as the original)
+    scales: Float32[Array, "blocks"]
+
+
+@jaxtyped(typechecker=beartype)
+def blocks(x: Array) -> Array:
+    """Flattened & zero-padded to `[blocks, BLOCK]`."""
+    flat = x.reshape(-1)
+    return jnp.pad(flat, (0, -flat.size % BLOCK)).reshape(-1, BLOCK)
+
+
+# @check_and_compile()
+@jaxtyped(typechecker=beartype)
+def quantize(x: Float[Array, "*shape"]) -> Quantized:
+    # (rounding has no useful derivative, & the power's is infinite at 0)
+    b = blocks(stop_gradient(x))
+    scales = jnp.max(jnp.abs(b), axis=-1).astype(jnp.float32)
+    safe = jnp.where(scales > 0, scales, 1)[:, jnp.newaxis]
+    c = jnp.sign(b) * LEVELS * jnp.power(jnp.abs(b) / safe, 1 / COMPANDING)
+    codes = jnp.round(c).astype(jnp.int8).reshape(-1)[: x.size].reshape(x.shape)
+    return Quantized(codes=codes, scales=scales)
+
+
+# @check_and_compile(1)
+@jaxtyped(typechecker=beartype)
+def dequantize(q: Quantized, dtype: Any = jnp.float64) -> Float[Array, "*shape"]:
+    c = blocks(q.codes).astype(dtype)
+    b = jnp.sign(c) * jnp.power(jnp.abs(c) / LEVELS, COMPANDING)
+    x = b * q.scales.astype(dtype)[:, jnp.newaxis]
+    return x.reshape(-1)[: q.codes.size].reshape(q.codes.shape)
+
+
+is_quantized = lambda x: isinstance(x, Quantized)
+
+
+@jaxtyped(typechecker=beartype)
+def compress(state: PyTree[Float[Array, "..."]]) -> PyTree[Any]:
+    return tree_map(lambda x: quantize(x) if x.ndim else x, state)
+
+
+@jaxtyped(typechecker=beartype)
+def decompress(state: PyTree[Any], dtype: Any = jnp.float64) -> PyTree[Any]:
+    return tree_map(
+        lambda x: dequantize(x, dtype) if is_quantized(x) else x,
+        state,
+        is_leaf=is_quantized,
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def nbytes(state: PyTree[Any]) -> int:
+    return sum([x.nbytes for x in tree_leaves(state)])
+
+
+# Cached, so the same optimizer always gets the same wrapper
+# (JAX compares static arguments like these by identity; cf. `tracing`):
+@lru_cache
+def init(original: Callable) -> Callable:
+    """An optimizer module's `init`, returning quantized state."""
+    return lambda w, p: compress(original(w, p))
+
+
+@lru_cache
+def wrap(original: Optimizer) -> Optimizer:
+    """An optimizer module's `update`, on quantized state."""
+
+    def update(p, s, w, dLdw):
+        s, w = original(p, decompress(s), w, dLdw)
+        return compress(s), w
+
+    return update
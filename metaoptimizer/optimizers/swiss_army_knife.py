@@ -24,8 +24,8 @@ class Params(NamedTuple):
 
 @jaxtyped(typechecker=beartype)
 class State(NamedTuple):
+    # (the weights before overstepping are `true_weights`)
     last_update: PyTree[Float[Array, "..."]]
-    actual: PyTree[Float[Array, "..."]]
     moving_average: PyTree[Float[Array, "..."]]
     correction_average: Float[Array, ""]
     moving_square: PyTree[Float[Array, "..."]]
@@ -59,7 +59,6 @@ def defaults(
 def init(initial_weights: PyTree[Float[Array, "..."]], p: Params) -> State:
     return State(
         last_update=tree_map(jnp.zeros_like, initial_weights),
-        actual=tree_map(jnp.zeros_like, initial_weights),
         moving_average=tree_map(jnp.zeros_like, initial_weights),
         correction_average=jnn.sigmoid(p.inv_sig_moving_average_decay),
         moving_square=tree_map(jnp.zeros_like, initial_weights),
@@ -70,7 +69,7 @@ def init(initial_weights: PyTree[Float[Array, "..."]], p: Params) -> State:
 @jaxtyped(typechecker=beartype)
 def flatten_quotient(
     x: Float[Array, "*n"],
-    k: Union[Float[Array, ""], Float[Array, "*n"]],
+    k: Union[Float[Array, ""], Float[Array, "*#n"]],
 ) -> Float[Array, "*n"]:
     # Idea is to take a scalar from 0 to 1 and flatten a signal that will act as a quotient.
     # Since we're dividing with it, we want "no influence" to mean "1 everywhere," not "0 everywhere."
@@ -128,7 +127,6 @@ def update(
     return (
         State(
             last_update=update,
-            actual=updated,
             moving_average=raw_moving_avg,
             correction_average=s.correction_average * moving_average_decay,
             moving_square=raw_moving_sq,
@@ -136,3 +134,14 @@ def update(
         ),
         tree_map(lambda wi, ui: wi - overstep * ui, updated, update),
     )
+
+
+@jaxtyped(typechecker=beartype)
+def true_weights(
+    p: Params,
+    s: State,
+    w: PyTree[Float[Array, "..."]],
+) -> PyTree[Float[Array, "..."]]:
+    """The weights `update` stepped to, before overstepping (cf. `nesterov`)."""
+    overstep = jnp.exp(p.log_overstep)
+    return tree_map(lambda wi, ui: wi + overstep * ui, w, s.last_update)
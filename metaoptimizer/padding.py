@@ -0,0 +1,192 @@
+from metaoptimizer import tracing, training
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
+from metaoptimizer.weights import Weights
+
+from beartype import beartype
+from beartype.typing import List, NamedTuple, Sequence, Tuple
+from check_and_compile import check_and_compile
+from jax import numpy as jnp, value_and_grad, vmap
+from jax.tree_util import tree_map
+from jaxtyping import jaxtyped, Array, Bool, Float, Float32, PyTree, UInt32
+
+
+# Padded & masked execution, so trials of different sizes share one compiled step:
+# the batch & every layer's width are zero-padded up to a bucket (see `bucket`),
+# & a `Mask` says which examples & units are real. The padding stays inert:
+#   - in the model: padded units have all-zero weights in & out,
+#     so they never reach the output, whatever the nonlinearity does at 0;
+#   - in the loss: padded examples & outputs are masked out;
+#   - in the optimizer: it only ever sees the real gradient,
+#     & its output is masked back to zero off the real weights
+#     (e.g. momentum or weight decay needn't keep zeros at zero by themselves);
+#   - in `permutations.layer_distance`: padded units only ever match padded units,
+#     & all-zero rows & columns add nothing to the (row-normalized) distance.
+# Every trial in a bucket is then the same shapes, & `cells` steps all of them
+# at once: one `vmap`, one compiled function for the whole bucket.
+# Padded hidden layers are always matched greedily (`O(n^2 m)` at the padded width):
+# an exhaustive search would cost the padded width's factorial, not the real one's
+# (a layer of 5 padded to 8 would search 8! = 40320 permutations instead of 120),
+# so padded cells may match a little worse than unpadded ones of up to 8 units.
+
+
+class Mask(NamedTuple):
+    examples: Bool[Array, "batch"]
+    units: List[Bool[Array, "_n"]]  # every layer's, input first (cf. `weights.sizes`)
+
+
+@jaxtyped(typechecker=beartype)
+def bucket(n: int) -> int:
+    """The next power of two (so a grid of sizes needs only a handful of buckets)."""
+    assert n > 0, f"Can't pad {n}"
+    return 1 << (n - 1).bit_length()
+
+
+@jaxtyped(typechecker=beartype)
+def mask(
+    batch: int,
+    sizes: Sequence[int],
+    padded_batch: int,
+    padded_sizes: Sequence[int],
+) -> Mask:
+    assert len(sizes) == len(padded_sizes), f"{len(sizes)} =/= {len(padded_sizes)}"
+    real = lambda n, padded: jnp.arange(padded) < n
+    return Mask(
+        examples=real(batch, padded_batch),
+        units=[real(n, padded) for n, padded in zip(sizes, padded_sizes)],
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def pad(x: Array, shape: Sequence[int]) -> Array:
+    """Zeros after the end of every axis, up to `shape`."""
+    assert x.ndim == len(shape), f"{x.shape} vs. {shape}"
+    return jnp.pad(x, [(0, padded - n) for n, padded in zip(x.shape, shape)])
+
+
+@jaxtyped(typechecker=beartype)
+def pad_weights(w: Weights, padded_sizes: Sequence[int]) -> Weights:
+    return Weights(
+        W=[pad(W, (padded_sizes[i + 1], padded_sizes[i])) for i, W in enumerate(w.W)],
+        B=[pad(B, (padded_sizes[i + 1],)) for i, B in enumerate(w.B)],
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def unpad_weights(w: Weights, sizes: Sequence[int]) -> Weights:
+    return Weights(
+        W=[W[: sizes[i + 1], : sizes[i]] for i, W in enumerate(w.W)],
+        B=[B[: sizes[i + 1]] for i, B in enumerate(w.B)],
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def weight_mask(m: Mask) -> PyTree[Bool[Array, "..."]]:
+    """Which weights are real, as a `Weights`-shaped tree."""
+    u = m.units
+    return Weights(
+        W=[u[i + 1][:, jnp.newaxis] & u[i][jnp.newaxis] for i in range(len(u) - 1)],
+        B=list(u[1:]),
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def zero_padding(
+    w: PyTree[Float[Array, "..."]], m: Mask
+) -> PyTree[Float[Array, "..."]]:
+    return tree_map(lambda x, real: jnp.where(real, x, 0), w, weight_mask(m))
+
+
+# @check_and_compile(1)
+@jaxtyped(typechecker=beartype)
+def loss(
+    weights: Weights,
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    m: Mask,
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+) -> Float32[Array, ""]:
+    """`training.loss` over only the real examples & outputs."""
+    outputs = forward_pass(weights, inputs)
+    assert (
+        outputs.shape == ground_truth.shape
+    ), f"{outputs.shape} =/= {ground_truth.shape}"
+    real = m.examples[:, jnp.newaxis] & m.units[-1][jnp.newaxis]
+    # (masked before the power, so its derivative never sees a padded difference)
+    L1 = jnp.where(real, jnp.abs(ground_truth - outputs), 0)
+    return jnp.sum(jnp.pow(L1, power))
+
+
+# @check_and_compile(1, 4, 10)
+@jaxtyped(typechecker=beartype)
+def step_global(
+    weights: Weights,
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    optim_parameterized: Optimizer,
+    opt_params: OptParams,
+    opt_state: OptState,
+    global_minimum: Weights,
+    m: Mask,
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    mode: str = training.AUTO,
+) -> Tuple[
+    Weights,
+    OptState,
+    OptParams,
+    List[UInt32[Array, "_n"]],
+    Float32[Array, ""],
+]:
+    """`training.step_global` on padded weights & data (see above)."""
+    L, dLdw = value_and_grad(loss)(
+        weights, forward_pass, inputs, ground_truth, m, power
+    )
+
+    def masked(p, s, w, d):
+        s, w = optim_parameterized(p, s, w, zero_padding(d, m))
+        return s, zero_padding(w, m)
+
+    weights_adjusted, opt_state_adjusted, opt_params_adjusted, perm = (
+        training.meta_step(
+            weights,
+            dLdw,
+            masked,
+            opt_params,
+            opt_state,
+            global_minimum,
+            mode,
+            m.units[1:-1],
+        )
+    )
+    return weights_adjusted, opt_state_adjusted, opt_params_adjusted, perm, L
+
+
+@check_and_compile(8, 9)
+@tracing.count(8, 9)
+def cells(
+    w: Weights,
+    opt_state: OptState,
+    opt_params: OptParams,
+    w_ideal: Weights,
+    inputs: Float32[Array, "cells batch ndim_in"],
+    ground_truth: Float32[Array, "cells batch ndim_out"],
+    m: Mask,
+    power: Float32[Array, ""],
+    forward_pass: ForwardPass,
+    optimizer: Optimizer,
+) -> Tuple[
+    Weights,
+    OptState,
+    OptParams,
+    List[UInt32[Array, "cells _n"]],
+    Float32[Array, "cells"],
+]:
+    """
+    `step_global` for every cell of a grid in one bucket at once
+    (everything but `power` has a leading `[cells]` axis).
+    """
+    one = lambda w, s, p, wi, x, y, mi: step_global(
+        w, forward_pass, x, y, optimizer, p, s, wi, mi, power
+    )
+    return vmap(one)(w, opt_state, opt_params, w_ideal, inputs, ground_truth, m)
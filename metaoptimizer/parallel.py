@@ -0,0 +1,97 @@
+from metaoptimizer import training
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
+
+from beartype import beartype
+from beartype.typing import Any, Callable, List, Optional, Tuple
+from jax import devices as jax_devices, lax, value_and_grad, vmap
+from jax.sharding import Mesh, NamedSharding, PartitionSpec as P
+from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree, UInt32
+import numpy as np
+
+try:
+    from jax import shard_map
+except ImportError:  # (older JAX)
+    from jax.experimental.shard_map import shard_map  # type: ignore
+
+
+# The one mesh axis: either examples in a batch or whole, independent trials.
+AXIS = "devices"
+
+
+@jaxtyped(typechecker=beartype)
+def mesh(n: Optional[int] = None) -> Mesh:
+    available = jax_devices()
+    n = len(available) if n is None else n
+    assert (
+        0 < n <= len(available)
+    ), f"Asked for {n} devices but there are {len(available)} (cf. `devices.force_host_devices`)"
+    return Mesh(np.array(available[:n]), (AXIS,))
+
+
+@jaxtyped(typechecker=beartype)
+def sharded(m: Mesh, axis: int = 0) -> NamedSharding:
+    """Split an array's `axis` across the mesh (e.g. to place data ahead of time)."""
+    return NamedSharding(m, P(*[None for _ in range(axis)], AXIS))
+
+
+# @check_and_compile(0, 2, 5, 10)
+@jaxtyped(typechecker=beartype)
+def step_global(
+    m: Mesh,
+    weights: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    optim_parameterized: Optimizer,
+    opt_params: OptParams,
+    opt_state: OptState,
+    global_minimum: PyTree[Float64[Array, "..."]],
+    power: Float32[Array, ""],
+    mode: str = training.AUTO,
+) -> Tuple[
+    PyTree[Float64[Array, "..."]],
+    OptState,
+    OptParams,
+    List[UInt32[Array, "_n"]],
+    Float32[Array, ""],
+    PyTree[Float64[Array, "..."]],
+]:
+    """
+    `training.step_global`, data-parallel: each device takes a slice of the batch
+    and the gradients are all-reduced. The loss is a sum over examples,
+    so the sum of the slices' gradients is exactly the whole batch's.
+    The meta-gradient depends on the batch only through that (already-reduced) gradient,
+    so every device computes the same one, and it needs no reduction of its own.
+    """
+    n = m.shape[AXIS]
+    assert inputs.shape[0] % n == 0, f"Batch of {inputs.shape[0]} across {n} devices"
+
+    def local(weights, inputs, ground_truth, opt_params, opt_state, ideal, power):
+        # Differentiating the all-reduced loss makes JAX all-reduce the gradient:
+        total = lambda w: lax.psum(
+            training.loss(w, forward_pass, inputs, ground_truth, power), AXIS
+        )
+        L, dLdw = value_and_grad(total)(weights)
+        return (
+            *training.meta_step(
+                weights, dLdw, optim_parameterized, opt_params, opt_state, ideal, mode
+            ),
+            L,
+            dLdw,
+        )
+
+    return shard_map(
+        local,
+        mesh=m,
+        in_specs=(P(), P(AXIS), P(AXIS), P(), P(), P(), P()),
+        out_specs=P(),
+    )(weights, inputs, ground_truth, opt_params, opt_state, global_minimum, power)
+
+
+@jaxtyped(typechecker=beartype)
+def across_trials(m: Mesh, f: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Run `f` on independent trials stacked along every argument's (and output's)
+    leading axis, each device taking an equal share of them. No communication at all.
+    """
+    return shard_map(vmap(f), mesh=m, in_specs=P(AXIS), out_specs=P(AXIS))
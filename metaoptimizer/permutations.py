@@ -3,13 +3,14 @@ from metaoptimizer.weights import layers, wb, Weights
 from beartype import beartype
 from beartype.typing import List, Optional, Tuple
 from check_and_compile import check_and_compile
-from jax import nn as jnn, numpy as jnp, vmap, ShapeDtypeStruct
+from jax import named_scope, nn as jnn, numpy as jnp, vmap, ShapeDtypeStruct
 from jax.experimental.checkify import check
 from jax.lax import cond, fori_loop, stop_gradient
 from jax.tree_util import tree_map, tree_reduce
 from jaxtyping import (
     jaxtyped,
     Array,
+    Bool,
     Float32,
     Float64,
     Int,
@@ -22,6 +23,10 @@ import sys
 from typing import NamedTuple
 
 
+# Exhaustive search is factorial in the layer's width, so wider layers match greedily:
+EXHAUSTIVE_MAX = 8
+
+
 # @check_and_compile()
 @jaxtyped(typechecker=beartype)
 def permute_vector(
@@ -45,18 +50,18 @@ def permute(
 @jaxtyped(typechecker=beartype)
 def permute_hidden_layers(
     w: Weights,
-    ps: List[UInt32[Array, "n"]],
+    ps: List[UInt32[Array, "_n"]],
 ) -> Weights:
     """Permute hidden layers' columns locally without changing the output of a network."""
     n = len(ps)
     assert layers(w) == n + 1
-    W = w.W
-    B = w.B
+    W = list(w.W)
+    B = list(w.B)
     for i in range(n):
         p = ps[i]
-        W = W.at[i].set(permute(W[i], p, 0))
-        W = W.at[i + 1].set(permute(W[i + 1], p, 1))
-        B = B.at[i].set(permute(B[i], p, 0))
+        W[i] = permute(W[i], p, 0)
+        W[i + 1] = permute(W[i + 1], p, 1)
+        B[i] = permute(B[i], p, 0)
     return Weights(W=W, B=B)
 
 
@@ -159,16 +164,61 @@ def find_permutation_rec(
     return r_indices, r_loss
 
 
+# @check_and_compile()
+@jaxtyped(typechecker=beartype)
+def find_permutation_greedy(
+    actual: Float32[Array, "n m"],
+    ideal: Float32[Array, "n m"],
+    real: Optional[Bool[Array, "n"]] = None,
+) -> UInt32[Array, "n"]:
+    """
+    Match each row of `actual`, in order, to its closest still-unmatched row of `ideal`.
+    Not optimal, but `O(n^2 m)` time and only `O(n m)` memory (one row at a time).
+    If only some rows are `real` (the rest padding: see `padding`),
+    real rows only ever match real rows, & padding only padding.
+    """
+    n = actual.shape[0]
+
+    def match(
+        i: Int[Array, ""],
+        carry: Tuple[UInt32[Array, "n"], Array],
+    ) -> Tuple[UInt32[Array, "n"], Array]:
+        p, taken = carry
+        distances = jnp.sum(jnp.abs(ideal - actual[i]), axis=-1)
+        allowed = jnp.logical_not(taken)
+        if real is not None:
+            allowed = jnp.logical_and(allowed, real == real[i])
+        j = jnp.argmin(jnp.where(allowed, distances, jnp.inf)).astype(jnp.uint32)
+        return p.at[i].set(j), taken.at[j].set(True)
+
+    p, _ = fori_loop(
+        0,
+        n,
+        match,
+        # (`zeros_like` so these live wherever the inputs do, e.g. under `shard_map`)
+        (
+            jnp.zeros_like(actual[:, 0], dtype=jnp.uint32),
+            jnp.zeros_like(actual[:, 0], dtype=jnp.bool_),
+        ),
+    )
+    return p
+
+
 # @check_and_compile()
 @jaxtyped(typechecker=beartype)
 def find_permutation(
     actual: Float32[Array, "n m"],
     ideal: Float32[Array, "n m"],
+    real: Optional[Bool[Array, "n"]] = None,
 ) -> UInt32[Array, "n"]:
     """
-    Exhaustive search for layer-wise permutations minimizing a given loss
+    Exhaustive search (for up to `EXHAUSTIVE_MAX` rows; greedy beyond)
+    for layer-wise permutations minimizing a given loss
     that nonetheless, when all applied in order, reverse any intermediate permutations
     and output the correct indices in their original positions.
+    Padding (rows that aren't `real`) only ever matches padding.
+    With `real`, always greedy: the search would be over the padded width,
+    not the real one (e.g. 8! instead of 5!), & how many rows are real isn't static.
 
     NOTE: INPUT CANNOT BE DIFFERENTIATED.
     TODO: search a bit more for how to detect the above (nothing yet) . . .
@@ -182,6 +232,8 @@ def find_permutation(
     )
     actual_normalized: Float32[Array, "n m"] = actual / (actual_std + 1e-8)
     ideal_normalized: Float32[Array, "n m"] = ideal / (ideal_std + 1e-8)
+    if n > EXHAUSTIVE_MAX or real is not None:
+        return find_permutation_greedy(actual_normalized, ideal_normalized, real)
     actual_squeezed: Float32[Array, "n 1 m"] = actual_normalized[:, jnp.newaxis]
     ideal_squeezed: Float32[Array, "1 n m"] = ideal_normalized[jnp.newaxis]
 
@@ -202,7 +254,8 @@ def find_permutation(
 def layer_distance(
     actual: Weights,
     ideal: Weights,
-) -> Tuple[Float32[Array, ""], List[UInt32[Array, "n"]]]:
+    units: Optional[List[Bool[Array, "_n"]]] = None,
+) -> Tuple[Float32[Array, ""], List[UInt32[Array, "_n"]]]:
     """
     Compute the "true" distance between two sets of weights and biases,
     allowing permutations at every layer without changing the final output.
@@ -216,6 +269,7 @@ def layer_distance(
     In practice, however, the extra loss in situations like the above
     should be entirely negligible.
     TODO: Investigate the above . . . if you have the compute to do so.
+    With zero-padded weights, `units` says which hidden units are real (see `padding`).
     """
 
     n = layers(actual)
@@ -237,23 +291,27 @@ def layer_distance(
             else jnp.concat(
                 [
                     permute(ideal.W[i], last_p, 1),
-                    ideal.B[i, ..., jnp.newaxis],
+                    ideal.B[i][..., jnp.newaxis],
                 ],
                 axis=-1,
             )
         ).astype(jnp.float32)
-        p = find_permutation(ai, ii)
+        with named_scope("permutation_search"):
+            p = find_permutation(ai, ii, None if units is None else units[i])
         permutations.append(p)
         last_p = p
 
     # Calculate loss differentiably:
     ideal = permute_hidden_layers(ideal, permutations)
-    wb_a = wb(actual)
-    wb_i = wb(ideal)
-    std_a = jnp.sqrt(jnp.sum(jnp.square(stop_gradient(wb_a)), axis=-1, keepdims=True))
-    std_i = jnp.sqrt(jnp.sum(jnp.square(stop_gradient(wb_i)), axis=-1, keepdims=True))
-    normalized_a = wb_a / (std_a + 1e-8)
-    normalized_i = wb_i / (std_i + 1e-8)
-    L = jnp.sum(jnp.abs(normalized_i - normalized_a))
+    normalized = lambda x: x / (
+        jnp.sqrt(jnp.sum(jnp.square(stop_gradient(x)), axis=-1, keepdims=True)) + 1e-8
+    )
+    L = sum(
+        [
+            jnp.sum(jnp.abs(normalized(i) - normalized(a)))
+            for a, i in zip(wb(actual), wb(ideal))
+        ],
+        jnp.array(0, dtype=jnp.float32),
+    )
 
     return L, permutations
@@ -0,0 +1,276 @@
+from metaoptimizer import data, feedforward, metrics, saving, tracing, training, trial
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
+from metaoptimizer.weights import sizes, Weights
+
+from beartype import beartype
+from beartype.typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from check_and_compile import check_and_compile
+from jax import lax, numpy as jnp, random as jrnd, vmap
+from jax.tree_util import tree_flatten, tree_map, tree_unflatten
+from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree, UInt32
+import numpy as np
+from numpy import ndarray
+import os
+from time import time
+
+
+# Population-based training (PBT): `size` copies of one trial (same teacher, same data)
+# that start from different weights & perturbed `opt_params`, all run as one vmapped
+# computation. Every `interval` steps, the worst `truncate` of them (by mean loss
+# over the interval) copy the weights, optimizer state & `opt_params` of randomly
+# chosen members of the best `truncate` (exploit), then perturb those `opt_params`
+# (explore). In between, every member still meta-learns by gradient, as in `trial.run`.
+# A whole interval (a `lax.scan` over its steps) plus exploit & explore is one
+# compiled call, so nothing ever comes back to the host mid-run.
+
+SIZE = 64
+INTERVAL = 100
+TRUNCATE = 0.25
+# Std. dev. of the noise added to `opt_params` (which are all unconstrained,
+# e.g. `log_lr`, so this is roughly +/- 20% of the learning rate):
+PERTURB = 0.2
+
+
+class Member(NamedTuple):
+    # Everything one member carries from step to step
+    # (with a leading `[size]` axis on every leaf for the whole population):
+    w: Weights
+    opt_state: OptState
+    opt_params: OptParams
+    permutation: List[UInt32[Array, "_n"]]
+
+
+class Generation(NamedTuple):
+    # One interval, for every member:
+    losses: Float32[Array, "interval size"]
+    distances: Float32[Array, "size"]  # summed `metrics.LAYER_DISTANCES`, at the end
+    opt_params: PyTree[Float64[Array, "size *n"]]  # before exploit & explore
+    source: UInt32[Array, "size"]  # whom each member copied (itself if it was kept)
+
+
+class Summary(NamedTuple):
+    losses: ndarray  # [steps, size]
+    distances: ndarray  # [generations, size]
+    sources: ndarray  # [generations, size]
+    best: int  # lowest final distance
+    # Each member's, at the end: the ones its final distance was measured with
+    # (i.e. before the last exploit & explore, which nothing comes after):
+    opt_params: PyTree[ndarray]
+
+
+@jaxtyped(typechecker=beartype)
+def init(
+    key: Array,
+    w_ideal: Weights,
+    opt_init: Callable,
+    opt_params: OptParams,
+    size: int,
+    initial_distance: Float64[Array, ""],
+    perturb: float = PERTURB,
+) -> Member:
+    """`size` members, each `initial_distance`-ish from `w_ideal` (cf. `trial.run`)."""
+    hidden = sizes(w_ideal)[1:-1]
+
+    def member(k: Array) -> Member:
+        k_w, k_p = jrnd.split(k)
+        w_flat, w_def = tree_flatten(w_ideal)
+        w_keys = tree_unflatten(w_def, list(jrnd.split(k_w, len(w_flat))))
+        w = tree_map(
+            lambda x, k: x + initial_distance * jrnd.normal(k, x.shape),
+            w_ideal,
+            w_keys,
+        )
+        p = jitter(k_p, opt_params, perturb)
+        return Member(
+            w=w,
+            opt_state=opt_init(w, p),
+            opt_params=p,
+            permutation=[jnp.arange(n, dtype=jnp.uint32) for n in hidden],
+        )
+
+    return tracing.strong(vmap(member)(jrnd.split(key, size)))
+
+
+@jaxtyped(typechecker=beartype)
+def jitter(key: Array, opt_params: OptParams, perturb: float) -> OptParams:
+    flat, structure = tree_flatten(opt_params)
+    keys = jrnd.split(key, len(flat))
+    noisy = [p + perturb * jrnd.normal(k, p.shape, p.dtype) for p, k in zip(flat, keys)]
+    return tree_unflatten(structure, noisy)
+
+
+@jaxtyped(typechecker=beartype)
+def exploit_and_explore(
+    key: Array,
+    members: Member,
+    fitness: Float32[Array, "size"],
+    truncate: float = TRUNCATE,
+    perturb: float = PERTURB,
+) -> Tuple[Member, UInt32[Array, "size"]]:
+    """
+    Truncation selection: the worst `truncate` (highest `fitness`, e.g. loss) become
+    copies of random members of the best `truncate`, with jittered `opt_params`.
+    """
+    size = fitness.shape[0]
+    cut = max(1, int(size * truncate))
+    assert 2 * cut <= size, f"Can't replace the worst {cut} of {size} with the best"
+    k_donor, k_jitter = jrnd.split(key)
+    # (diverged members go last)
+    order = jnp.argsort(jnp.where(jnp.isfinite(fitness), fitness, jnp.inf))
+    donors = order[jrnd.randint(k_donor, [cut], 0, cut)]
+    everyone = jnp.arange(size, dtype=jnp.uint32)
+    source = everyone.at[order[size - cut :]].set(donors.astype(jnp.uint32))
+    copied = tree_map(lambda x: x[source], members)
+    replaced = source != everyone
+    jittered = jitter(k_jitter, copied.opt_params, perturb)
+    # (per-layer or per-unit `opt_params` have more axes: see `optimizers.granular`)
+    opt_params = tree_map(
+        lambda new, old: jnp.where(
+            replaced.reshape(-1, *[1 for _ in new.shape[1:]]), new, old
+        ),
+        jittered,
+        copied.opt_params,
+    )
+    return copied._replace(opt_params=opt_params), source
+
+
+@check_and_compile(5, 6, 7, 8)
+@tracing.count(5, 6, 7, 8)
+def generation(
+    members: Member,
+    w_ideal: Weights,
+    power: Float32[Array, ""],
+    block: data.Block,
+    key: Array,
+    forward_pass: ForwardPass,
+    optimizer: Optimizer,
+    truncate: float = TRUNCATE,
+    perturb: float = PERTURB,
+) -> Tuple[Member, Generation]:
+    """One interval (a step per row of `block`) for every member, then exploit & explore."""
+
+    def step(members: Member, batch: Tuple[Array, Array]) -> Tuple[Member, Array]:
+        x, y_ideal = batch
+        one = lambda m: training.step_global(
+            m.w,
+            forward_pass,
+            x,
+            y_ideal,
+            optimizer,
+            m.opt_params,
+            m.opt_state,
+            w_ideal,
+            power,
+        )
+        w, opt_state, opt_params, permutation, L, _ = vmap(one)(members)
+        return Member(w, opt_state, opt_params, permutation), L
+
+    members, losses = lax.scan(step, members, (block.x, block.y))
+
+    def distance(m: Member) -> Float32[Array, ""]:
+        d = metrics.compute(
+            (metrics.LAYER_DISTANCES,), m.w, m.w, w_ideal, m.permutation
+        )
+        return jnp.sum(d[metrics.LAYER_DISTANCES])
+
+    distances = vmap(distance)(members)
+    fitness = jnp.mean(losses, axis=0)
+    survivors, source = exploit_and_explore(key, members, fitness, truncate, perturb)
+    return survivors, Generation(losses, distances, members.opt_params, source)
+
+
+@jaxtyped(typechecker=beartype)
+def run(
+    key: Array,
+    ndim: int,
+    batch: int,
+    layers: int,
+    forward_pass: Callable,
+    optimizer: Optimizer,
+    opt_init: Callable,
+    opt_params: OptParams,
+    training_steps: int = 100000,
+    subdir: Tuple = ("population",),
+    power: Float32[Array, ""] = jnp.array(2.0, dtype=jnp.float32),
+    initial_distance: Float64[Array, ""] = jnp.array(0.1, dtype=jnp.float64),
+    size: int = SIZE,
+    interval: int = INTERVAL,
+    truncate: float = TRUNCATE,
+    perturb: float = PERTURB,
+    prefix: str = "",
+    verbose: bool = True,
+    store: Optional[str] = None,
+    widths: Optional[Tuple[int, ...]] = None,
+) -> Summary:
+    """
+    Like `trial.run`, but for a population (see above). `optimizer` & `opt_init`
+    are an optimizer module's `update` & `init`, since every member needs its own state.
+    """
+    assert (
+        training_steps % interval == 0
+    ), f"Training steps must be a multiple of {interval}, but it was {training_steps}"
+    generations = training_steps // interval
+
+    k1, k2 = jrnd.split(key)
+    shapes = tuple([ndim for _ in range(layers + 1)]) if widths is None else widths
+    assert len(shapes) == layers + 1, f"{len(shapes)} widths for {layers} layers"
+    assert shapes[0] == ndim, f"Input width {shapes[0]} =/= `ndim` ({ndim})"
+    w_ideal = feedforward.init(shapes, k1, True)
+    members = init(k2, w_ideal, opt_init, opt_params, size, initial_distance, perturb)
+
+    # One block of data per generation, shared by every member, made one ahead:
+    data_key = jrnd.PRNGKey(42)
+    make = lambda g: data.generate(
+        jrnd.fold_in(data_key, g), w_ideal, interval, batch, ndim, forward_pass
+    )
+    pbt_key = jrnd.fold_in(key, 1)
+
+    if verbose:
+        print(prefix + f"Training a population of {size}...")
+        t0 = time()
+    history: List[Generation] = []
+    ahead = make(0)
+    for g in range(generations):
+        block, ahead = ahead, make(g + 1)
+        members, out = generation(
+            members,
+            w_ideal,
+            power,
+            block,
+            jrnd.fold_in(pbt_key, g),
+            forward_pass,
+            optimizer,
+            truncate,
+            perturb,
+        )
+        history.append(out)
+        if verbose and (g + 1) % max(1, generations // 10) == 0:
+            print(prefix + f"{100 * (g + 1) // generations}%")
+    if verbose:
+        print(prefix + f"Done in {int(time() - t0)} seconds")
+
+    outputs: Dict[str, Array] = {}
+    stacked = saving.stack(history)
+    outputs["losses.npy"] = stacked.losses.reshape(training_steps, size)
+    outputs["distances.npy"] = stacked.distances
+    outputs["sources.npy"] = stacked.source
+    outputs.update(trial.readable(stacked.opt_params))
+    saving.save(
+        os.path.join(os.getcwd(), *subdir),
+        outputs,
+        store=store,
+        trial="/".join(subdir),
+        prefix=prefix,
+        verbose=verbose,
+    )
+
+    distances = np.asarray(outputs["distances.npy"])
+    return Summary(
+        losses=np.asarray(outputs["losses.npy"]),
+        distances=distances,
+        sources=np.asarray(outputs["sources.npy"]),
+        best=int(
+            np.argmin(np.where(np.isfinite(distances[-1]), distances[-1], np.inf))
+        ),
+        opt_params=tree_map(np.asarray, history[-1].opt_params),
+    )
@@ -0,0 +1,130 @@
+from beartype import beartype
+from beartype.typing import Any, Dict, Optional, Tuple
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from jax import block_until_ready, monitoring, named_scope, profiler
+from jaxtyping import jaxtyped
+from time import perf_counter
+
+
+# Opt-in: everything here is a no-op (one global read) unless `enable` was called.
+# Inside compiled code, phases are marked with `jax.named_scope` regardless
+# (that only labels the HLO, at no runtime cost) so they show up in traces.
+ENABLED = False
+TRACE_DIR: Optional[str] = None
+TRACE_STEPS: Tuple[int, int] = (0, 0)
+TRACING = False
+LISTENING = False
+
+WALL: Dict[str, float] = defaultdict(float)
+CALLS: Dict[str, int] = defaultdict(int)
+COMPILE: Dict[str, float] = defaultdict(float)
+COMPILES: Dict[str, int] = defaultdict(int)
+
+NULL = nullcontext()
+
+
+def on_event_duration(event: str, duration_secs: float, **kwargs) -> None:
+    # e.g. `/jax/core/compile/jaxpr_trace_duration` or `.../backend_compile_duration`
+    if ENABLED and "compile" in event:
+        COMPILE[event] += duration_secs
+        COMPILES[event] += 1
+
+
+@jaxtyped(typechecker=beartype)
+def enable(
+    trace_dir: Optional[str] = None,
+    trace_steps: Tuple[int, int] = (10, 20),
+) -> None:
+    """
+    Start timing host-side phases & compilation.
+    If `trace_dir` is given, also capture a `jax.profiler` trace
+    (viewable in TensorBoard/Perfetto) for steps `[start, stop)` of each trial.
+    """
+    global ENABLED, LISTENING, TRACE_DIR, TRACE_STEPS
+    ENABLED = True
+    TRACE_DIR = trace_dir
+    TRACE_STEPS = trace_steps
+    if not LISTENING:
+        monitoring.register_event_duration_secs_listener(on_event_duration)
+        LISTENING = True
+
+
+@jaxtyped(typechecker=beartype)
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+@jaxtyped(typechecker=beartype)
+def reset() -> None:
+    for d in (WALL, CALLS, COMPILE, COMPILES):
+        d.clear()
+
+
+@contextmanager
+def timed(name: str):
+    t0 = perf_counter()
+    try:
+        with named_scope(name):
+            yield
+    finally:
+        WALL[name] += perf_counter() - t0
+        CALLS[name] += 1
+
+
+def span(name: str):
+    """Time a host-side phase (and label anything traced inside it)."""
+    return timed(name) if ENABLED else NULL
+
+
+def block(x: Any) -> Any:
+    """
+    JAX dispatches asynchronously, so a host timer only means something
+    if we wait for the result; only ever wait when profiling.
+    """
+    return block_until_ready(x) if ENABLED else x
+
+
+@jaxtyped(typechecker=beartype)
+def at_step(i: int) -> None:
+    """Call once per training step to start/stop trace capture on schedule."""
+    global TRACING
+    if not ENABLED or TRACE_DIR is None:
+        return
+    start, stop = TRACE_STEPS
+    if i == start and not TRACING:
+        profiler.start_trace(TRACE_DIR)
+        TRACING = True
+    elif i >= stop and TRACING:
+        profiler.stop_trace()
+        TRACING = False
+
+
+@jaxtyped(typechecker=beartype)
+def finish() -> None:
+    """Stop any trace still running (e.g. if the trial had fewer steps)."""
+    global TRACING
+    if TRACING:
+        profiler.stop_trace()
+        TRACING = False
+
+
+@jaxtyped(typechecker=beartype)
+def summary() -> str:
+    rows = [("phase", "calls", "total (s)", "mean (ms)")]
+    for name, total in sorted(WALL.items(), key=lambda kv: -kv[1]):
+        n = CALLS[name]
+        rows.append((name, str(n), f"{total:.3f}", f"{1000 * total / n:.3f}"))
+    for event, total in sorted(COMPILE.items(), key=lambda kv: -kv[1]):
+        n = COMPILES[event]
+        rows.append((event, str(n), f"{total:.3f}", f"{1000 * total / n:.3f}"))
+    widths = [max([len(r[i]) for r in rows]) for i in range(4)]
+    lines = [
+        "  ".join(
+            [r[0].ljust(widths[0])] + [r[i].rjust(widths[i]) for i in range(1, 4)]
+        )
+        for r in rows
+    ]
+    lines.insert(1, "-" * len(lines[0]))
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+from metaoptimizer import stopping, store
+
+from beartype import beartype
+from beartype.typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from jaxtyping import jaxtyped
+import numpy as np
+import os
+
+
+# Directory-name suffixes written by `plot-convergence.py`:
+#   <root>/<layers>-layer/<ndim>-dimensional/<distance>-distance/trial-<i>/
+LAYER_SUFFIX = "-layer"
+NDIM_SUFFIX = "-dimensional"
+DISTANCE_SUFFIX = "-distance"
+TRIAL_PREFIX = "trial-"
+
+
+class TrialKey(NamedTuple):
+    layers: int
+    ndim: int
+    distance: float
+    trial: int
+
+
+Index = Dict[TrialKey, str]
+
+
+@jaxtyped(typechecker=beartype)
+def parse_number(name: str, prefix: str, suffix: str) -> Optional[str]:
+    if not (name.startswith(prefix) and name.endswith(suffix)):
+        return None
+    return name[len(prefix) : len(name) - len(suffix)]
+
+
+@jaxtyped(typechecker=beartype)
+def numeric(number: str) -> bool:
+    try:
+        float(number)
+        return True
+    except ValueError:
+        return False
+
+
+@jaxtyped(typechecker=beartype)
+def subdirectories(directory: str, prefix: str, suffix: str) -> List[Tuple[str, str]]:
+    """Only ever one `scandir` per level, and only into matching directories."""
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            number = parse_number(entry.name, prefix, suffix)
+            # (skips e.g. `trial-3.tmp-...` directories that are still being written)
+            if number is not None and numeric(number) and entry.is_dir():
+                found.append((number, entry.path))
+    return found
+
+
+@jaxtyped(typechecker=beartype)
+def parse_key(trial: str) -> Optional[TrialKey]:
+    parts = trial.split("/")
+    if len(parts) != 4:
+        return None
+    layers = parse_number(parts[0], "", LAYER_SUFFIX)
+    ndim = parse_number(parts[1], "", NDIM_SUFFIX)
+    dist = parse_number(parts[2], "", DISTANCE_SUFFIX)
+    i = parse_number(parts[3], TRIAL_PREFIX, "")
+    if layers is None or ndim is None or dist is None or i is None:
+        return None
+    if not all([numeric(n) for n in (layers, ndim, dist, i)]):
+        return None
+    return TrialKey(
+        layers=int(layers),
+        ndim=int(ndim),
+        distance=float(dist),
+        trial=int(i),
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def index(root: str) -> Index:
+    """
+    Map each `TrialKey` under a `convergence-rates`-style tree to its directory.
+    Nothing is loaded: this only reads directory entries (or a store's headers).
+    `root` may also be a single-file sweep store (see `metaoptimizer.store`),
+    in which case each "directory" is a virtual path `<root>/<trial>`.
+    """
+    trials: Index = {}
+    if os.path.isfile(root):
+        for trial in store.contents(root):
+            key = parse_key(trial)
+            if key is not None:
+                trials[key] = os.path.join(root, *trial.split("/"))
+        return dict(sorted(trials.items()))
+    for layers, layer_dir in subdirectories(root, "", LAYER_SUFFIX):
+        for ndim, ndim_dir in subdirectories(layer_dir, "", NDIM_SUFFIX):
+            for dist, dist_dir in subdirectories(ndim_dir, "", DISTANCE_SUFFIX):
+                for i, trial_dir in subdirectories(dist_dir, TRIAL_PREFIX, ""):
+                    key = TrialKey(
+                        layers=int(layers),
+                        ndim=int(ndim),
+                        distance=float(dist),
+                        trial=int(i),
+                    )
+                    trials[key] = trial_dir
+    return dict(sorted(trials.items()))
+
+
+@jaxtyped(typechecker=beartype)
+def select(
+    trials: Index,
+    layers: Optional[int] = None,
+    ndim: Optional[int] = None,
+    distance: Optional[float] = None,
+    trial: Optional[int] = None,
+) -> Index:
+    return {
+        k: v
+        for k, v in trials.items()
+        if (layers is None or k.layers == layers)
+        and (ndim is None or k.ndim == ndim)
+        and (distance is None or np.isclose(k.distance, distance))
+        and (trial is None or k.trial == trial)
+    }
+
+
+@jaxtyped(typechecker=beartype)
+def load(directory: str, *path: str) -> np.ndarray:
+    """Memory-map an array: nothing is read from disk until it's indexed."""
+    if not os.path.isdir(directory):
+        in_store = store.split(directory)
+        if in_store is not None:
+            return store.read(*in_store, "/".join(path))
+    return np.load(os.path.join(directory, *path), mmap_mode="r", allow_pickle=False)
+
+
+@jaxtyped(typechecker=beartype)
+def read(
+    directory: str,
+    *path: str,
+    index: Union[int, slice, Tuple, None] = None,
+) -> np.ndarray:
+    """Copy only the requested slice (everything if `index` is `None`) into memory."""
+    if not os.path.isdir(directory):
+        in_store = store.split(directory)
+        if in_store is not None:
+            return store.read(*in_store, "/".join(path), index=index)
+    mapped = load(directory, *path)
+    return np.array(mapped if index is None else mapped[index])
+
+
+@jaxtyped(typechecker=beartype)
+def losses(directory: str) -> np.ndarray:
+    return load(directory, "losses.npy")
+
+
+@jaxtyped(typechecker=beartype)
+def converged(directory: str) -> bool:
+    return bool(read(directory, "closer_or_not.npy"))
+
+
+@jaxtyped(typechecker=beartype)
+def stopped(directory: str) -> Tuple[str, int]:
+    """Why (`""` if it didn't) and after how many steps a trial stopped."""
+    return (
+        stopping.REASONS[read(directory, "stopping", "reason.npy").item()],
+        read(directory, "stopping", "steps.npy").item(),
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def weight_distances(directory: str, layer: int) -> np.ndarray:
+    return load(directory, "weight_distances", f"layer_{layer}.npy")
+
+
+@jaxtyped(typechecker=beartype)
+def weights(
+    directory: str,
+    layer: int,
+    name: str = "w_historical.npy",
+    biases: bool = False,
+) -> np.ndarray:
+    return load(
+        directory,
+        "weights",
+        f"layer_{layer}",
+        "biases" if biases else "weights",
+        name,
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def optimizer(directory: str) -> Dict[str, np.ndarray]:
+    if not os.path.isdir(directory):
+        in_store = store.split(directory)
+        if in_store is not None:
+            path, trial = in_store
+            return {
+                os.path.splitext(name[len("optimizer/") :])[0]: load(
+                    directory, *name.split("/")
+                )
+                for name in sorted(store.contents(path).get(trial, {}))
+                if name.startswith("optimizer/") and name.endswith(".npy")
+            }
+    d = os.path.join(directory, "optimizer")
+    if not os.path.isdir(d):
+        return {}
+    return {
+        os.path.splitext(f)[0]: load(d, f)
+        for f in sorted(os.listdir(d))
+        if f.endswith(".npy")
+    }
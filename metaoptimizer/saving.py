@@ -0,0 +1,134 @@
+from metaoptimizer import store as results_store
+
+from beartype import beartype
+from beartype.typing import Any, Dict, List, Optional, Sequence
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+from jax import device_get, jit, numpy as jnp
+from jax.tree_util import tree_map
+from jaxtyping import jaxtyped
+from threading import Semaphore
+from uuid import uuid4
+import numpy as np
+import os
+import shutil
+
+
+# Background writers, so the next trial can start while this one's saving.
+THREADS = 4
+# Each pending save holds a trial's histories in memory, so don't queue too many:
+MAX_PENDING = 8
+
+# `jnp.stack` compiles a separate concatenation for every number of arguments,
+# in time that grows faster than linearly (seconds for a few thousand steps),
+# so per-step histories are stacked this many steps at a time
+# (and through `jit`, whose argument handling is ~10x faster per array):
+STACK_PIECE = 256
+
+POOL: Optional[ThreadPoolExecutor] = None
+PENDING: List[Future] = []
+SLOTS = Semaphore(MAX_PENDING)
+
+
+@jit
+def stack_piece(xs: Sequence[Any]) -> Any:
+    return jnp.stack(xs)
+
+
+@jaxtyped(typechecker=beartype)
+def stack(history: Sequence[Any]) -> Any:
+    """Per-step pytrees -> one pytree of arrays with a leading `steps` axis."""
+
+    def leaf(*xs):
+        pieces = [
+            stack_piece(xs[i : i + STACK_PIECE]) for i in range(0, len(xs), STACK_PIECE)
+        ]
+        return pieces[0] if len(pieces) == 1 else jnp.concatenate(pieces)
+
+    return tree_map(leaf, *history)
+
+
+@jaxtyped(typechecker=beartype)
+def write_directory(directory: str, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    Write everything into a sibling temporary directory, then rename it into place,
+    so `directory` either doesn't exist or is complete (never half-written).
+    """
+    parent = os.path.dirname(directory)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    tmp = f"{directory}.tmp-{os.getpid()}-{uuid4().hex[:8]}"
+    for name, x in arrays.items():
+        path = os.path.join(tmp, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, x, allow_pickle=False)
+    if os.path.exists(directory):
+        old = f"{directory}.old-{os.getpid()}-{uuid4().hex[:8]}"
+        os.rename(directory, old)
+        os.rename(tmp, directory)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.rename(tmp, directory)
+
+
+@jaxtyped(typechecker=beartype)
+def write(
+    directory: str,
+    arrays: Dict[str, Any],
+    store: Optional[str],
+    trial: Optional[str],
+    prefix: str,
+    verbose: bool,
+) -> None:
+    try:
+        host = device_get(arrays)  # one transfer for everything
+        host = {k: np.asarray(v) for k, v in host.items()}
+        if store is None:
+            write_directory(directory, host)
+            if verbose:
+                print(prefix + f"Saved {len(host)} arrays to `{directory}`")
+        else:
+            assert trial is not None
+            results_store.append(store, trial, host)
+            if verbose:
+                print(prefix + f"Saved {len(host)} arrays to `{store}`")
+    finally:
+        SLOTS.release()
+
+
+@jaxtyped(typechecker=beartype)
+def raise_failures() -> None:
+    global PENDING
+    done = [f for f in PENDING if f.done()]
+    PENDING = [f for f in PENDING if not f.done()]
+    for f in done:
+        f.result()  # re-raises anything that went wrong in the background
+
+
+@jaxtyped(typechecker=beartype)
+def save(
+    directory: str,
+    arrays: Dict[str, Any],
+    store: Optional[str] = None,
+    trial: Optional[str] = None,
+    prefix: str = "",
+    verbose: bool = False,
+) -> None:
+    """
+    Queue `arrays` (named by paths relative to the trial, e.g. `weights/layer_0/...`)
+    to be written to `directory`, or to one `store` entry named `trial`, in the background.
+    Blocks only if `MAX_PENDING` saves are already queued.
+    """
+    global POOL
+    raise_failures()
+    if POOL is None:
+        POOL = ThreadPoolExecutor(THREADS, thread_name_prefix="metaoptimizer-save")
+    SLOTS.acquire()
+    PENDING.append(POOL.submit(write, directory, arrays, store, trial, prefix, verbose))
+
+
+@jaxtyped(typechecker=beartype)
+def wait() -> None:
+    """Block until everything queued so far is on disk (or failed: raised once)."""
+    futures.wait(PENDING)
+    raise_failures()
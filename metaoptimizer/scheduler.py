@@ -0,0 +1,122 @@
+from metaoptimizer.trial import Progress, Summary
+
+from beartype import beartype
+from beartype.typing import Callable, Dict, List, NamedTuple, Optional
+from jaxtyping import jaxtyped
+import math
+import numpy as np
+
+
+# Multi-fidelity search: start many configurations on a small budget,
+# then give only the best `1 / eta` of them `eta` times more steps, and so on
+# (successive halving). Hyperband runs several of those, from aggressive
+# (many configurations, tiny budgets) to cautious (few, full budgets), since
+# which one wins depends on how well early losses predict final ones.
+# Promoted trials continue where they left off (`trial.Progress`), never restart.
+
+ETA = 3
+
+
+class Config(NamedTuple):
+    optimizer: str  # module name in `metaoptimizer.optimizers`
+    lr: float
+    distance: float
+    batch: int
+
+
+class Result(NamedTuple):
+    config: Config
+    steps: int
+    score: float
+    stop_reason: str
+
+
+# `run(config, training_steps, resume)`, e.g. a thin wrapper around `trial.run`:
+Run = Callable[[Config, int, Optional[Progress]], Summary]
+Score = Callable[[Summary], float]
+
+
+@jaxtyped(typechecker=beartype)
+def final_loss(summary: Summary) -> float:
+    """Mean over the last 1% of steps (single-step losses are noisy); lower is better."""
+    assert summary.losses is not None, "Scoring by loss needs `track_losses`"
+    tail = summary.losses[-max(1, summary.losses.shape[0] // 100) :]
+    x = float(np.mean(tail))
+    return x if np.isfinite(x) else math.inf
+
+
+@jaxtyped(typechecker=beartype)
+def final_distance(summary: Summary) -> float:
+    assert (
+        summary.weight_distances is not None
+    ), "Scoring by distance needs `track_weight_distances`"
+    x = float(np.sum(summary.weight_distances[-1]))
+    return x if np.isfinite(x) else math.inf
+
+
+@jaxtyped(typechecker=beartype)
+def budgets(min_steps: int, max_steps: int, eta: int = ETA) -> List[int]:
+    """`min_steps`, `eta` times that, ... up to `max_steps` (all multiples of 100)."""
+    assert min_steps % 100 == 0, f"Budgets must be multiples of 100, not {min_steps}"
+    assert max_steps % 100 == 0, f"Budgets must be multiples of 100, not {max_steps}"
+    assert 0 < min_steps <= max_steps
+    out = [min_steps]
+    while out[-1] < max_steps:
+        out.append(min(max_steps, 100 * math.ceil(out[-1] * eta / 100)))
+    return out
+
+
+@jaxtyped(typechecker=beartype)
+def successive_halving(
+    configs: List[Config],
+    run: Run,
+    min_steps: int,
+    max_steps: int,
+    eta: int = ETA,
+    score: Score = final_loss,
+    verbose: bool = True,
+) -> List[Result]:
+    """Every configuration's last result, best first."""
+    alive = list(dict.fromkeys(configs))
+    progress: Dict[Config, Optional[Progress]] = {c: None for c in alive}
+    results: Dict[Config, Result] = {}
+    for rung, steps in enumerate(budgets(min_steps, max_steps, eta)):
+        if verbose:
+            print(f"Rung {rung}: {len(alive)} configuration(s) for {steps} steps")
+        for c in alive:
+            if c in results and results[c].stop_reason:
+                continue  # already stopped early: more steps won't change anything
+            summary = run(c, steps, progress[c])
+            progress[c] = summary.progress
+            results[c] = Result(c, summary.steps, score(summary), summary.stop_reason)
+        ranked = sorted(alive, key=lambda c: results[c].score)
+        alive = ranked[: max(1, len(alive) // eta)]
+        for c in ranked[len(alive) :]:
+            del progress[c]  # (histories can be big)
+    return sorted(results.values(), key=lambda r: r.score)
+
+
+@jaxtyped(typechecker=beartype)
+def hyperband(
+    sample: Callable[[int], List[Config]],
+    run: Run,
+    min_steps: int,
+    max_steps: int,
+    eta: int = ETA,
+    score: Score = final_loss,
+    verbose: bool = True,
+) -> List[Result]:
+    """
+    Successive halving from every starting budget in `budgets(min_steps, max_steps)`,
+    on `sample(n)` fresh configurations each. Every result, best first.
+    """
+    rungs = budgets(min_steps, max_steps, eta)
+    results: List[Result] = []
+    for s in reversed(range(len(rungs))):
+        n = math.ceil(len(rungs) / (s + 1) * eta**s)
+        if verbose:
+            print(f"Bracket {s}: {n} configuration(s) from {rungs[-1 - s]} steps")
+        results += successive_halving(
+            sample(n), run, rungs[-1 - s], max_steps, eta, score, verbose
+        )
+    return sorted(results, key=lambda r: r.score)
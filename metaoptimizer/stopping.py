@@ -0,0 +1,100 @@
+from beartype import beartype
+from beartype.typing import NamedTuple, Optional
+from check_and_compile import check_and_compile
+from jax import numpy as jnp
+from jaxtyping import jaxtyped, Array, Float32, UInt32
+
+
+# When to give up on (or call time on) a trial before `training_steps`.
+# Checked on-device once per chunk of steps (see `trial.run`),
+# so a check never makes the host wait on a step.
+
+# Saved as an index into this:
+REASONS = ("", "non-finite", "exploded", "plateau", "converged")
+NONE, NON_FINITE, EXPLODED, PLATEAU, CONVERGED = range(len(REASONS))
+
+
+class Criteria(NamedTuple):
+    # Any NaN or infinite loss:
+    non_finite: bool = True
+    # Any loss above this:
+    max_loss: Optional[float] = None
+    # This many chunks in a row without the mean loss beating the best so far
+    # by at least `min_improvement` (relative):
+    patience: Optional[int] = None
+    min_improvement: float = 1e-3
+    # Summed `metrics.LAYER_DISTANCES` (at the end of a chunk) below this:
+    min_distance: Optional[float] = None
+
+
+class State(NamedTuple):
+    best: Float32[Array, ""]  # lowest chunk-mean loss so far
+    waited: UInt32[Array, ""]  # chunks since `best` last improved
+    reason: UInt32[Array, ""]  # one of `REASONS` (`NONE` while still going)
+    steps: UInt32[Array, ""]  # steps that count (after a stop, no more are added)
+
+
+@jaxtyped(typechecker=beartype)
+def init() -> State:
+    return State(
+        best=jnp.array(jnp.inf, dtype=jnp.float32),
+        waited=jnp.array(0, dtype=jnp.uint32),
+        reason=jnp.array(NONE, dtype=jnp.uint32),
+        steps=jnp.array(0, dtype=jnp.uint32),
+    )
+
+
+@check_and_compile(3)
+def check(
+    state: State,
+    losses: Float32[Array, "chunk"],
+    distance: Optional[Float32[Array, ""]],
+    criteria: Criteria,
+) -> State:
+    """Fold in one chunk of steps. Once `state.reason` is set, nothing changes."""
+    n = losses.shape[0]
+    # Non-finite & exploded losses stop right after the first offending step:
+    bad = jnp.zeros([n], dtype=jnp.bool_)
+    if criteria.non_finite:
+        bad = bad | ~jnp.isfinite(losses)
+    if criteria.max_loss is not None:
+        exploded = jnp.isfinite(losses) & (losses > criteria.max_loss)
+        bad = bad | exploded
+    first_bad = jnp.argmax(bad)
+    any_bad = jnp.any(bad)
+    exploded_first = (
+        jnp.isfinite(losses[first_bad])
+        if criteria.max_loss is not None
+        else jnp.array(False)
+    )
+
+    mean = jnp.mean(losses)
+    improved = mean < state.best * (1 - criteria.min_improvement)
+    best = jnp.where(improved, mean, state.best)
+    waited = jnp.where(improved, 0, state.waited + 1).astype(jnp.uint32)
+    plateau = (
+        waited >= criteria.patience
+        if criteria.patience is not None
+        else jnp.array(False)
+    )
+    converged = (
+        distance < criteria.min_distance
+        if criteria.min_distance is not None and distance is not None
+        else jnp.array(False)
+    )
+
+    reason = jnp.select(
+        [any_bad & exploded_first, any_bad, converged, plateau],
+        [EXPLODED, NON_FINITE, CONVERGED, PLATEAU],
+        NONE,
+    ).astype(jnp.uint32)
+    steps = state.steps + jnp.where(any_bad, first_bad + 1, n).astype(jnp.uint32)
+
+    going = state.reason == NONE
+    keep = lambda new, old: jnp.where(going, new, old)
+    return State(
+        best=keep(best, state.best),
+        waited=keep(waited, state.waited),
+        reason=keep(reason, state.reason),
+        steps=keep(steps, state.steps),
+    )
@@ -0,0 +1,249 @@
+from beartype import beartype
+from beartype.typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from contextlib import contextmanager
+from functools import lru_cache
+from jaxtyping import jaxtyped
+import fcntl
+import json
+import numpy as np
+import os
+import struct
+import zlib
+
+
+# One append-only file per sweep instead of thousands of directories.
+# Layout: a sequence of records, each
+#   [prefix: MAGIC, header length, payload length, payload CRC32]
+#   [header: JSON (trial, name, dtype, shape, rows, transaction)]
+#   [payload: zlib-compressed C-ordered bytes for `rows` of the array]
+# Every `append` ends with a commit record; anything without one
+# (e.g. a process killed mid-write) is invisible to readers.
+# Replacing a trial leaves its old records behind as dead space,
+# until `compact` rewrites the file with only the live ones.
+EXTENSION = ".store"
+MAGIC = b"MOS1"
+PREFIX = struct.Struct("<4sIQI")
+COMMIT = ""
+CHUNK_BYTES = 1 << 20
+COMPRESSION_LEVEL = 1
+
+
+class Chunk(NamedTuple):
+    start: int
+    stop: int
+    offset: int
+    length: int
+    crc: int
+
+
+class Entry(NamedTuple):
+    dtype: str
+    shape: Tuple[int, ...]
+    chunks: List[Chunk]
+
+
+Index = Dict[str, Dict[str, Entry]]
+
+
+@jaxtyped(typechecker=beartype)
+def record(header: dict, payload: bytes) -> bytes:
+    h = json.dumps(header, separators=(",", ":")).encode()
+    return PREFIX.pack(MAGIC, len(h), len(payload), zlib.crc32(payload)) + h + payload
+
+
+@jaxtyped(typechecker=beartype)
+def chunks(x: np.ndarray) -> List[Tuple[int, int]]:
+    if x.ndim == 0:
+        return [(0, 1)]
+    n = x.shape[0]
+    row_bytes = max(1, x[:1].nbytes)
+    rows = max(1, CHUNK_BYTES // row_bytes)
+    return [(i, min(n, i + rows)) for i in range(0, max(n, 1), rows)]
+
+
+@contextmanager
+def locked(path: str):
+    while True:
+        with open(path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Waited on a file `compact` has since replaced? Lock the new one.
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                    yield f
+                    return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@jaxtyped(typechecker=beartype)
+def append(path: str, trial: str, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    Atomically (w.r.t. readers) add or replace every array for one trial.
+    Safe to call from many processes at once: each call is a single locked write.
+    """
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with locked(path) as f:
+        size = f.seek(0, os.SEEK_END)
+        _, valid = scan(path, size, os.fstat(f.fileno()).st_mtime_ns)
+        if valid < size:
+            f.truncate(valid)  # drop a torn tail so later records stay reachable
+        transaction = valid
+        blob = bytearray()
+        for name, x in arrays.items():
+            x = np.asarray(x, order="C")  # (`ascontiguousarray` would make 0-d 1-d)
+            for start, stop in chunks(x):
+                rows = x if x.ndim == 0 else x[start:stop]
+                blob += record(
+                    {
+                        "trial": trial,
+                        "name": name,
+                        "dtype": x.dtype.str,
+                        "shape": list(x.shape),
+                        "rows": [start, stop],
+                        "transaction": transaction,
+                    },
+                    zlib.compress(rows.tobytes(), COMPRESSION_LEVEL),
+                )
+        blob += record(
+            {"trial": trial, "name": COMMIT, "transaction": transaction},
+            b"",
+        )
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@lru_cache(maxsize=16)
+def scan(path: str, size: int, mtime_ns: int) -> Tuple[Index, int]:
+    committed: Index = {}
+    pending: Dict[int, Index] = {}
+    with open(path, "rb") as f:
+        offset = 0
+        while offset + PREFIX.size <= size:
+            f.seek(offset)
+            magic, header_len, payload_len, crc = PREFIX.unpack(f.read(PREFIX.size))
+            end = offset + PREFIX.size + header_len + payload_len
+            if magic != MAGIC or end > size:
+                break  # torn tail from a crashed writer
+            header = json.loads(f.read(header_len))
+            txn = pending.setdefault(header["transaction"], {})
+            if header["name"] == COMMIT:
+                committed.update(pending.pop(header["transaction"]))
+            else:
+                start, stop = header["rows"]
+                entry = txn.setdefault(header["trial"], {}).setdefault(
+                    header["name"],
+                    Entry(header["dtype"], tuple(header["shape"]), []),
+                )
+                entry.chunks.append(
+                    Chunk(start, stop, end - payload_len, payload_len, crc)
+                )
+            offset = end
+    return committed, offset
+
+
+@jaxtyped(typechecker=beartype)
+def contents(path: str) -> Index:
+    """Headers only, cached until the file changes."""
+    if not os.path.isfile(path):
+        return {}
+    st = os.stat(path)
+    committed, _ = scan(path, st.st_size, st.st_mtime_ns)
+    return committed
+
+
+@jaxtyped(typechecker=beartype)
+def contains(path: str, trial: str) -> bool:
+    return trial in contents(path)
+
+
+@jaxtyped(typechecker=beartype)
+def decode(f, entry: Entry, chunk: Chunk) -> np.ndarray:
+    f.seek(chunk.offset)
+    payload = f.read(chunk.length)
+    assert zlib.crc32(payload) == chunk.crc, f"Corrupt chunk in `{f.name}`"
+    x = np.frombuffer(zlib.decompress(payload), dtype=np.dtype(entry.dtype))
+    if len(entry.shape) == 0:
+        return x.reshape(())
+    return x.reshape(chunk.stop - chunk.start, *entry.shape[1:])
+
+
+@jaxtyped(typechecker=beartype)
+def read(
+    path: str,
+    trial: str,
+    name: str,
+    index: Union[int, slice, Tuple, None] = None,
+) -> np.ndarray:
+    """Decompress only the chunks overlapping the requested rows."""
+    entry = contents(path)[trial][name]
+    with open(path, "rb") as f:
+        if index is None or len(entry.shape) == 0:
+            if len(entry.shape) == 0:
+                x = decode(f, entry, entry.chunks[0])
+            else:
+                x = np.concatenate([decode(f, entry, c) for c in entry.chunks])
+            return np.array(x if index is None else x[index])
+        first, rest = (index[0], index[1:]) if isinstance(index, tuple) else (index, ())
+        rows = np.arange(entry.shape[0])[first]
+        if rows.size == 0:
+            return np.empty([0, *entry.shape[1:]], dtype=entry.dtype)[rest]
+        lo, hi = int(rows.min()), int(rows.max()) + 1
+        needed = [c for c in entry.chunks if c.start < hi and c.stop > lo]
+        block = np.concatenate([decode(f, entry, c) for c in needed])
+        x = block[rows - needed[0].start]
+        return np.array(x[rest] if rows.ndim == 0 else x[(slice(None), *rest)])
+
+
+@jaxtyped(typechecker=beartype)
+def compact(path: str) -> None:
+    """
+    Rewrite the store with only each trial's latest arrays (payloads copied as-is).
+    Writers wait for it, but readers don't: only run it while nothing is reading.
+    """
+    with locked(path) as f:
+        size = f.seek(0, os.SEEK_END)
+        index, _ = scan(path, size, os.fstat(f.fileno()).st_mtime_ns)
+        tmp = path + ".compact"
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            for trial, entries in index.items():
+                transaction = dst.tell()
+                for name, entry in entries.items():
+                    for chunk in entry.chunks:
+                        src.seek(chunk.offset)
+                        dst.write(
+                            record(
+                                {
+                                    "trial": trial,
+                                    "name": name,
+                                    "dtype": entry.dtype,
+                                    "shape": list(entry.shape),
+                                    "rows": [chunk.start, chunk.stop],
+                                    "transaction": transaction,
+                                },
+                                src.read(chunk.length),
+                            )
+                        )
+                dst.write(
+                    record(
+                        {"trial": trial, "name": COMMIT, "transaction": transaction},
+                        b"",
+                    )
+                )
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, path)
+
+
+@jaxtyped(typechecker=beartype)
+def split(path: str) -> Optional[Tuple[str, str]]:
+    """Split `<sweep>.store/<trial>` into the store file and the trial inside it."""
+    head, tail = path, ""
+    while head and not os.path.exists(head):
+        head, name = os.path.split(head)
+        tail = name if not tail else f"{name}/{tail}"
+    if head and os.path.isfile(head) and head.endswith(EXTENSION):
+        return head, tail
+    return None
@@ -0,0 +1,194 @@
+from beartype import beartype
+from beartype.typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+)
+from contextlib import contextmanager
+from jaxtyping import jaxtyped
+from urllib.parse import quote
+import fcntl
+import os
+import socket
+import threading
+import time
+
+
+# A work queue in a shared directory, so any number of worker processes
+# (on any number of machines that can see it) can split one sweep between them.
+# Per grid cell (e.g. one trial), the queue holds at most one file:
+#   `<cell>.claim`: someone's working on it (contents: who; mtime: last heartbeat)
+#   `<cell>.done`: finished
+# Claims whose heartbeat stops (a killed worker, a lost node) are re-issued.
+# Every state change happens under one `flock`, just like `store` & `aggregate`;
+# heartbeats only touch the worker's own claim, so they don't need it.
+EXTENSION = ".queue"
+HEARTBEAT_SECS = 30.0
+STALE_SECS = 120.0
+
+
+class Status(NamedTuple):
+    pending: List[str]
+    claimed: Dict[str, str]  # cell -> worker
+    stale: Dict[str, str]  # cell -> worker
+    done: List[str]
+
+
+@jaxtyped(typechecker=beartype)
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@jaxtyped(typechecker=beartype)
+def path(queue: str, cell: str, suffix: str) -> str:
+    # Cells are usually paths themselves (e.g. `1-layer/2-dimensional/...`):
+    return os.path.join(queue, quote(cell, safe="") + suffix)
+
+
+@contextmanager
+def locked(queue: str):
+    os.makedirs(queue, exist_ok=True)
+    with open(os.path.join(queue, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@jaxtyped(typechecker=beartype)
+def owner(queue: str, cell: str) -> Optional[str]:
+    try:
+        with open(path(queue, cell, ".claim")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@jaxtyped(typechecker=beartype)
+def age(queue: str, cell: str) -> float:
+    return time.time() - os.stat(path(queue, cell, ".claim")).st_mtime
+
+
+@jaxtyped(typechecker=beartype)
+def claim(
+    queue: str,
+    cells: Iterable[str],
+    worker: str,
+    stale_secs: float = STALE_SECS,
+    done: Optional[Set[str]] = None,
+) -> Optional[str]:
+    """
+    The first cell that's neither done nor (freshly) claimed, now claimed by `worker`.
+    Cells in `done` are skipped without touching the queue, & any newly found done
+    are added to it: done is forever, so a worker calling this over & over
+    (cf. `run`) only ever looks at the rest, not every cell every time.
+    """
+    done = set() if done is None else done
+    with locked(queue):
+        for cell in cells:
+            if cell in done:
+                continue
+            if os.path.exists(path(queue, cell, ".done")):
+                done.add(cell)
+                continue
+            if owner(queue, cell) is not None and age(queue, cell) < stale_secs:
+                continue
+            tmp = path(queue, cell, f".claim.{worker}")
+            with open(tmp, "w") as f:
+                f.write(worker)
+            os.replace(tmp, path(queue, cell, ".claim"))
+            return cell
+    return None
+
+
+@jaxtyped(typechecker=beartype)
+def heartbeat(queue: str, cell: str, worker: str) -> bool:
+    """Keep a claim alive. `False` if it's been re-issued to someone else."""
+    if owner(queue, cell) != worker:
+        return False
+    os.utime(path(queue, cell, ".claim"))
+    return True
+
+
+@jaxtyped(typechecker=beartype)
+def finish(queue: str, cell: str, worker: str) -> None:
+    """
+    Mark `cell` done, & drop `worker`'s claim on it
+    (if it's been re-issued, the new owner's claim is theirs to drop).
+    """
+    with locked(queue):
+        open(path(queue, cell, ".done"), "w").close()
+        if owner(queue, cell) == worker:
+            os.remove(path(queue, cell, ".claim"))
+
+
+@contextmanager
+def holding(queue: str, cell: str, worker: str, every: float = HEARTBEAT_SECS):
+    """Heartbeat from a background thread while the body runs."""
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(every):
+            if not heartbeat(queue, cell, worker):
+                print(
+                    f"Warning: `{cell}` was re-issued from {worker}; finishing anyway"
+                )
+                return
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@jaxtyped(typechecker=beartype)
+def run(
+    queue: str,
+    cells: List[str],
+    work: Callable[[str], None],
+    worker: Optional[str] = None,
+    heartbeat_secs: float = HEARTBEAT_SECS,
+    stale_secs: float = STALE_SECS,
+) -> List[str]:
+    """
+    Claim and `work` on cells until none are left (done or freshly claimed elsewhere).
+    Returns the cells this worker finished. `work` must be idempotent
+    (cf. `store.append` & `aggregate.update`): a re-issued cell can run twice.
+    """
+    worker = worker_id() if worker is None else worker
+    finished: List[str] = []
+    done: Set[str] = set()
+    while True:
+        cell = claim(queue, cells, worker, stale_secs, done)
+        if cell is None:
+            return finished
+        with holding(queue, cell, worker, heartbeat_secs):
+            work(cell)
+        finish(queue, cell, worker)
+        done.add(cell)
+        finished.append(cell)
+
+
+@jaxtyped(typechecker=beartype)
+def status(queue: str, cells: List[str], stale_secs: float = STALE_SECS) -> Status:
+    s = Status(pending=[], claimed={}, stale={}, done=[])
+    with locked(queue):
+        for cell in cells:
+            who = owner(queue, cell)
+            if os.path.exists(path(queue, cell, ".done")):
+                s.done.append(cell)
+            elif who is None:
+                s.pending.append(cell)
+            elif age(queue, cell) < stale_secs:
+                s.claimed[cell] = who
+            else:
+                s.stale[cell] = who
+    return s
@@ -0,0 +1,147 @@
+from beartype import beartype
+from beartype.typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from collections import defaultdict
+from functools import wraps
+from jax import monitoring, numpy as jnp
+from jax.tree_util import tree_flatten, tree_map
+from jaxtyping import jaxtyped
+import logging
+
+
+# Python bodies of compiled functions only ever run while JAX is tracing them,
+# so counting calls *inside* the function counts (re)traces, and nothing else.
+# The usual culprit is a static argument that compares unequal every time,
+# e.g. a fresh `lambda` (compared by identity) built for each trial.
+
+LOGGER = logging.getLogger(__name__)
+
+# In benchmark mode, any function traced more than this many times is an error:
+MAX_TRACES: Optional[int] = None
+
+# Both keyed by qualified name (e.g. `metaoptimizer.trial.step`), so they pair up:
+TRACES: Dict[str, int] = defaultdict(int)
+COMPILES: Dict[str, int] = defaultdict(int)
+SIGNATURES: Dict[str, Tuple[str, ...]] = {}
+# Compile events only name the function (e.g. `jit(step)`), not its module,
+# so every `count`ed function's short name -> its qualified name(s):
+QUALIFIED: Dict[str, Set[str]] = defaultdict(set)
+
+
+def on_event_duration(event: str, duration_secs: float, **kwargs) -> None:
+    if event.endswith("backend_compile_duration"):
+        # (older JAX versions don't report `fun_name`)
+        fun_name = str(kwargs.get("fun_name", "?"))
+        short = fun_name[4:-1] if fun_name.startswith("jit(") else fun_name
+        candidates = QUALIFIED.get(short, set())
+        # (ambiguous if two `count`ed functions share a name: left as JAX put it)
+        COMPILES[next(iter(candidates)) if len(candidates) == 1 else fun_name] += 1
+
+
+# Compiles are rare (and slow), so always counting them costs nothing:
+monitoring.register_event_duration_secs_listener(on_event_duration)
+
+
+@jaxtyped(typechecker=beartype)
+def describe(x: Any) -> str:
+    if callable(x):
+        # JAX hashes functions by identity, so the address is what matters:
+        name = getattr(x, "__qualname__", type(x).__name__)
+        return f"{name} at {id(x):#x}"
+    return repr(x)
+
+
+@jaxtyped(typechecker=beartype)
+def abstract(x: Any) -> str:
+    # Everything JAX keys its cache on: tree structure, shapes, dtypes, & weak types
+    # (e.g. a Python float `1.0` is a weakly-typed `float64[]`, and retraces as strong)
+    leaves, structure = tree_flatten(x)
+    avals: List[Any] = [getattr(y, "aval", y) for y in leaves]
+    described = [
+        (
+            f"{a.dtype}{list(a.shape)}{'(weak)' if getattr(a, 'weak_type', False) else ''}"
+            if hasattr(a, "dtype")
+            else repr(a)
+        )
+        for a in avals
+    ]
+    return f"{structure} {described}"
+
+
+@jaxtyped(typechecker=beartype)
+def strong(x: Any) -> Any:
+    """The same arrays without weak types (which JAX would compile separately)."""
+    return tree_map(lambda y: jnp.asarray(y, dtype=y.dtype), x)
+
+
+@jaxtyped(typechecker=beartype)
+def benchmark(max_traces: Optional[int] = 1) -> None:
+    """Fail loudly whenever a `count`ed function is traced more than `max_traces` times."""
+    global MAX_TRACES
+    MAX_TRACES = max_traces
+
+
+@jaxtyped(typechecker=beartype)
+def count(*static_argnums: int) -> Callable[[Callable], Callable]:
+    """
+    Decorate a function *under* `check_and_compile` (with the same static arguments)
+    to count its traces and log what changed whenever it's retraced.
+    """
+
+    def decorator(f: Callable) -> Callable:
+        name = f"{f.__module__}.{f.__qualname__}"
+        QUALIFIED[f.__name__].add(name)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            signature = tuple(
+                [
+                    (
+                        f"static #{i}: {describe(a)}"
+                        if i in static_argnums
+                        else f"#{i}: {abstract(a)}"
+                    )
+                    for i, a in enumerate(args)
+                ]
+                + [f"{k}: {abstract(v)}" for k, v in sorted(kwargs.items())]
+            )
+            TRACES[name] += 1
+            n = TRACES[name]
+            previous = SIGNATURES.get(name)
+            SIGNATURES[name] = signature
+            if previous is not None:
+                changed = [
+                    f"{old} -> {new}"
+                    for old, new in zip(previous, signature)
+                    if old != new
+                ] or ["(nothing visible: maybe a cache was cleared?)"]
+                message = f"Retracing `{name}` (trace #{n}) because " + "; ".join(
+                    changed
+                )
+                if MAX_TRACES is not None and n > MAX_TRACES:
+                    raise RuntimeError(
+                        message + f" (more than the allowed {MAX_TRACES} traces)"
+                    )
+                LOGGER.warning(message)
+            return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@jaxtyped(typechecker=beartype)
+def summary() -> str:
+    """Traces & compiles of every function so far, side by side."""
+    names = sorted(set(TRACES) | set(COMPILES))
+    return "\n".join(
+        [
+            f"{TRACES.get(n, 0):>6} traces  {COMPILES.get(n, 0):>6} compiles  {n}"
+            for n in names
+        ]
+    )
+
+
+@jaxtyped(typechecker=beartype)
+def reset() -> None:
+    for d in (TRACES, COMPILES, SIGNATURES):
+        d.clear()
@@ -1,14 +1,34 @@
 from metaoptimizer import permutations
-from metaoptimizer.optimizers import Optimizer
+from metaoptimizer.optimizers import Optimizer, OptParams, OptState
 
 from beartype import beartype
-from beartype.typing import Any, Callable, List, Tuple
+from beartype.typing import Any, Callable, List, Optional, Tuple
 from check_and_compile import check_and_compile
-from jax import grad, numpy as jnp, value_and_grad
+from jax import (
+    grad,
+    jacfwd,
+    lax,
+    named_scope,
+    numpy as jnp,
+    value_and_grad,
+    vjp,
+    vmap,
+)
+from jax.dtypes import float0
 from jax.errors import TracerBoolConversionError
 from jax.lax import stop_gradient
-from jax.tree_util import tree_map, tree_reduce, tree_structure
-from jaxtyping import jaxtyped, Array, Float32, Float64, PyTree, UInt32
+from jax.tree_util import tree_leaves, tree_map, tree_reduce, tree_structure
+from jaxtyping import (
+    jaxtyped,
+    Array,
+    Bool,
+    Float,
+    Float32,
+    Float64,
+    PyTree,
+    UInt32,
+)
+import numpy as np
 import operator
 import os
 import sys
@@ -22,6 +42,32 @@ ForwardPass = Callable[
 
 OPTIMIZER_LR = jnp.array(0.25, dtype=jnp.float64)
 
+# How `step_downhill` gets its meta-gradient:
+# differentiating `slope_away_from_local_minimum` (the reference),
+AUTODIFF = "autodiff"
+# the same, worked out by hand (see `slope_away_and_update`),
+ANALYTIC = "analytic"
+# or that *and* the weight update from a single optimizer call
+# (so the update uses this step's gradient, not the last one):
+FUSED = "fused"
+DOWNHILL_ENGINES = (AUTODIFF, ANALYTIC, FUSED)
+
+# How `meta_step` differentiates through the optimizer update:
+# reverse mode (one backward pass, but it keeps every weight-sized intermediate),
+REVERSE = "reverse"
+# forward mode (one tangent per hyperparameter, pushed alongside the update),
+FORWARD = "forward"
+# or whichever fits `opt_params` (see `hypergradient_mode`):
+AUTO = "auto"
+HYPERGRADIENT_MODES = (REVERSE, FORWARD, AUTO)
+# Up to this many scalar hyperparameters, forward mode is about as fast
+# (measured on CPU; past that, each extra tangent costs more than it saves):
+FORWARD_MAX_HYPERPARAMETERS = 4
+
+# Per-example gradients (see `example_grads`) are a copy of the weights per example,
+# so at most this many bytes of them at once (see `map_example_grads`):
+EXAMPLE_GRAD_BYTES = 2**27
+
 
 # @check_and_compile(1)
 @jaxtyped(typechecker=beartype)
@@ -53,6 +99,79 @@ def loss_and_grad(
     return value_and_grad(loss)(weights, forward_pass, inputs, ground_truth, power)
 
 
+@jaxtyped(typechecker=beartype)
+def example_chunk(
+    weights: PyTree[Float64[Array, "..."]],
+    batch: int,
+    budget: int = EXAMPLE_GRAD_BYTES,
+) -> int:
+    """
+    How many per-example gradients to hold at once: as few chunks as fit in `budget`,
+    split as evenly as possible (the batch is padded up to a multiple of this).
+    """
+    per_example = sum([x.size * x.dtype.itemsize for x in tree_leaves(weights)])
+    fit = min(batch, max(1, budget // per_example))
+    chunks = -(-batch // fit)
+    return -(-batch // chunks)
+
+
+# @check_and_compile(1)
+@jaxtyped(typechecker=beartype)
+def example_grads(
+    weights: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    real: Optional[Bool[Array, "batch"]] = None,
+) -> PyTree[Float64[Array, "batch ..."]]:
+    """
+    Each example's loss gradient (they sum to `loss_and_grad`'s),
+    or exactly zero for examples that aren't `real` (i.e. padding).
+    """
+    if real is None:
+        real = jnp.ones(inputs.shape[0], dtype=bool)
+    one = lambda x, y, r: grad(
+        lambda w: jnp.where(
+            r, loss(w, forward_pass, x[jnp.newaxis], y[jnp.newaxis], power), 0
+        )
+    )(weights)
+    return vmap(one)(inputs, ground_truth, real)
+
+
+# @check_and_compile(0, 2)
+@jaxtyped(typechecker=beartype)
+def map_example_grads(
+    f: Callable[[PyTree[Float64[Array, "..."]]], Array],
+    weights: PyTree[Float64[Array, "..."]],
+    forward_pass: ForwardPass,
+    inputs: Float32[Array, "batch ndim_in"],
+    ground_truth: Float32[Array, "batch ndim_out"],
+    power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    budget: int = EXAMPLE_GRAD_BYTES,
+) -> Float[Array, "batch ..."]:
+    """
+    `f` of each example's gradient, without ever holding more than `budget` bytes
+    of them (a loop over chunks of the batch, each chunk one `vmap`).
+    """
+    batch = inputs.shape[0]
+    chunk = example_chunk(weights, batch, budget)
+    chunks = -(-batch // chunk)
+    # Padded up to whole chunks, with the padding masked out (cf. `padding.loss`):
+    real = jnp.ones(batch, dtype=bool)  # (padded with `False`)
+    chunked = lambda a: jnp.pad(
+        a, [(0, chunks * chunk - batch), *[(0, 0) for _ in a.shape[1:]]]
+    ).reshape(chunks, chunk, *a.shape[1:])
+
+    def one_chunk(xyr: Tuple[Array, Array, Array]) -> Array:
+        g = example_grads(weights, forward_pass, *xyr[:2], power, xyr[2])
+        return vmap(f)(g)
+
+    out = lax.map(one_chunk, (chunked(inputs), chunked(ground_truth), chunked(real)))
+    # (& none of it reaches anything that sums over the batch)
+    return out.reshape(chunks * chunk, *out.shape[2:])[:batch]
+
+
 # @check_and_compile(1, 4)
 @jaxtyped(typechecker=beartype)
 def step(
@@ -61,12 +180,12 @@ def step(
     inputs: Float32[Array, "batch ndim_in"],
     ground_truth: Float32[Array, "batch ndim_out"],
     optim_parameterized: Optimizer,
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
 ) -> Tuple[
     PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, "..."]],
+    OptState,
     Float32[Array, ""],
 ]:
     L, dLdw = loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
@@ -84,13 +203,13 @@ def update_and_retest(
     inputs: Float32[Array, "batch ndim_in"],
     ground_truth: Float32[Array, "batch ndim_out"],
     optim_parameterized: Optimizer,
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     last_dLdw: PyTree[Float64[Array, "..."]],
     power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
 ) -> Tuple[
     Float32[Array, ""],
-    Tuple[PyTree[Float64[Array, "..."]], PyTree[Float64[Array, "..."]]],
+    Tuple[PyTree[Float64[Array, "..."]], OptState],
 ]:
     opt_state_adjusted, weights_adjusted = optim_parameterized(
         opt_params, opt_state, weights, last_dLdw
@@ -104,14 +223,13 @@ def update_and_retest(
 # @check_and_compile(2)
 @jaxtyped(typechecker=beartype)
 def slope_away_from_local_minimum(
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     optim_parameterized: Optimizer,
     weights: PyTree[Float64[Array, "..."]],
     dLdw: PyTree[Float64[Array, "..."]],
 ) -> Float64[Array, ""]:
-    # TODO: directly do the math instead of recomputing,
-    # but make sure it's right (at least here I'm sure)
+    # (The reference: `slope_away_and_update` does the math directly.)
     # ALL THIS IS REALLY DOING IS MINIMIZING `dLdw` BY MOVING `weights`
     _, actual = optim_parameterized(opt_params, opt_state, weights, dLdw)
     forgotten = stop_gradient(actual)
@@ -122,7 +240,44 @@ def slope_away_from_local_minimum(
     )
 
 
-# @check_and_compile(1, 4)
+# @check_and_compile(2)
+@jaxtyped(typechecker=beartype)
+def slope_away_and_update(
+    opt_params: OptParams,
+    opt_state: OptState,
+    optim_parameterized: Optimizer,
+    weights: PyTree[Float64[Array, "..."]],
+    dLdw: PyTree[Float64[Array, "..."]],
+) -> Tuple[
+    OptParams,
+    Tuple[OptState, PyTree[Float64[Array, "..."]]],
+]:
+    """
+    `grad(slope_away_from_local_minimum)` without re-running the optimizer
+    (plus the update itself, for free). In `actual`, the derivative of
+    `|stop_gradient(actual) - dLdw - actual|` is just `-sign(...)`, so the whole thing
+    is one VJP of the update with that as the cotangent.
+    """
+    (opt_state_adjusted, actual), pullback = vjp(
+        lambda p: optim_parameterized(p, opt_state, weights, dLdw), opt_params
+    )
+    # (evaluated exactly like the reference, including `jnp.abs`'s slope of 1 at 0)
+    away = tree_map(
+        lambda a, d: jnp.where((a - d) - a >= 0, -1.0, 1.0).astype(a.dtype),
+        actual,
+        dLdw,
+    )
+    # (no cotangent for the new state: integer leaves, e.g. `quantized` codes, need `float0`)
+    zero = lambda x: (
+        np.zeros(x.shape, float0)
+        if jnp.issubdtype(x.dtype, jnp.integer)
+        else jnp.zeros_like(x)
+    )
+    (dLdo,) = pullback((tree_map(zero, opt_state_adjusted), away))
+    return dLdo, (opt_state_adjusted, actual)
+
+
+# @check_and_compile(1, 4, 9)
 @jaxtyped(typechecker=beartype)
 def step_downhill(
     weights: PyTree[Float64[Array, "..."]],
@@ -130,41 +285,55 @@ def step_downhill(
     inputs: Float32[Array, "batch ndim_in"],
     ground_truth: Float32[Array, "batch ndim_out"],
     optim_parameterized: Optimizer,
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     last_dLdw: PyTree[Float64[Array, "..."]],
     power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    engine: str = ANALYTIC,
 ) -> Tuple[
     PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, ""]],
+    OptState,
+    OptParams,
     Float32[Array, ""],
     PyTree[Float64[Array, "..."]],
 ]:
     # TODO: This loss function probably won't make sense for Nesterov momentum,
     # since it makes no distinction between actual weights and returned weights
+    # (the actual ones are `nesterov.true_weights`, if we want them here)
+    assert engine in DOWNHILL_ENGINES, f"Unknown engine {engine} ({DOWNHILL_ENGINES})"
 
-    (L, (weights_adjusted, opt_state_adjusted)), dLdw = value_and_grad(
-        update_and_retest, has_aux=True
-    )(
-        weights,
-        forward_pass,
-        inputs,
-        ground_truth,
-        optim_parameterized,
-        opt_params,
-        opt_state,
-        last_dLdw,
-        power,
-    )
-    dLdo = grad(slope_away_from_local_minimum)(
-        opt_params,
-        opt_state,
-        optim_parameterized,
-        weights,
-        dLdw,
-    )
-    opt_params_adjusted: PyTree[Float64[Array, "..."]] = tree_map(
+    if engine == FUSED:
+        L, dLdw = loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
+        dLdo, (opt_state_adjusted, weights_adjusted) = slope_away_and_update(
+            opt_params, opt_state, optim_parameterized, weights, dLdw
+        )
+    else:
+        (L, (weights_adjusted, opt_state_adjusted)), dLdw = value_and_grad(
+            update_and_retest, has_aux=True
+        )(
+            weights,
+            forward_pass,
+            inputs,
+            ground_truth,
+            optim_parameterized,
+            opt_params,
+            opt_state,
+            last_dLdw,
+            power,
+        )
+        meta_gradient = (
+            grad(slope_away_from_local_minimum)
+            if engine == AUTODIFF
+            else lambda *args: slope_away_and_update(*args)[0]
+        )
+        dLdo = meta_gradient(
+            opt_params,
+            opt_state,
+            optim_parameterized,
+            weights,
+            dLdw,
+        )
+    opt_params_adjusted: OptParams = tree_map(
         lambda w, d: w - OPTIMIZER_LR * d,
         opt_params,
         dLdo,
@@ -181,18 +350,19 @@ def step_downhill(
 # @check_and_compile(2)
 @jaxtyped(typechecker=beartype)
 def opt_step_global(
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     optim_parameterized: Optimizer,
     weights: PyTree[Float64[Array, "..."]],
     dLdw: PyTree[Float64[Array, "..."]],
     global_minimum: PyTree[Float64[Array, "..."]],
+    units: Optional[List[Bool[Array, "_n"]]] = None,
 ) -> Tuple[
     Float32[Array, ""],
     Tuple[
+        OptState,
         PyTree[Float64[Array, "..."]],
-        PyTree[Float64[Array, "..."]],
-        List[UInt32[Array, "n"]],
+        List[UInt32[Array, "_n"]],
     ],
 ]:
     # try:
@@ -206,17 +376,78 @@ def opt_step_global(
     # except TracerBoolConversionError:
     #     sys.exit("Please don't JIT-compile `training.opt_step_global`!")
 
-    opt_state_adjusted, weights_adjusted = optim_parameterized(
-        opt_params, opt_state, weights, dLdw
+    with named_scope("optimizer_update"):
+        opt_state_adjusted, weights_adjusted = optim_parameterized(
+            opt_params, opt_state, weights, dLdw
+        )
+    with named_scope("layer_distance"):
+        L, perm = permutations.layer_distance(
+            actual=weights_adjusted,
+            ideal=global_minimum,
+            units=units,
+        )
+    return L, (opt_state_adjusted, weights_adjusted, perm)
+
+
+@jaxtyped(typechecker=beartype)
+def hypergradient_mode(opt_params: PyTree[Float64[Array, "..."]], mode: str) -> str:
+    """`mode`, with `AUTO` resolved by counting hyperparameters (static, from shapes)."""
+    assert mode in HYPERGRADIENT_MODES, f"Unknown mode {mode} ({HYPERGRADIENT_MODES})"
+    if mode != AUTO:
+        return mode
+    n = sum([x.size for x in tree_leaves(opt_params)])
+    return FORWARD if n <= FORWARD_MAX_HYPERPARAMETERS else REVERSE
+
+
+# @check_and_compile(2, 6)
+@jaxtyped(typechecker=beartype)
+def meta_step(
+    weights: PyTree[Float64[Array, "..."]],
+    dLdw: PyTree[Float64[Array, "..."]],
+    optim_parameterized: Optimizer,
+    opt_params: OptParams,
+    opt_state: OptState,
+    global_minimum: PyTree[Float64[Array, "..."]],
+    mode: str = AUTO,
+    units: Optional[List[Bool[Array, "_n"]]] = None,
+) -> Tuple[
+    PyTree[Float64[Array, "..."]],
+    OptState,
+    OptParams,
+    List[UInt32[Array, "_n"]],
+]:
+    """
+    Everything in `step_global` after the loss gradient
+    (which is the only part that ever sees the batch; cf. `parallel`).
+    `units` are which hidden units are real, if the weights are padded (see `padding`).
+    """
+    g = (
+        grad(opt_step_global, has_aux=True)
+        if hypergradient_mode(opt_params, mode) == REVERSE
+        else jacfwd(opt_step_global, has_aux=True)
     )
-    L, perm = permutations.layer_distance(
-        actual=weights_adjusted,
-        ideal=global_minimum,
+    # tragic we can't compile the above without wasting hours
+    # TODO: look into custom backprop?
+    with named_scope("meta_gradient"):
+        dLdo, (opt_state_adjusted, weights_adjusted, perm) = g(
+            opt_params,
+            opt_state,
+            optim_parameterized,
+            weights,
+            dLdw,
+            global_minimum,
+            units,
+        )
+    # (forward mode's come out in the loss's precision)
+    opt_params_adjusted: OptParams = tree_map(
+        lambda w, d: w - OPTIMIZER_LR * d.astype(w.dtype),
+        opt_params,
+        dLdo,
     )
-    return L, (opt_state_adjusted, weights_adjusted, perm)
+    return weights_adjusted, opt_state_adjusted, opt_params_adjusted, perm
 
 
-# @check_and_compile(1, 4)
+# @check_and_compile(1, 4, 9)
 @jaxtyped(typechecker=beartype)
 def step_global(
     weights: PyTree[Float64[Array, "..."]],
@@ -224,17 +455,20 @@ def step_global(
     inputs: Float32[Array, "batch ndim_in"],
     ground_truth: Float32[Array, "batch ndim_out"],
     optim_parameterized: Optimizer,
-    opt_params: PyTree[Float64[Array, ""]],
-    opt_state: PyTree[Float64[Array, "..."]],
+    opt_params: OptParams,
+    opt_state: OptState,
     global_minimum: PyTree[Float64[Array, "..."]],
     power: Float32[Array, ""] = jnp.array(2, dtype=jnp.float32),
+    mode: str = AUTO,
 ) -> Tuple[
     PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, ""]],
-    List[UInt32[Array, "n"]],
+    OptState,
+    OptParams,
+    List[UInt32[Array, "_n"]],
     Float32[Array, ""],
+    PyTree[Float64[Array, "..."]],
 ]:
+    """One step of training & of meta-learning, with the loss & gradient it took."""
     # try:
     #     assert tree_reduce(
     #         operator.and_,
@@ -246,22 +480,16 @@ def step_global(
     # except TracerBoolConversionError:
     #     sys.exit("Please don't JIT-compile `training.step_global`!")
 
-    L, dLdw = loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
-    g = grad(opt_step_global, has_aux=True)
-    # tragic we can't compile the above without wasting hours
-    # TODO: look into custom backprop?
-    dLdo, (opt_state_adjusted, weights_adjusted, perm) = g(
-        opt_params,
-        opt_state,
-        optim_parameterized,
+    with named_scope("loss_and_grad"):
+        L, dLdw = loss_and_grad(weights, forward_pass, inputs, ground_truth, power)
+    weights_adjusted, opt_state_adjusted, opt_params_adjusted, perm = meta_step(
         weights,
         dLdw,
-        global_minimum,
-    )
-    opt_params_adjusted: PyTree[Float64[Array, "..."]] = tree_map(
-        lambda w, d: w - OPTIMIZER_LR * d,
+        optim_parameterized,
         opt_params,
-        dLdo,
+        opt_state,
+        global_minimum,
+        mode,
     )
     return (
         weights_adjusted,
@@ -269,4 +497,5 @@ def step_global(
         opt_params_adjusted,
         perm,
         L,
+        dLdw,
     )
@@ -1,13 +1,35 @@
-from metaoptimizer import feedforward, permutations, training
-from metaoptimizer.training import ForwardPass, Optimizer
+from metaoptimizer import (
+    checkpoint,
+    data,
+    feedforward,
+    metrics,
+    parallel,
+    permutations,
+    profiling,
+    saving,
+    stopping,
+    tracing,
+    training,
+)
+from metaoptimizer.checkpoint import Progress
+from metaoptimizer.training import ForwardPass, Optimizer, OptParams, OptState
 from metaoptimizer.weights import layers, wb, Weights
 
 from beartype import beartype
-from beartype.typing import Callable, List, Optional, Tuple, TypeAlias
+from beartype.typing import (
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeAlias,
+)
 from check_and_compile import check_and_compile
 from importlib import import_module
-from jax import debug, nn as jnn, numpy as jnp, random as jrnd
+from jax import debug, named_scope, nn as jnn, numpy as jnp, random as jrnd
 from jax.experimental import io_callback
+from jax.sharding import Mesh
 from jax.tree_util import tree_flatten, tree_map, tree_unflatten
 from jaxtyping import (
     jaxtyped,
@@ -21,6 +43,7 @@ from jaxtyping import (
     UInt64,
 )
 import matplotlib.pyplot as plt
+import numpy as np
 from numpy import ndarray
 import operator
 import os
@@ -29,41 +52,119 @@ from time import time
 from types import ModuleType
 
 
-@check_and_compile(6, 7, 8, 9)
+class Summary(NamedTuple):
+    losses: Optional[ndarray]
+    weight_distances: Optional[ndarray]
+    converged: Optional[bool]
+    steps: int  # actually taken (fewer than asked for if stopped early)
+    stop_reason: str  # one of `stopping.REASONS`
+    progress: Progress  # to continue this trial later with `run(..., resume=...)`
+
+
+# Everything `run` carries from one step to the next:
+Snapshot: TypeAlias = Tuple[Weights, OptState, OptParams, List[UInt32[Array, "_n"]]]
+
+
+# Optimizer parameters as saved: (field, how to make it human-readable, output name)
+READABLE = [
+    ("log_lr", jnp.exp, "lr"),
+    ("inv_sig_moving_average_decay", jnn.sigmoid, "moving_average_decay"),
+    ("inv_sig_moving_square_decay", jnn.sigmoid, "moving_square_decay"),
+    ("inv_sig_moving_square_quotient", jnn.sigmoid, "moving_square_quotient"),
+    ("inv_sig_momentum", jnn.sigmoid, "momentum"),
+    ("log_overstep", jnp.exp, "overstep"),
+    ("inv_sig_weight_decay", jnn.sigmoid, "weight_decay"),
+    ("log_epsilon", jnp.exp, "epsilon"),
+]
+
+
+@jaxtyped(typechecker=beartype)
+def readable(history: OptParams) -> Dict[str, Array]:
+    """
+    `optimizer/*.npy` outputs from stacked `opt_params` (`[steps, ...]`).
+    Per-layer or per-unit ones (see `optimizers.granular`) get a file per array
+    of weights, each `[steps, units]` (e.g. `lr_0.npy`, `lr_1.npy`, ...).
+    """
+    outputs: Dict[str, Array] = {}
+    for field, f, name in READABLE:
+        if hasattr(history, field):
+            x = getattr(history, field)
+            if isinstance(x, list):
+                for i, xi in enumerate(x):
+                    outputs[f"optimizer/{name}_{i}.npy"] = f(
+                        xi.reshape(xi.shape[0], -1)
+                    )
+            else:
+                outputs[f"optimizer/{name}.npy"] = f(x)
+    return outputs
+
+
+@check_and_compile(7, 8, 9, 10)
+@tracing.count(7, 8, 9, 10)
 def step(
-    key: Array,
     w: Weights,
-    opt_state: PyTree[Float64[Array, "..."]],
-    opt_params: PyTree[Float64[Array, ""]],
+    opt_state: OptState,
+    opt_params: OptParams,
     w_ideal: Weights,
     power: Float32[Array, ""],
-    batch: int,
-    ndim: int,
+    block: data.Block,
+    i: UInt32[Array, ""],
     forward_pass: ForwardPass,
     optimizer: Optimizer,
+    metric_set: Tuple[str, ...] = (),
+    mesh: Optional[Mesh] = None,
 ) -> Tuple[
-    Array,
     Weights,
-    PyTree[Float64[Array, "..."]],
-    PyTree[Float64[Array, ""]],
-    List[UInt32[Array, "n"]],
+    OptState,
+    OptParams,
+    List[UInt32[Array, "_n"]],
     Float32[Array, ""],
+    metrics.Metrics,
 ]:
-    k, key = jrnd.split(key)
-    x = jrnd.normal(k, [batch, ndim], dtype=jnp.float32)
-    y_ideal = forward_pass(w_ideal, x)
-    w, opt_state, opt_params, permutation, L = training.step_global(
-        w,
-        forward_pass,
-        x,
-        y_ideal,
-        optimizer,
-        opt_params,
-        opt_state,
-        w_ideal,
-        power,
+    # This step's inputs & teacher outputs, generated ahead of time (see `data`):
+    x, y_ideal = block.x[i], block.y[i]
+    w_before = w
+    w, opt_state, opt_params, permutation, L, dLdw = (
+        training.step_global(
+            w,
+            forward_pass,
+            x,
+            y_ideal,
+            optimizer,
+            opt_params,
+            opt_state,
+            w_ideal,
+            power,
+        )
+        if mesh is None
+        else parallel.step_global(
+            mesh,
+            w,
+            forward_pass,
+            x,
+            y_ideal,
+            optimizer,
+            opt_params,
+            opt_state,
+            w_ideal,
+            power,
+        )
     )
-    return key, w, opt_state, opt_params, permutation, L
+    per_example = bool(set(metrics.PER_EXAMPLE) & set(metric_set))
+    with named_scope("per_example_grads"):
+        sq_norms = (
+            training.map_example_grads(
+                metrics.sq_norms, w_before, forward_pass, x, y_ideal, power
+            )
+            if per_example
+            else None
+        )
+    with named_scope("metrics"):
+        # (the gradient the step above already took, not a second one)
+        m = metrics.compute(
+            metric_set, w_before, w, w_ideal, permutation, dLdw, sq_norms
+        )
+    return w, opt_state, opt_params, permutation, L, m
 
 
 @jaxtyped(typechecker=beartype)
@@ -74,8 +175,8 @@ def run(
     layers: int,
     forward_pass: Callable,
     optimizer: Optimizer,
-    opt_state: PyTree[Float64[Array, "..."]],
-    opt_params: PyTree[Float64[Array, ""]],
+    opt_state: OptState,
+    opt_params: OptParams,
     nonlinearity: Callable[[Float32[Array, "*n"]], Float32[Array, "*n"]] = jnn.gelu,
     training_steps: int = 100000,
     subdir: Tuple = ("logs",),
@@ -92,18 +193,38 @@ def run(
     track_w_ideal_hist: bool = True,
     track_b_ideal_hist: bool = True,
     verbose: bool = True,
-) -> None:
+    store: Optional[str] = None,
+    metric_set: Tuple[str, ...] = (),
+    dataset: Optional[str] = None,
+    widths: Optional[Tuple[int, ...]] = None,
+    mesh: Optional[Mesh] = None,
+    stop: Optional[stopping.Criteria] = None,
+    resume: Optional[Progress] = None,
+    checkpoint_dir: Optional[str] = None,
+    checkpoint_every: int = checkpoint.CHECKPOINT_EVERY,
+) -> Summary:
 
     if track_convergence:
         assert track_weight_distances
 
+    # Which `metaoptimizer.metrics` to compute on-device at every step:
+    needs_distances = track_weight_distances or (
+        stop is not None and stop.min_distance is not None
+    )
+    if needs_distances and metrics.LAYER_DISTANCES not in metric_set:
+        metric_set = (metrics.LAYER_DISTANCES, *metric_set)
+
     if verbose:
         print(prefix + "Setting up the model architecture...")
 
+    trial_key = key
     k1, k2 = jrnd.split(key)
 
     # Weight initialization (note `w_ideal` is really the *goal*)
-    shapes = tuple([ndim for _ in range(layers + 1)])
+    # Input first; by default, every layer is `ndim`-by-`ndim`:
+    shapes = tuple([ndim for _ in range(layers + 1)]) if widths is None else widths
+    assert len(shapes) == layers + 1, f"{len(shapes)} widths for {layers} layers"
+    assert shapes[0] == ndim, f"Input width {shapes[0]} =/= `ndim` ({ndim})"
     w_ideal = feedforward.init(shapes, k1, True)
 
     # Uncomment if you want `w` to start already very close to `w_ideal`:
@@ -115,335 +236,343 @@ def run(
         w_keys,
     )
 
+    # Picking up where an earlier process (e.g. one that was killed) left off:
+    if checkpoint_dir is not None:
+        fresh = Progress(
+            steps=0,
+            block_steps=0,
+            w=w,
+            opt_state=opt_state,
+            opt_params=opt_params,
+            permutation=[jnp.arange(n, dtype=jnp.uint32) for n in shapes[1:-1]],
+            stop=stopping.init(),
+            losses=[] if track_losses else None,
+            metrics=[],
+            permutations=[] if track_permutations else None,
+            opt_params_hist=[] if track_opt_params_hist else None,
+            w_hist=[] if track_w_hist else None,
+            b_hist=[] if track_b_hist else None,
+        )
+        setup = checkpoint.fingerprint(fresh)
+        if resume is None:
+            resume = checkpoint.load(checkpoint_dir, trial_key, fresh)
+            if resume is not None and verbose:
+                print(
+                    prefix + f"Resuming from step {resume.steps} (`{checkpoint_dir}`)"
+                )
+
+    # Picking up where an earlier call left off, the same trial (same `key`)
+    # just with more `training_steps`:
+    start = 0
+    if resume is not None:
+        assert (
+            resume.steps <= training_steps
+        ), f"Resuming at step {resume.steps} of only {training_steps}"
+        start = resume.steps
+        w, opt_state, opt_params = resume.w, resume.opt_state, resume.opt_params
+
     # Replicable pseudorandomness
     key = jrnd.PRNGKey(42)  # the answer
 
-    # Record-keeping
-    losses = (
-        jnp.empty(
-            [training_steps],
-            dtype=jnp.float32,
-        )
-        if track_losses
-        else None
+    # Inputs & teacher outputs, a block ahead of the training loop
+    # (either freshly generated, or from a fixed dataset on disk;
+    # with a `mesh`, each device holds a slice of every batch: see `parallel`):
+    block_steps = (
+        min(data.BLOCK_STEPS, training_steps) if resume is None else resume.block_steps
     )
-    weight_distances = (
-        jnp.empty(
-            [training_steps, layers],
-            dtype=jnp.float32,
+    sharding = None if mesh is None else parallel.sharded(mesh, axis=1)
+    batches = (
+        data.stream(
+            key, w_ideal, batch, ndim, forward_pass, block_steps, sharding, start
         )
-        if track_weight_distances
-        else None
-    )
-    permutation_history = (
-        jnp.empty(
-            [training_steps, layers - 1, ndim],
-            dtype=jnp.uint32,
-        )
-        if track_permutations
-        else None
-    )
-    opt_params_hist: Optional[List[PyTree[Float64[Array, ""]]]] = (
-        [] if track_opt_params_hist else None
+        if dataset is None
+        else data.finite(dataset, batch, block_steps, sharding, start)
     )
-    w_hist = (
-        jnp.empty(
-            [training_steps, layers, ndim, ndim],
-            dtype=jnp.float32,
-        )
-        if track_w_hist
-        else None
-    )
-    b_hist = (
-        jnp.empty(
-            [training_steps, layers, ndim],
-            dtype=jnp.float32,
-        )
-        if track_b_hist
-        else None
-    )
-    w_ideal_hist = (
-        jnp.empty(
-            [training_steps, layers, ndim, ndim],
-            dtype=jnp.float32,
-        )
-        if track_w_ideal_hist
-        else None
+
+    # `step` returns strongly-typed arrays, so feeding it weakly-typed defaults
+    # (e.g. from `jnp.array(0.01)`) would compile it twice:
+    opt_state, opt_params = tracing.strong((opt_state, opt_params))
+
+    # Record-keeping (device arrays, one per step, stacked once at the end:
+    # appending never waits on the device, unlike writing into a host buffer)
+    losses: Optional[List[Float32[Array, ""]]] = [] if track_losses else None
+    metric_hist: List[metrics.Metrics] = []
+    permutation_history: Optional[List[List[UInt32[Array, "_width"]]]] = (
+        [] if track_permutations else None
     )
-    b_ideal_hist = (
-        jnp.empty(
-            [training_steps, layers, ndim],
-            dtype=jnp.float32,
-        )
-        if track_b_ideal_hist
-        else None
+    opt_params_hist: Optional[List[OptParams]] = [] if track_opt_params_hist else None
+    w_hist: Optional[List[List[Float32[Array, "n_out n_in"]]]] = (
+        [] if track_w_hist else None
     )
+    b_hist: Optional[List[List[Float32[Array, "n_out"]]]] = [] if track_b_hist else None
+
+    stop_state = stopping.init()
+    # The state after every step of this chunk & the one before, so a stop can hand
+    # back the state as of the step that triggered it (which can be mid-chunk, e.g.
+    # the step before a non-finite loss). These are only references to arrays
+    # each step makes anyway, but they do keep up to two chunks' worth alive:
+    states: List[Snapshot] = []
+    previous_states: List[Snapshot] = []
+    if resume is not None:
+        # (copies: appending to these mustn't change `resume`)
+        copy = lambda h, tracked: None if h is None or not tracked else list(h)
+        losses = copy(resume.losses, track_losses)
+        metric_hist = list(resume.metrics)
+        permutation_history = copy(resume.permutations, track_permutations)
+        opt_params_hist = copy(resume.opt_params_hist, track_opt_params_hist)
+        w_hist = copy(resume.w_hist, track_w_hist)
+        b_hist = copy(resume.b_hist, track_b_hist)
+        permutation = resume.permutation
+        stop_state = resume.stop
+        if int(stop_state.reason) == stopping.NONE:
+            # (in case `resume` came from a run without early stopping)
+            steps_so_far = jnp.array(resume.steps, dtype=jnp.uint32)
+            stop_state = stop_state._replace(steps=steps_so_far)
+        elif stop is not None:
+            start = training_steps  # (it's already stopped: nothing left to do)
 
     if verbose:
         print(prefix + "Entering the training loop...")
 
-    # Training loop:
+    # Training loop, checked for early stopping every 1% (see `stopping`):
     train_one_percent = training_steps // 100
     assert (
         train_one_percent * 100 == training_steps
     ), f"Training steps must be a multiple of 100, but it was {training_steps}"
+    last_checkpoint = start
+    # Histories from `start` to `last_checkpoint`, already stacked for checkpoints:
+    segments: Dict[str, List[PyTree[Array]]] = {}
     if verbose:
         t0 = time()
-    for pct in range(100):
-        for i in range(pct * train_one_percent, (pct + 1) * train_one_percent):
-
-            key, w, opt_state, opt_params, permutation, L = step(
-                key,
-                w,
-                opt_state,
-                opt_params,
-                w_ideal,
-                power,
-                batch,
-                ndim,
-                forward_pass,
-                optimizer,
-            )
-
-            if losses is not None:
-                losses[i] = jnp.array(L)
+    first: int = start
+    # State after `n` steps, for `n` in the last two chunks:
+    after = lambda n: (previous_states + states)[n - first + len(previous_states) - 1]
+    for first in range(start, training_steps, train_one_percent):
+        chunk: List[Float32[Array, ""]] = []
+        if stop is not None:
+            previous_states, states = states, []
+        for i in range(first, min(first + train_one_percent, training_steps)):
+
+            profiling.at_step(i)
+            with profiling.span("step"):
+                block, j = next(batches)
+                w, opt_state, opt_params, permutation, L, m = profiling.block(
+                    step(
+                        w,
+                        opt_state,
+                        opt_params,
+                        w_ideal,
+                        power,
+                        block,
+                        j,
+                        forward_pass,
+                        optimizer,
+                        metric_set,
+                        mesh,
+                    )
+                )
 
-            for layer in range(layers):
+            with profiling.span("record"):
+                chunk.append(L)
 
-                if weight_distances is not None:
-                    wb_actual = wb(w)
-                    wb_ideal = wb(w_ideal)
-                    weight_distances[i, layer] = jnp.sum(
-                        jnp.abs(wb_actual[layer] - wb_ideal[layer])
-                    )
+                if stop is not None:
+                    states.append((w, opt_state, opt_params, permutation))
 
-                if permutation_history is not None:
-                    permutation_history[i] = (
-                        jnp.array(permutation, dtype=jnp.uint32)
-                        if layers > 1
-                        else jnp.empty([0, 1], dtype=jnp.uint32)
-                    )
+                if losses is not None:
+                    losses.append(L)
 
-            if opt_params_hist is not None:
-                opt_params_hist.append(opt_params)
+                if metric_set:
+                    metric_hist.append(m)
 
-            if w_hist is not None:
-                w_hist[i] = w.W
+                if permutation_history is not None:
+                    permutation_history.append(permutation)
 
-            if b_hist is not None:
-                b_hist[i] = w.B
+                if opt_params_hist is not None:
+                    opt_params_hist.append(opt_params)
 
-            if w_ideal_hist is not None:
-                w_ideal_hist[i] = w_ideal.W
+                # (saved as float32, like everything else recorded)
+                if w_hist is not None:
+                    w_hist.append([W.astype(jnp.float32) for W in w.W])
 
-            if b_ideal_hist is not None:
-                b_ideal_hist[i] = w_ideal.B
+                if b_hist is not None:
+                    b_hist.append([B.astype(jnp.float32) for B in w.B])
 
         if verbose:
-            print(prefix + f"{pct + 1}%")
+            print(prefix + f"{100 * (i + 1) // training_steps}%")
+
+        if stop is not None:
+            previous = stop_state
+            distance = (
+                jnp.sum(m[metrics.LAYER_DISTANCES])
+                if stop.min_distance is not None
+                else None
+            )
+            stop_state = stopping.check(stop_state, saving.stack(chunk), distance, stop)
+            # Only ever look at the *previous* chunk's verdict, which is long done,
+            # so the device already has this chunk queued up and never sits idle
+            # (at the cost of one wasted chunk once a trial does stop):
+            if int(previous.reason) != stopping.NONE:
+                break
+
+        if checkpoint_dir is not None and i + 1 - last_checkpoint >= checkpoint_every:
+            with profiling.span("checkpoint"):
+                stacked = checkpoint.save(
+                    checkpoint_dir,
+                    Progress(
+                        steps=i + 1,
+                        block_steps=block_steps,
+                        w=w,
+                        opt_state=opt_state,
+                        opt_params=opt_params,
+                        permutation=permutation,
+                        stop=stop_state,
+                        losses=losses,
+                        metrics=metric_hist,
+                        permutations=permutation_history,
+                        opt_params_hist=opt_params_hist,
+                        w_hist=w_hist,
+                        b_hist=b_hist,
+                    ),
+                    last_checkpoint,
+                    trial_key,
+                    setup,
+                )
+            for name, x in stacked.items():
+                segments.setdefault(name, []).append(x)
+            last_checkpoint = i + 1
+
+    # Everything after a stop is thrown away:
+    steps = int(stop_state.steps) if stop is not None else training_steps
+    if steps > start and int(stop_state.reason) != stopping.NONE:
+        w, opt_state, opt_params, permutation = after(steps)
+    reason = stopping.REASONS[int(stop_state.reason)] if stop is not None else ""
+    recorded = [losses, metric_hist, permutation_history, opt_params_hist, w_hist]
+    for history in [*recorded, b_hist]:
+        if history is not None:
+            del history[steps:]
     if verbose:
         print(prefix + f"Done in {int(time() - t0)} seconds")
-
-    # return (
-    #     losses,
-    #     weight_distances,
-    #     permutation_history,
-    #     opt_params_hist,
-    #     w_hist,
-    #     b_hist,
-    #     w_ideal_hist,
-    #     b_ideal_hist,
-    # )
+        if reason:
+            print(prefix + f"Stopped early ({reason}) after {steps} steps")
 
     if verbose:
         print(prefix + "Saving...")
 
-    cwd = os.getcwd()
-    cwd = os.path.join(cwd, *subdir)
-    path = lambda *args: os.path.join(cwd, *args)
+    profiling.finish()
+
+    # Everything below is a handful of vectorized device ops;
+    # the transfer to the host and the file I/O happen in the background
+    # (see `metaoptimizer.saving`) while the caller moves on to the next trial.
+    outputs: Dict[str, Array] = {}
 
-    if os.path.exists(path()):
-        shutil.rmtree(path(), ignore_errors=True)
-    os.makedirs(path("weight_distances"))
-    os.makedirs(path("optimizer"))
-    os.makedirs(path("weights"))
+    def stack(name: str, h: List) -> PyTree[Array]:
+        pieces = segments.get(name, [])
+        if not pieces or steps < last_checkpoint:
+            return saving.stack(h)
+        parts = [saving.stack(h[:start])] if start else []
+        parts += pieces
+        if steps > last_checkpoint:
+            parts.append(saving.stack(h[last_checkpoint:]))
+        return tree_map(lambda *x: jnp.concatenate(x), *parts)
 
     w_ideal_permuted = permutations.permute_hidden_layers(w_ideal, permutation)
 
-    @jaxtyped(typechecker=beartype)
-    def save(x, *args) -> None:
-        if verbose:
-            print(prefix + f"Saving `{path(*args)}`...")
-        jnp.save(path(*args), jnp.array(x), allow_pickle=False)
+    outputs["stopping/reason.npy"] = stop_state.reason
+    outputs["stopping/steps.npy"] = jnp.array(steps, dtype=jnp.uint32)
 
     if losses is not None:
-        save(losses, "losses.npy")
-
-    for i in range(layers):
-
-        if weight_distances is not None:
-            save(
-                weight_distances[:, i],
-                "weight_distances",
-                f"layer_{i}.npy",
-            )
-
-            if track_convergence:
-                save(
-                    jnp.less(
-                        jnp.sum(jnp.array(weight_distances[-1])),
-                        jnp.sum(jnp.array(weight_distances[0])),
-                    ),
-                    "closer_or_not.npy",
-                )
-
-        os.makedirs(path("weights", f"layer_{i}", "weights"))
-        os.makedirs(path("weights", f"layer_{i}", "biases"))
-        if w_hist is not None:
-            save(
-                jnp.array([jnp.ravel(wh[i]) for wh in w_hist]),
-                "weights",
-                f"layer_{i}",
-                "weights",
-                "w_historical.npy",
-            )
-        if b_hist is not None:
-            save(
-                jnp.array([jnp.ravel(bh[i]) for bh in b_hist]),
-                "weights",
-                f"layer_{i}",
-                "biases",
-                "w_historical.npy",
+        outputs["losses.npy"] = stack("losses", losses)
+
+    # {name: [steps, layers]}
+    metric_arrays = stack("metrics", metric_hist) if metric_hist else {}
+    for name, arr in metric_arrays.items():
+        if name != metrics.LAYER_DISTANCES:
+            outputs[f"metrics/{name}.npy"] = arr
+
+    if track_weight_distances:
+        distances = metric_arrays[metrics.LAYER_DISTANCES]
+        for i in range(layers):
+            outputs[f"weight_distances/layer_{i}.npy"] = distances[:, i]
+        if track_convergence:
+            outputs["closer_or_not.npy"] = jnp.less(
+                jnp.sum(distances[-1]), jnp.sum(distances[0])
             )
-        if w_ideal_hist is not None:
-            save(
-                jnp.array([jnp.ravel(wh[i]) for wh in w_ideal_hist]),
-                "weights",
-                f"layer_{i}",
-                "weights",
-                "w_ideal_historical.npy",
-            )
-        if b_ideal_hist is not None:
-            save(
-                jnp.array([jnp.ravel(bh[i]) for bh in b_ideal_hist]),
-                "weights",
-                f"layer_{i}",
-                "biases",
-                "w_ideal_historical.npy",
-            )
-        save(
-            w_ideal.W[i],
-            "weights",
-            f"layer_{i}",
-            "weights",
-            "ideal_orig.npy",
-        )
-        save(
-            w_ideal_permuted.W[i],
-            "weights",
-            f"layer_{i}",
-            "weights",
-            "ideal_perm.npy",
-        )
-        save(
-            w.W[i],
-            "weights",
-            f"layer_{i}",
-            "weights",
-            "final.npy",
-        )
-        save(
-            w_ideal.B[i],
-            "weights",
-            f"layer_{i}",
-            "biases",
-            "ideal_orig.npy",
-        )
-        save(
-            w_ideal_permuted.B[i],
-            "weights",
-            f"layer_{i}",
-            "biases",
-            "ideal_perm.npy",
-        )
-        save(
-            w.B[i],
-            "weights",
-            f"layer_{i}",
-            "biases",
-            "final.npy",
-        )
 
-    if permutation_history is not None:
+    # [steps][layers][...] -> per layer, [steps, everything else flattened]:
+    per_layer = lambda name, h: [x.reshape(x.shape[0], -1) for x in stack(name, h)]
+    # `w_ideal` never changes, so there's nothing to record per step:
+    constant = lambda xs: [jnp.broadcast_to(x.reshape(-1), (steps, x.size)) for x in xs]
+    histories = {
+        ("weights", "w_historical.npy"): (
+            None if w_hist is None else per_layer("w_hist", w_hist)
+        ),
+        ("biases", "w_historical.npy"): (
+            None if b_hist is None else per_layer("b_hist", b_hist)
+        ),
+        ("weights", "w_ideal_historical.npy"): (
+            constant(w_ideal.W) if track_w_ideal_hist else None
+        ),
+        ("biases", "w_ideal_historical.npy"): (
+            constant(w_ideal.B) if track_b_ideal_hist else None
+        ),
+    }
+    for i in range(layers):
+        for (kind, name), h in histories.items():
+            if h is not None:
+                outputs[f"weights/layer_{i}/{kind}/{name}"] = h[i]
+        outputs[f"weights/layer_{i}/weights/ideal_orig.npy"] = w_ideal.W[i]
+        outputs[f"weights/layer_{i}/weights/ideal_perm.npy"] = w_ideal_permuted.W[i]
+        outputs[f"weights/layer_{i}/weights/final.npy"] = w.W[i]
+        outputs[f"weights/layer_{i}/biases/ideal_orig.npy"] = w_ideal.B[i]
+        outputs[f"weights/layer_{i}/biases/ideal_perm.npy"] = w_ideal_permuted.B[i]
+        outputs[f"weights/layer_{i}/biases/final.npy"] = w.B[i]
+
+    if permutation_history is not None and layers > 1:
+        # (hidden layers can be different widths, so stack each separately)
+        perms = stack("permutations", permutation_history)
         for i in range(layers - 1):
-            save(
-                permutation_history[i],
-                f"layer_{i}_permutation.npy",
-            )
+            outputs[f"layer_{i}_permutation.npy"] = perms[i]
 
     if opt_params_hist is not None:
-        if hasattr(opt_params_hist[0], "log_lr"):
-            save(
-                jnp.array([jnp.exp(p.log_lr) for p in opt_params_hist]),
-                "optimizer",
-                "lr.npy",
-            )
-        if hasattr(opt_params_hist[0], "inv_sig_moving_average_decay"):
-            save(
-                jnp.array(
-                    [
-                        jnn.sigmoid(p.inv_sig_moving_average_decay)
-                        for p in opt_params_hist
-                    ]
-                ),
-                "optimizer",
-                "moving_average_decay.npy",
-            )
-        if hasattr(opt_params_hist[0], "inv_sig_moving_square_decay"):
-            save(
-                jnp.array(
-                    [
-                        jnn.sigmoid(p.inv_sig_moving_square_decay)
-                        for p in opt_params_hist
-                    ]
-                ),
-                "optimizer",
-                "moving_square_decay.npy",
-            )
-        if hasattr(opt_params_hist[0], "inv_sig_moving_square_quotient"):
-            save(
-                jnp.array(
-                    [
-                        jnn.sigmoid(p.inv_sig_moving_square_quotient)
-                        for p in opt_params_hist
-                    ]
-                ),
-                "optimizer",
-                "moving_square_quotient.npy",
-            )
-        if hasattr(opt_params_hist[0], "inv_sig_momentum"):
-            save(
-                jnp.array([jnn.sigmoid(p.inv_sig_momentum) for p in opt_params_hist]),
-                "optimizer",
-                "momentum.npy",
-            )
-        if hasattr(opt_params_hist[0], "log_overstep"):
-            save(
-                jnp.array([jnp.exp(p.log_overstep) for p in opt_params_hist]),
-                "optimizer",
-                "overstep.npy",
-            )
-        if hasattr(opt_params_hist[0], "inv_sig_weight_decay"):
-            save(
-                jnp.array(
-                    [jnn.sigmoid(p.inv_sig_weight_decay) for p in opt_params_hist]
-                ),
-                "optimizer",
-                "weight_decay.npy",
-            )
-        if hasattr(opt_params_hist[0], "log_epsilon"):
-            save(
-                jnp.array([jnp.exp(p.log_epsilon) for p in opt_params_hist]),
-                "optimizer",
-                "epsilon.npy",
-            )
+        outputs.update(readable(stack("opt_params_hist", opt_params_hist)))
+
+    # With a `store`, everything for this trial goes into one append to one file
+    # (keyed by `subdir`) instead of a directory tree of tiny `.npy` files:
+    with profiling.span("save"):
+        saving.save(
+            os.path.join(os.getcwd(), *subdir),
+            outputs,
+            store=store,
+            trial="/".join(subdir),
+            prefix=prefix,
+            verbose=verbose,
+        )
+
+    if profiling.ENABLED:
+        print(profiling.summary())
+        print(tracing.summary())
+        profiling.reset()
+
+    # Small enough to hand back for running aggregates (see `metaoptimizer.aggregate`):
+    return Summary(
+        losses=None if losses is None else np.asarray(outputs["losses.npy"]),
+        weight_distances=np.asarray(distances) if track_weight_distances else None,
+        converged=bool(outputs["closer_or_not.npy"]) if track_convergence else None,
+        steps=steps,
+        stop_reason=reason,
+        progress=Progress(
+            steps=steps,
+            block_steps=block_steps,
+            w=w,
+            opt_state=opt_state,
+            opt_params=opt_params,
+            permutation=permutation,
+            stop=stop_state,
+            losses=losses,
+            metrics=metric_hist,
+            permutations=permutation_history,
+            opt_params_hist=opt_params_hist,
+            w_hist=w_hist,
+            b_hist=b_hist,
+        ),
+    )
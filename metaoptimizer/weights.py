@@ -6,29 +6,43 @@ from jaxtyping import jaxtyped, Array, Float32, Float64
 
 
 class Weights(NamedTuple):
-    W: Float64[Array, "n_layers n_out n_in"]
-    B: Float64[Array, "n_layers n_out"]
+    # One array per layer, so layers needn't be square or the same size
+    # (e.g. 784 -> 512 -> 256 -> 10), and nothing is wasted on padding.
+    # (Underscored axes aren't matched across layers, which can all differ.)
+    W: List[Float64[Array, "_n_out _n_in"]]
+    B: List[Float64[Array, "_n_out"]]
 
 
 @jaxtyped(typechecker=beartype)
 def layers(w: Weights) -> int:
-    assert jnp.issubdtype(w.W.dtype, jnp.float64)
-    assert jnp.issubdtype(w.B.dtype, jnp.float64)
-    n = w.W.shape[0]
-    assert n == w.B.shape[0]
+    n = len(w.W)
+    assert n == len(w.B), f"{n} =/= {len(w.B)}"
+    for W, B in zip(w.W, w.B):
+        assert jnp.issubdtype(W.dtype, jnp.float64)
+        assert jnp.issubdtype(B.dtype, jnp.float64)
     return n
 
 
+@jaxtyped(typechecker=beartype)
+def sizes(w: Weights) -> List[int]:
+    """Layer widths, input first, e.g. `[784, 512, 256, 10]`."""
+    assert layers(w) > 0
+    return [w.W[0].shape[1], *[W.shape[0] for W in w.W]]
+
+
 # @check_and_compile()
 @jaxtyped(typechecker=beartype)
-def wb(weights: Weights) -> Float32[Array, "n_layers n_out n_in_plus_1"]:
-    assert weights.W.ndim == 3
-    assert weights.B.ndim == 2
-    assert weights.W.shape[:-1] == weights.B.shape
-    assert jnp.issubdtype(weights.W.dtype, jnp.float64)
-    assert jnp.issubdtype(weights.B.dtype, jnp.float64)
-    w = weights.W.astype(jnp.float32)
-    b = weights.B.astype(jnp.float32)[..., jnp.newaxis]
-    y = jnp.concat([w, b], axis=-1)
-    assert y.shape == (*weights.W.shape[:-1], weights.W.shape[-1] + 1)
-    return y
+def wb(weights: Weights) -> List[Float32[Array, "_n_out _n_in_plus_1"]]:
+    out = []
+    for W, B in zip(weights.W, weights.B):
+        assert W.ndim == 2
+        assert B.ndim == 1
+        assert W.shape[:-1] == B.shape
+        assert jnp.issubdtype(W.dtype, jnp.float64)
+        assert jnp.issubdtype(B.dtype, jnp.float64)
+        y = jnp.concat(
+            [W.astype(jnp.float32), B.astype(jnp.float32)[..., jnp.newaxis]], axis=-1
+        )
+        assert y.shape == (*W.shape[:-1], W.shape[-1] + 1)
+        out.append(y)
+    return out
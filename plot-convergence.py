@@ -1,10 +1,23 @@
-from metaoptimizer import feedforward, trial
+from metaoptimizer import aggregate, feedforward, saving, store, sweep, trial
 
+from beartype.typing import Dict, NamedTuple
+from functools import lru_cache
 from jax import nn as jnn, numpy as jnp, random as jrnd
+from jaxtyping import Array, Float32
+from matplotlib import pyplot as plt
+import numpy as np
 import os
+import sys
 
 
 DIRECTORY = ["convergence-rates"]
+# One append-only file for the whole sweep instead of ~3000 directories
+# (set to `None` to get the old directory-per-trial layout):
+STORE = os.path.join(*DIRECTORY) + store.EXTENSION
+# Running per-cell statistics, so plotting never re-reads individual trials:
+AGGREGATES = os.path.join(*DIRECTORY) + aggregate.EXTENSION
+# Which trials are done or being run, and by whom (see `metaoptimizer.sweep`):
+QUEUE = os.path.join(*DIRECTORY) + sweep.EXTENSION
 
 TRIALS = 32
 NONLINEARITY = jnn.gelu
@@ -15,67 +28,153 @@ from metaoptimizer.optimizers import (
     # adam as optim,
 )
 
-forward_pass = lambda weights, x: feedforward.run(weights, x, NONLINEARITY)
+forward_pass = feedforward.forward_pass(NONLINEARITY)
 optimizer = optim.update
 opt_params = optim.defaults()
 
 
-if __name__ == "__main__":
-
-    print("And so it begins...")
+def plot_aggregates(path: str) -> None:
+    import plot  # Relative import: `plot.py`
 
+    cells = aggregate.load(path)
+    for layers in sorted({k.layers for k in cells}):
+        here = {k: v for k, v in cells.items() if k.layers == layers}
+        ndims = sorted({k.ndim for k in here})
+        dists = sorted({k.distance for k in here})
+        fraction = np.full([len(ndims), len(dists)], np.nan)
+        for k, cell in here.items():
+            fraction[ndims.index(k.ndim), dists.index(k.distance)] = (
+                aggregate.convergence(cell)
+            )
+        out = os.path.join(*DIRECTORY, f"{layers}-layer")
+        os.makedirs(out, exist_ok=True)
+        print(f"Plotting `{os.path.join(out, 'convergence.png')}`...")
+        plt.imshow(fraction, vmin=0, vmax=1, origin="lower", aspect="auto")
+        plt.colorbar(label="fraction of trials that got closer")
+        plt.xticks(range(len(dists)), [f"{d:g}" for d in dists])
+        plt.yticks(range(len(ndims)), [str(n) for n in ndims])
+        plt.xlabel("initial distance")
+        plt.ylabel("dimensionality")
+        plt.savefig(os.path.join(out, "convergence.png"), dpi=plot.DPI)
+        plt.close()
+
+        for k, cell in here.items():
+            d = os.path.join(out, f"{k.ndim}-dimensional", f"{k.distance}-distance")
+            os.makedirs(d, exist_ok=True)
+            print(f"Plotting `{os.path.join(d, 'losses.png')}`...")
+            x, mean = plot.decimate(cell.mean)
+            _, std = plot.decimate(np.sqrt(aggregate.variance(cell)))
+            plt.plot(x, mean, linewidth=plot.LINE_WIDTH)
+            plt.fill_between(x, mean - std, mean + std, alpha=0.25)
+            q = [aggregate.quantile(cell.final_loss, p) for p in (0.25, 0.5, 0.75)]
+            plt.title(
+                f"{len(cell.trials)} trials; final loss median {q[1]:.3g}"
+                f" (IQR {q[0]:.3g} to {q[2]:.3g})"
+            )
+            plt.ticklabel_format(style="plain", useOffset=False)
+            plt.savefig(os.path.join(d, "losses.png"), dpi=plot.DPI)
+            plt.close()
+
+
+class Cell(NamedTuple):
+    layers: int
+    ndim: int
+    dist: Float32[Array, ""]
+    trial: int
+
+
+def grid() -> Dict[str, Cell]:
+    cells = {}
     for layers in range(1, 4):
-        print(f"  {layers} layer" + ("" if layers == 1 else "s"))
-        layer_dir = (*DIRECTORY, f"{layers}-layer")
-
         for lg_ndim in range(4):
             ndim = int(jnp.exp2(lg_ndim))
-            print(f"    {ndim} dimension" + ("" if ndim == 1 else "s"))
-            ndim_dir = (*layer_dir, f"{ndim}-dimensional")
-
-            shapes = tuple([ndim for _ in range(layers + 1)])
-            w_example = feedforward.init(shapes, jrnd.PRNGKey(42), False)
-            opt_state = optim.init(w_example, opt_params)
 
             # for lg_lr in range(8):
             #     lr = 0.0001 * jnp.exp2(lg_lr)
-            #     print(f"      learning rate of {lr}")
-            #     lr_dir = (*ndim_dir, f"{lr}-learning-rate")
 
             for lg_dist in range(8):
                 dist = 0.01 * jnp.exp2(lg_dist)
-                print(f"        initial distance of {dist}")
-                dist_dir = (*ndim_dir, f"{dist}-distance")
 
                 # for lg_batch in range(4):
                 #     batch = int(jnp.exp2(lg_batch))
-                #     print(f"          batches of {batch}")
-                #     batch_dir = (*dist_dir, f"batch-of-{batch}")
-                batch = 1
 
                 for i in range(TRIALS):
-                    directory = (*dist_dir, f"trial-{i}")
-
-                    if not os.path.exists(os.path.join(*directory)):
-                        print(f"            trial #{i}")
-                        trial.run(
-                            jrnd.PRNGKey(i),
-                            ndim,
-                            batch,
-                            layers,
-                            forward_pass,
-                            optimizer,
-                            opt_state,
-                            opt_params,
-                            NONLINEARITY,
-                            TRAINING_STEPS,
-                            directory,
-                            POWER,
-                            dist,
-                            "              ",
-                            verbose=False,
-                        )
+                    name = (
+                        f"{layers}-layer/{ndim}-dimensional/{dist}-distance/trial-{i}"
+                    )
+                    cells[name] = Cell(layers, ndim, dist, i)
+    return cells
+
+
+@lru_cache
+def initial_state(layers: int, ndim: int):
+    shapes = tuple([ndim for _ in range(layers + 1)])
+    w_example = feedforward.init(shapes, jrnd.PRNGKey(42), False)
+    return optim.init(w_example, opt_params)
+
+
+def work(name: str, cell: Cell) -> None:
+    batch = 1
+    directory = tuple(name.split("/")) if STORE else (*DIRECTORY, *name.split("/"))
+    done = (
+        store.contains(STORE, name)
+        if STORE
+        else os.path.exists(os.path.join(*directory))
+    )
+    if done:  # e.g. finished before this sweep had a queue
+        return
+    print(f"{name}")
+    summary = trial.run(
+        jrnd.PRNGKey(cell.trial),
+        cell.ndim,
+        batch,
+        cell.layers,
+        forward_pass,
+        optimizer,
+        initial_state(cell.layers, cell.ndim),
+        opt_params,
+        NONLINEARITY,
+        TRAINING_STEPS,
+        directory,
+        POWER,
+        cell.dist,
+        "  ",
+        verbose=False,
+        store=STORE,
+    )
+    assert summary.losses is not None
+    assert summary.weight_distances is not None
+    assert summary.converged is not None
+    aggregate.update(
+        AGGREGATES,
+        aggregate.CellKey(cell.layers, cell.ndim, float(cell.dist)),
+        name,
+        summary.losses.astype(np.float64),
+        float(np.sum(summary.weight_distances[-1])),
+        summary.converged,
+    )
+    saving.wait()  # before the queue calls it done
 
-    import plot  # Relative import: `plot.py`
 
-    plot.run(os.path.join(os.getcwd(), *DIRECTORY))
+if __name__ == "__main__":
+
+    # Any number of processes, on any machines sharing this directory,
+    # can run `plot-convergence.py --worker` to split the sweep between them
+    # (then run it once more without `--worker` to plot):
+    worker = "--worker" in sys.argv[1:]
+
+    print("And so it begins...")
+
+    cells = grid()
+    finished = sweep.run(QUEUE, list(cells), lambda name: work(name, cells[name]))
+    print(f"Finished {len(finished)} trial(s) here")
+
+    if not worker:
+        left = sweep.status(QUEUE, list(cells))
+        if left.claimed or left.pending or left.stale:
+            print(
+                f"Still waiting on {len(left.claimed)} running, {len(left.stale)} stale,"
+                f" and {len(left.pending)} pending trial(s); plotting what's done"
+            )
+        # Per-trial plots are still available via `plot.py`, but they're thousands of files:
+        plot_aggregates(AGGREGATES)
@@ -1,81 +1,235 @@
+from metaoptimizer import store
+
 from beartype import beartype
+from beartype.typing import Dict, List, NamedTuple, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib import pyplot as plt
 from jaxtyping import jaxtyped
+import json
+import matplotlib
+import multiprocessing
 import numpy as np
 import os
+import zlib
 
 
 DPI = 256
 LINE_WIDTH = DPI / 256.0
+# Horizontal resolution of the saved figure, i.e. how many points are worth drawing:
+PIXEL_COLUMNS = int(plt.rcParams["figure.figsize"][0] * DPI)
+# Which PNGs came from which version of the data (so changed data gets replotted):
+MANIFEST = ".plots.json"
+
+
+class Source(NamedTuple):
+    path: str  # an `.npy` file, or a store if `trial` is not `None`
+    trial: Optional[str]
+    name: Optional[str]
+
+
+class Job(NamedTuple):
+    sources: List[Source]
+    pngs: List[str]
+    shared_ylim: bool  # for historical data, make sure axis ranges are identical
+    stamp: str
 
 
 @jaxtyped(typechecker=beartype)
-def run(directory: str) -> None:
-
-    if not os.path.exists(directory):
-        return
-    assert os.path.isdir(directory), f"File `{directory}` is not a directory"
-
-    plt.close("all")
-
-    # If we have historical data, make sure axis ranges are identical
-    historical_files, non_historical_files = [], []
-    for f in os.listdir(directory):
-        if f.endswith("historical.npy"):
-            historical_files.append(f)
-        else:
-            non_historical_files.append(f)
-    historical_loaded = [np.load(os.path.join(directory, f)) for f in historical_files]
-    n_historical = len(historical_files)
-    if n_historical != 0:
-        historical_min = np.min(
-            [np.min(f.astype(np.float32)) for f in historical_loaded]
-        )
-        historical_max = np.max(
-            [np.max(f.astype(np.float32)) for f in historical_loaded]
+def load(source: Source) -> np.ndarray:
+    if source.trial is None:
+        return np.load(source.path, mmap_mode="r", allow_pickle=False)
+    assert source.name is not None
+    return store.read(source.path, source.trial, source.name)
+
+
+@jaxtyped(typechecker=beartype)
+def decimate(
+    arr: np.ndarray, columns: int = PIXEL_COLUMNS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keep only the min & max of each pixel column (per line, if 2D):
+    the plot looks identical, but 100k-point series draw ~2k segments.
+    """
+    if arr.ndim == 0:
+        return np.zeros([1]), np.asarray(arr).reshape(1)
+    n = arr.shape[0]
+    if n <= 2 * columns:
+        return np.arange(n), np.asarray(arr)
+    per = n // columns
+    usable = per * columns
+    chunked = np.asarray(arr[:usable]).reshape(columns, per, *arr.shape[1:])
+    lo, hi = chunked.min(axis=1), chunked.max(axis=1)
+    y = np.stack([lo, hi], axis=1).reshape(2 * columns, *arr.shape[1:])
+    x = np.repeat(np.arange(columns) * per + per // 2, 2)
+    if usable < n:  # the ragged tail, in full
+        x = np.concatenate([x, np.arange(usable, n)])
+        y = np.concatenate([y, np.asarray(arr[usable:])])
+    return x, y
+
+
+@jaxtyped(typechecker=beartype)
+def render(job: Job) -> None:
+    loaded = [load(s) for s in job.sources]
+    if job.shared_ylim:
+        lo = float(min([np.min(x) for x in loaded]))
+        hi = float(max([np.max(x) for x in loaded]))
+    for arr, png in zip(loaded, job.pngs):
+        os.makedirs(os.path.dirname(png), exist_ok=True)
+        plt.plot(*decimate(arr), linewidth=LINE_WIDTH)
+        if job.shared_ylim:
+            plt.ylim(lo - 0.1 * (hi - lo), hi + 0.1 * (hi - lo))
+        plt.ticklabel_format(style="plain", useOffset=False)
+        plt.savefig(png, dpi=DPI)
+        plt.close()
+
+
+def use_agg() -> None:
+    matplotlib.use("Agg")
+
+
+@jaxtyped(typechecker=beartype)
+def stamp_files(paths: List[str]) -> str:
+    st = [os.stat(p) for p in paths]
+    return ",".join([f"{s.st_size}:{s.st_mtime_ns}" for s in st])
+
+
+@jaxtyped(typechecker=beartype)
+def stamp_store(entries: List[store.Entry]) -> str:
+    crcs = [c.crc for e in entries for c in e.chunks]
+    return f"{zlib.crc32(np.array(crcs, dtype=np.uint32).tobytes()):08x}"
+
+
+@jaxtyped(typechecker=beartype)
+def jobs_for_group(
+    sources: List[Source],
+    pngs: List[str],
+    stamp: List[str],
+) -> List[Job]:
+    historical = [
+        i for i, s in enumerate(sources) if pngs[i].endswith("historical.png")
+    ]
+    others = [i for i in range(len(sources)) if i not in historical]
+    jobs = [Job([sources[i]], [pngs[i]], False, stamp[i]) for i in others]
+    if historical:
+        # If one changes, the shared axis range might too, so they're one job:
+        jobs.append(
+            Job(
+                [sources[i] for i in historical],
+                [pngs[i] for i in historical],
+                True,
+                ";".join([stamp[i] for i in historical]),
+            )
         )
-        historical_range = historical_max - historical_min
-    for fname, arr in zip(historical_files, historical_loaded):
-        without_ext, ext = os.path.splitext(fname)
-        png = os.path.join(directory, without_ext + ".png")
-        if os.path.exists(png):
-            print(f"Skipping `{os.path.join(directory, fname)}` (already exists)...")
-        else:
-            print(f"Plotting `{os.path.join(directory, fname)}`...")
-            plt.plot(arr, linewidth=LINE_WIDTH)
-            plt.ylim(
-                historical_min - 0.1 * historical_range,
-                historical_max + 0.1 * historical_range,
+    return jobs
+
+
+@jaxtyped(typechecker=beartype)
+def collect_directory(directory: str) -> List[Job]:
+    sources, pngs, stamps, subdirectories = [], [], [], []
+    with os.scandir(directory) as it:
+        for entry in sorted(it, key=lambda e: e.name):
+            without_ext, ext = os.path.splitext(entry.name)
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif entry.is_file() and ext == ".npy":
+                sources.append(Source(entry.path, None, None))
+                pngs.append(os.path.join(directory, without_ext + ".png"))
+                stamps.append(stamp_files([entry.path]))
+            elif ext not in (".png", ".json"):
+                print(f"Skipping `{entry.path}` (not an `.npy` file or a directory)...")
+    jobs = jobs_for_group(sources, pngs, stamps)
+    for d in subdirectories:
+        jobs.extend(collect_directory(d))
+    return jobs
+
+
+@jaxtyped(typechecker=beartype)
+def collect_store(path: str) -> List[Job]:
+    # PNGs go in a directory tree next to the store, mirroring its trials:
+    root = path[: -len(store.EXTENSION)]
+    jobs = []
+    for trial, entries in store.contents(path).items():
+        groups: Dict[str, List[str]] = {}
+        for name in entries:
+            if name.endswith(".npy"):
+                groups.setdefault(os.path.dirname(name), []).append(name)
+        for names in groups.values():
+            jobs.extend(
+                jobs_for_group(
+                    [Source(path, trial, n) for n in names],
+                    [
+                        os.path.join(root, *trial.split("/"), n[:-4] + ".png")
+                        for n in names
+                    ],
+                    [stamp_store([entries[n]]) for n in names],
+                )
             )
-            plt.ticklabel_format(style="plain", useOffset=False)
-            plt.savefig(png, dpi=DPI)
-            plt.close()
-
-    for fname in non_historical_files:
-        f = os.path.join(directory, fname)
-        # checking if it is a file
-        if os.path.isdir(f):
-            print(f"Entering `{f}`...")
-            run(f)
-        elif os.path.isfile(f):
-            without_ext, ext = os.path.splitext(fname)
-            if ext == ".npy":
-                png = os.path.join(directory, without_ext + ".png")
-                if os.path.exists(png):
-                    print(f"Skipping `{f}` (already exists)...")
-                else:
-                    print(f"Plotting `{f}`...")
-                    plt.plot(np.load(f), linewidth=LINE_WIDTH)
-                    # plt.gca().set_ylim([0.0, 1.0])
-                    plt.ticklabel_format(style="plain", useOffset=False)
-                    plt.savefig(png, dpi=DPI)
-                    plt.close()
-            elif ext != ".png":
-                print(f"Skipping `{f}` (extension was `{ext}` instead of `.npy`)...")
-        else:
-            print(f"Skipping `{f}` (not a file or directory)...")
+    return jobs
+
+
+@jaxtyped(typechecker=beartype)
+def run(directory: str, workers: Optional[int] = None) -> None:
+    """
+    Plot every `.npy` array under `directory` (or in a sweep store),
+    skipping PNGs whose data hasn't changed since they were drawn,
+    across `workers` processes (default: one per core).
+    """
+
+    is_store = directory.endswith(store.EXTENSION) and os.path.isfile(directory)
+    if is_store:
+        jobs = collect_store(directory)
+        root = directory[: -len(store.EXTENSION)]
+    else:
+        if not os.path.exists(directory):
+            return
+        assert os.path.isdir(directory), f"File `{directory}` is not a directory"
+        jobs = collect_directory(directory)
+        root = directory
+
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest: Dict[str, str] = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    stale = []
+    for job in jobs:
+        up_to_date = [
+            os.path.exists(p) and manifest.get(p) == job.stamp for p in job.pngs
+        ]
+        for png in job.pngs:
+            print(("Skipping" if all(up_to_date) else "Plotting") + f" `{png}`...")
+        if not all(up_to_date):
+            stale.append(job)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(stale))
+    if workers <= 1:
+        for job in stale:
+            render(job)
+    else:
+        plt.close("all")
+        # Fresh processes, not forks: forking once JAX's threads are up can deadlock
+        # (& JAX warns about it). `use_agg` sets up Matplotlib in each one instead.
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=use_agg,
+        ) as pool:
+            list(pool.map(render, stale, chunksize=max(1, len(stale) // (4 * workers))))
+
+    if stale:
+        for job in stale:
+            for png in job.pngs:
+                manifest[png] = job.stamp
+        os.makedirs(root, exist_ok=True)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
 
 
 if __name__ == "__main__":
     run(os.path.join(os.getcwd(), "logs"))
     run(os.path.join(os.getcwd(), "convergence-rates"))
+    run(os.path.join(os.getcwd(), "convergence-rates" + store.EXTENSION))
@@ -2,15 +2,36 @@ from os import environ
 
 
 from metaoptimizer import (
+    aggregate,
+    checkpoint,
+    data,
     feedforward,
+    implicit,
+    line_search,
+    metrics,
+    padding,
+    parallel,
     permutations,
+    population,
+    profiling,
+    results,
+    saving,
+    scheduler,
+    stopping,
+    store,
+    sweep,
+    tracing,
     training,
+    trial,
+    weights,
 )
 from metaoptimizer.optimizers import (
     Optimizer,
     adam,
+    granular,
     momentum,
     nesterov,
+    quantized,
     rmsprop,
     sgd,
     swiss_army_knife,
@@ -20,14 +41,25 @@ from metaoptimizer.training import ForwardPass
 from metaoptimizer.weights import layers, wb, Weights
 
 from beartype import beartype
-from beartype.typing import Any, Callable, Iterable, Protocol, Tuple
+from beartype.typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    cast,
+)
 from hypothesis import given, settings, strategies as st, Verbosity
 from hypothesis.extra import numpy as hnp
-from jax import jit, grad, nn as jnn, numpy as jnp, random as jrnd
+from jax import jit, grad, lax, nn as jnn, numpy as jnp, random as jrnd
 from jax.experimental.checkify import all_checks, checkify
 from jax.lax import stop_gradient
 from jax.numpy import linalg as jla
-from jax.tree_util import tree_map, tree_reduce, tree_structure
+from jax.tree_util import tree_leaves, tree_map, tree_reduce, tree_structure
 from jaxtyping import (
     jaxtyped,
     Array,
@@ -37,10 +69,18 @@ from jaxtyping import (
     TypeCheckError,
     UInt32,
 )
-from math import prod
+from math import ceil, inf, isfinite, prod
 from numpy.typing import ArrayLike
+import concurrent.futures
+import numpy as np
 import operator
+import os
+import plot  # Relative import: `plot.py`
 import pytest
+import shutil
+import subprocess
+import sys
+import time
 
 
 TEST_COUNT_CI = 10000
@@ -86,7 +126,7 @@ def test_feedforward_id_prop(np_x: ArrayLike) -> None:
     if not jnp.all(jnp.isfinite(x)):
         return
     y = feedforward.run(
-        Weights(jnp.eye(3, 3)[jnp.newaxis], jnp.zeros([3])[jnp.newaxis]),
+        Weights([jnp.eye(3, 3)], [jnp.zeros([3])]),
         x,
         lambda z: z,
     )
@@ -101,7 +141,27 @@ def test_feedforward_id_prop(np_x: ArrayLike) -> None:
 # negation significantly (very significantly!) alters behavior.
 
 
-# TODO: test varying dimensionality across layers
+@jaxtyped(typechecker=beartype)
+def test_varying_dimensionality() -> None:
+    # Wide enough in the middle for greedy matching (see `EXHAUSTIVE_MAX`):
+    shapes = (6, permutations.EXHAUSTIVE_MAX + 1, 4, 2)
+    w = feedforward.init(shapes, jrnd.PRNGKey(0), True)
+    assert [W.shape for W in w.W] == [(9, 6), (4, 9), (2, 4)]
+    x = jrnd.normal(jrnd.PRNGKey(1), [3, 6], dtype=jnp.float32)
+    y = feedforward.run(w, x)
+    assert y.shape == (3, 2)
+    ps = [
+        jrnd.permutation(jrnd.PRNGKey(2 + i), n).astype(jnp.uint32)
+        for i, n in enumerate(shapes[1:-1])
+    ]
+    wp = permutations.permute_hidden_layers(w, ps)
+    assert jnp.allclose(feedforward.run(wp, x), y, atol=1e-5)
+    loss, found = permutations.layer_distance(w, wp)
+    assert [p.shape for p in found] == [(9,), (4,)]
+    assert jnp.isclose(loss, 0, atol=1e-4), f"{loss} =/= 0"
+    sq_norms = jnp.ones([2, 3], dtype=jnp.float32)  # (two examples' gradients)
+    m = metrics.compute(metrics.ALL, w, wp, w, found, w, sq_norms)
+    assert all([v.shape == (3,) for v in m.values()])
 
 
 @jaxtyped(typechecker=beartype)
@@ -262,28 +322,28 @@ def test_cut_axes() -> None:
 @jaxtyped(typechecker=beartype)
 def test_find_permutation_1() -> None:
     ideal = Weights(
-        W=jnp.eye(5, 5, dtype=jnp.float64)[jnp.newaxis],
-        B=jnp.ones([1, 5], dtype=jnp.float64),
+        W=[jnp.eye(5, 5, dtype=jnp.float64)],
+        B=[jnp.ones([5], dtype=jnp.float64)],
     )
     actual = Weights(
-        W=jnp.array(
-            [
+        W=[
+            jnp.array(
                 [
                     [0, 0, -1, 0, 0],
                     [1, 0, 0, 0, 0],
                     [0, 0, 0, -1, 0],
                     [0, 1, 0, 0, 0],
                     [0, 0, 0, 0, 1],
-                ]
-            ],
-            dtype=jnp.float64,
-        ),
-        B=jnp.array([[-1, 1, -1, 1, 1]], dtype=jnp.float64),
+                ],
+                dtype=jnp.float64,
+            )
+        ],
+        B=[jnp.array([-1, 1, -1, 1, 1], dtype=jnp.float64)],
     )
     wb_a = wb(actual)
     wb_i = wb(ideal)
-    assert wb_a.shape[0] == 1
-    assert wb_i.shape[0] == 1
+    assert len(wb_a) == 1
+    assert len(wb_i) == 1
     p = permutations.find_permutation(wb_a[0], wb_i[0])
     ideal_indices = jnp.array([2, 0, 3, 1, 4], dtype=jnp.uint32)
     assert jnp.all(p == ideal_indices), f"{p} =/= {ideal_indices}"
@@ -400,7 +460,7 @@ def test_better_than_random_permutation_prop_5(x, y, randomly_chosen) -> None:
 @jaxtyped(typechecker=beartype)
 def prop_permute_hidden_layers(
     w: Weights,
-    p: list[UInt32[Array, "n"]],
+    p: list[UInt32[Array, "_n"]],
     x: Float[Array, "batch ndim"],
     nl: Callable = jnn.gelu,
 ) -> None:
@@ -426,7 +486,7 @@ def prop_permute_hidden_layers(
 @jaxtyped(typechecker=beartype)
 def test_permute_hidden_layers_1() -> None:
     prop_permute_hidden_layers(
-        Weights(jnp.zeros([3, 5, 5]), jnp.zeros([3, 5])),
+        Weights(list(jnp.zeros([3, 5, 5])), list(jnp.zeros([3, 5]))),
         [jnp.arange(5, dtype=jnp.uint32) for _ in range(2)],
         jnp.zeros([1, 5], dtype=jnp.float32),
     )
@@ -436,8 +496,8 @@ def test_permute_hidden_layers_1() -> None:
 def test_permute_hidden_layers_2() -> None:
     prop_permute_hidden_layers(
         w=Weights(
-            W=jnp.ones([3, 5, 5], dtype=jnp.float64),
-            B=jnp.ones([3, 5], dtype=jnp.float64),
+            W=list(jnp.ones([3, 5, 5], dtype=jnp.float64)),
+            B=list(jnp.ones([3, 5], dtype=jnp.float64)),
         ),
         p=[jnp.arange(5, dtype=jnp.uint32) for _ in range(2)],
         x=jnp.zeros([1, 5], dtype=jnp.float32),
@@ -458,7 +518,10 @@ def test_permute_hidden_layers_prop_1(
     x: ArrayLike,
 ) -> None:
     prop_permute_hidden_layers(
-        Weights(jnp.array(W, dtype=jnp.float64), jnp.array(B, dtype=jnp.float64)),
+        Weights(
+            list(jnp.array(W, dtype=jnp.float64)),
+            list(jnp.array(B, dtype=jnp.float64)),
+        ),
         [jnp.array(p, dtype=jnp.uint32) for p in P],
         jnp.array(x, dtype=jnp.float32),
     )
@@ -478,7 +541,10 @@ def test_permute_hidden_layers_prop_2(
     x: ArrayLike,
 ) -> None:
     prop_permute_hidden_layers(
-        Weights(jnp.array(W, dtype=jnp.float64), jnp.array(B, dtype=jnp.float64)),
+        Weights(
+            list(jnp.array(W, dtype=jnp.float64)),
+            list(jnp.array(B, dtype=jnp.float64)),
+        ),
         [jnp.array(p, dtype=jnp.uint32) for p in P],
         jnp.array(x, dtype=jnp.float32),
     )
@@ -498,7 +564,10 @@ def test_permute_hidden_layers_prop_3(
     x: ArrayLike,
 ) -> None:
     prop_permute_hidden_layers(
-        Weights(jnp.array(W, dtype=jnp.float64), jnp.array(B, dtype=jnp.float64)),
+        Weights(
+            list(jnp.array(W, dtype=jnp.float64)),
+            list(jnp.array(B, dtype=jnp.float64)),
+        ),
         [jnp.array(p, dtype=jnp.uint32) for p in P],
         jnp.array(x, dtype=jnp.float32),
     )
@@ -520,8 +589,8 @@ def test_layer_distance() -> None:
     Wideal = jnp.stack([eye, eye, eye])
     Bideal = jnp.zeros([3, 5])
     loss, ps = permutations.layer_distance(
-        Weights(Wactual, Bactual),
-        Weights(Wideal, Bideal),
+        Weights(list(Wactual), list(Bactual)),
+        Weights(list(Wideal), list(Bideal)),
     )
     assert len(ps) == 2, f"{len(ps)} =/= 2"
     assert jnp.isclose(loss, 0), f"{loss} =/= 0"
@@ -841,7 +910,7 @@ def prop_optim_global(
         x = jrnd.normal(k, [BATCH, NDIM], dtype=jnp.float32)
         err, y_ideal = jit_forward_pass(w_ideal, x)
         err.throw()
-        w, opt_state, opt_params, _, _ = training.step_global(
+        w, opt_state, opt_params, _, _, _ = training.step_global(
             w,
             forward_pass,
             x,
@@ -919,3 +988,1139 @@ def test_prop_optim_global() -> None:
         swiss_army_knife.defaults(lr=LR),
         swiss_army_knife.init,
     )
+
+
+def test_results_index(tmp_path) -> None:
+    for layers, ndim, dist, i in [(1, 2, 0.01, 0), (1, 2, 0.01, 1), (2, 4, 0.32, 0)]:
+        trial = tmp_path / f"{layers}-layer" / f"{ndim}-dimensional"
+        trial = trial / f"{dist}-distance" / f"trial-{i}"
+        (trial / "weight_distances").mkdir(parents=True)
+        np.save(trial / "losses.npy", np.arange(100, dtype=np.float32) + i)
+        np.save(trial / "weight_distances" / "layer_0.npy", np.ones(100))
+        np.save(trial / "closer_or_not.npy", np.array(i == 0))
+    (tmp_path / "not-a-trial").mkdir()
+    index = results.index(str(tmp_path))
+    assert len(index) == 3
+    assert list(index)[-1] == results.TrialKey(2, 4, 0.32, 0)
+    selected = results.select(index, layers=1, distance=0.01)
+    assert len(selected) == 2
+    directory = selected[results.TrialKey(1, 2, 0.01, 1)]
+    assert isinstance(results.losses(directory), np.memmap)
+    assert np.allclose(
+        results.read(directory, "losses.npy", index=slice(-3, None)),
+        [98, 99, 100],
+    )
+    assert results.weight_distances(directory, 0).shape == (100,)
+    assert not results.converged(directory)
+    assert results.optimizer(directory) == {}
+    os.mkdir(os.path.join(directory, "optimizer"))
+    np.save(os.path.join(directory, "optimizer", "lr.npy"), np.full([100], 0.01))
+    assert list(results.optimizer(directory)) == ["lr"]
+    # Malformed names are skipped, & a missing root is just empty:
+    for malformed in ["x-layer", "1.5.5-layer/2-dimensional"]:
+        (tmp_path / malformed).mkdir(parents=True)
+    (tmp_path / "2-layer" / "x-dimensional").mkdir()
+    assert results.index(str(tmp_path)) == index
+    assert results.index(str(tmp_path / "missing")) == {}
+    # The same, from a store:
+    path = str(tmp_path / f"sweep{store.EXTENSION}")
+    trial = "1-layer/2-dimensional/0.01-distance/trial-0"
+    w = np.arange(12, dtype=np.float32).reshape(3, 4)
+    store.append(
+        path,
+        trial,
+        {
+            "optimizer/lr.npy": np.full([3], 0.01),
+            "weights/layer_0/weights/w_historical.npy": w,
+            "weights/layer_0/biases/w_historical.npy": w[:, :2],
+            "stopping/reason.npy": np.array(stopping.PLATEAU, dtype=np.uint32),
+            "stopping/steps.npy": np.array(3, dtype=np.uint32),
+        },
+    )
+    for malformed in [
+        "1-layer/2-dimensional",
+        "1-layer/2-dimensional/0.01-distance/trial0",
+        "1-layer/2-dimensional/x-distance/trial-0",
+    ]:
+        store.append(path, malformed, {"x.npy": np.zeros(1)})
+    index = results.index(path)
+    assert list(index) == [results.TrialKey(1, 2, 0.01, 0)]
+    directory = index[results.TrialKey(1, 2, 0.01, 0)]
+    assert list(results.optimizer(directory)) == ["lr"]
+    assert np.allclose(results.optimizer(directory)["lr"], 0.01)
+    assert np.array_equal(results.weights(directory, 0), w)
+    assert np.array_equal(results.weights(directory, 0, biases=True), w[:, :2])
+    assert results.stopped(directory) == ("plateau", 3)
+
+
+def test_store(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(store, "CHUNK_BYTES", 64)
+    path = str(tmp_path / f"sweep{store.EXTENSION}")
+    trial = "1-layer/2-dimensional/0.01-distance/trial-0"
+    w = np.arange(300, dtype=np.float32).reshape(100, 3)
+    store.append(path, trial, {"losses.npy": np.zeros(10), "w.npy": w})
+    assert len(store.contents(path)[trial]["w.npy"].chunks) > 1
+    assert np.array_equal(store.read(path, trial, "w.npy"), w)
+    assert np.array_equal(
+        store.read(path, trial, "w.npy", index=slice(7, 60, 3)), w[7:60:3]
+    )
+    assert np.array_equal(store.read(path, trial, "w.npy", index=(42, 1)), w[42, 1])
+    # Replacing a trial, then a torn (uncommitted) write, then another trial:
+    store.append(path, trial, {"losses.npy": np.ones(10)})
+    with open(path, "ab") as f:
+        f.write(store.record({"trial": trial, "name": "x", "transaction": 0}, b"")[:-3])
+    store.append(
+        path, "2-layer/1-dimensional/0.32-distance/trial-5", {"x.npy": np.array(True)}
+    )
+    assert np.array_equal(store.read(path, trial, "losses.npy"), np.ones(10))
+    index = results.index(path)
+    assert list(index) == [
+        results.TrialKey(1, 2, 0.01, 0),
+        results.TrialKey(2, 1, 0.32, 5),
+    ]
+    directory = index[results.TrialKey(2, 1, 0.32, 5)]
+    assert results.read(directory, "x.npy")
+    assert np.array_equal(
+        results.losses(index[results.TrialKey(1, 2, 0.01, 0)]), np.ones(10)
+    )
+    # Edge cases: 0-d arrays, empty row selections, missing files & non-store paths:
+    scalar = "2-layer/1-dimensional/0.32-distance/trial-5"
+    assert store.read(path, scalar, "x.npy").shape == ()
+    assert store.read(path, scalar, "x.npy", index=()) == np.array(True)
+    assert "w.npy" not in store.contents(path)[trial]  # (replaced with the rest)
+    assert store.read(path, trial, "losses.npy", index=slice(5, 5)).shape == (0,)
+    assert store.read(path, trial, "losses.npy", index=(slice(5, 5),)).shape == (0,)
+    missing = str(tmp_path / f"missing{store.EXTENSION}")
+    assert store.contents(missing) == {} and not store.contains(missing, trial)
+    assert store.split(f"{path}/{trial}") == (path, trial)
+    assert store.split(str(tmp_path / "not-a-store" / trial)) is None
+    # Compaction drops replaced arrays & the torn tail, but nothing live:
+    size = os.path.getsize(path)
+    store.compact(path)
+    assert os.path.getsize(path) < size
+    assert not os.path.exists(path + ".compact")
+    assert np.array_equal(store.read(path, trial, "losses.npy"), np.ones(10))
+    assert store.read(path, trial, "losses.npy", index=3) == 1
+    assert list(results.index(path)) == list(index)
+    # A writer waiting on a store that's replaced meanwhile appends to the new file:
+    late = "3-layer/1-dimensional/0.01-distance/trial-0"
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        with store.locked(path):
+            pending = pool.submit(store.append, path, late, {"x.npy": np.zeros(2)})
+            time.sleep(0.2)
+            shutil.copy(path, path + ".copy")
+            os.replace(path + ".copy", path)
+        pending.result()
+    assert store.contains(path, late) and store.contains(path, scalar)
+
+
+def test_saving(tmp_path) -> None:
+    trial = "1-layer/2-dimensional/0.01-distance/trial-0"
+    # Into a store, in the background:
+    path = str(tmp_path / f"sweep{store.EXTENSION}")
+    saving.save(str(tmp_path / "unused"), {"x.npy": jnp.arange(3)}, path, trial)
+    saving.wait()
+    assert np.array_equal(store.read(path, trial, "x.npy"), np.arange(3))
+    assert not (tmp_path / "unused").exists()
+    # Replacing a trial's directory leaves nothing else behind:
+    directory = tmp_path / "tree" / trial
+    for i in range(2):
+        saving.save(str(directory), {"losses.npy": jnp.full([4], float(i))})
+        saving.wait()
+    assert os.listdir(directory.parent) == ["trial-0"]
+    assert list(results.index(str(tmp_path / "tree")).values()) == [str(directory)]
+    assert np.array_equal(results.losses(str(directory)), np.ones(4))
+    # A write that fails in the background is raised by the next `save`:
+    (tmp_path / "file").write_text("")
+    saving.save(str(tmp_path / "file" / "trial"), {"x.npy": jnp.arange(3)})
+    concurrent.futures.wait(saving.PENDING)
+    with pytest.raises(OSError):
+        saving.save(str(tmp_path / "fine"), {"x.npy": jnp.arange(3)})
+    # (& only once)
+    saving.save(str(tmp_path / "fine"), {"x.npy": jnp.arange(3)})
+    saving.wait()
+    assert (tmp_path / "fine" / "x.npy").exists()
+    # `wait` raises too:
+    saving.save(str(tmp_path / "file" / "again"), {"x.npy": jnp.arange(3)})
+    with pytest.raises(OSError):
+        saving.wait()
+    saving.wait()
+    assert saving.PENDING == []
+
+
+def test_plot_decimate() -> None:
+    y = np.sin(np.arange(100003) / 1000.0)[:, np.newaxis] * np.arange(1, 4)
+    x, d = plot.decimate(y, 100)
+    assert x.shape[0] == d.shape[0] < 300
+    assert d.shape[1:] == (3,)
+    assert np.allclose(d.min(axis=0), y.min(axis=0))
+    assert np.allclose(d.max(axis=0), y.max(axis=0))
+    assert np.all(np.diff(x) >= 0)
+
+
+def test_plot_incremental(tmp_path) -> None:
+    np.save(tmp_path / "losses.npy", np.arange(10.0))
+    (tmp_path / "weights").mkdir()
+    np.save(tmp_path / "weights" / "w_historical.npy", np.ones([10, 2]))
+    np.save(tmp_path / "weights" / "w_ideal_historical.npy", np.zeros([10, 2]))
+    plot.run(str(tmp_path), workers=1)
+    png = tmp_path / "losses.png"
+    first = os.stat(png).st_mtime_ns
+    assert (tmp_path / "weights" / "w_ideal_historical.png").exists()
+    plot.run(str(tmp_path), workers=1)
+    assert os.stat(png).st_mtime_ns == first
+    np.save(tmp_path / "losses.npy", np.arange(20.0))
+    plot.run(str(tmp_path), workers=1)
+    assert os.stat(png).st_mtime_ns != first
+
+
+def test_plot_workers(tmp_path, monkeypatch) -> None:
+    for i in range(4):
+        np.save(tmp_path / f"{i}.npy", np.arange(10.0) * i)
+
+    def fork():
+        raise AssertionError("Forked a worker after JAX started its threads")
+
+    monkeypatch.setattr(os, "fork", fork)
+    plot.run(str(tmp_path), workers=2)
+    for i in range(4):
+        assert (tmp_path / f"{i}.png").exists()
+
+
+def test_aggregate(tmp_path) -> None:
+    path = str(tmp_path / f"sweep{aggregate.EXTENSION}")
+    key = aggregate.CellKey(2, 4, 0.01)
+    curves = [np.exp(-np.arange(100) / (i + 1.0)) for i in range(32)]
+    curves[-1] = curves[-1][:60]  # e.g. stopped early
+    for i, c in enumerate(curves):
+        aggregate.update(path, key, f"trial-{i}", c, float(i), i % 4 != 0)
+    aggregate.update(path, key, "trial-0", curves[0], 0.0, False)  # idempotent
+    cell = aggregate.load(path)[key]
+    assert len(cell.trials) == 32
+    assert aggregate.convergence(cell) == 0.75
+    full = np.stack(curves[:-1])
+    assert np.allclose(cell.mean[60:], full[:, 60:].mean(axis=0))
+    assert np.allclose(aggregate.variance(cell)[60:], full[:, 60:].var(axis=0, ddof=1))
+    assert np.allclose(cell.mean[:60], np.stack([c[:60] for c in curves]).mean(axis=0))
+    median = aggregate.quantile(cell.final_distance, 0.5)
+    assert abs(median - 15.5) / 15.5 < 0.1
+    assert aggregate.quantile(cell.final_distance, 0.0) == 0.0
+    # Diverged trials land in the non-finite bucket (& out-of-range ones are clamped):
+    diverged = aggregate.CellKey(2, 4, 1.0)
+    aggregate.update(path, diverged, "inf", np.array([1.0, inf]), float("nan"), False)
+    aggregate.update(path, diverged, "huge", np.array([1e30]), 1e30, False)
+    cell = aggregate.load(path)[diverged]
+    assert aggregate.quantile(cell.final_loss, 1.0) == inf
+    assert aggregate.quantile(cell.final_distance, 1.0) == inf
+    top = aggregate.quantile(cell.final_distance, 0.0)
+    assert isfinite(top) and abs(top - aggregate.SKETCH_MAX) / top < 0.05
+    # (& never poison the running statistics:)
+    assert list(cell.counts) == [2, 0] and np.all(np.isfinite(cell.mean))
+    # An empty cell has no quantiles (or convergence rate) at all:
+    nothing = aggregate.empty()
+    assert np.isnan(aggregate.quantile(nothing.final_loss, 0.5))
+    assert np.isnan(aggregate.convergence(nothing))
+
+
+def test_metrics() -> None:
+    [w, w_ideal] = [
+        feedforward.init(
+            tuple([NDIM for _ in range(LAYERS + 1)]), jrnd.PRNGKey(i), True
+        )
+        for i in range(2)
+    ]
+    identity = [jnp.arange(NDIM, dtype=jnp.uint32) for _ in range(LAYERS - 1)]
+    sq_norms = jnp.ones([2, LAYERS], dtype=jnp.float32)  # (two examples' gradients)
+    m = metrics.compute(metrics.ALL, w, w, w_ideal, identity, w, sq_norms)
+    looped = [jnp.sum(jnp.abs(wb(w)[i] - wb(w_ideal)[i])) for i in range(LAYERS)]
+    assert jnp.allclose(m[metrics.LAYER_DISTANCES], jnp.stack(looped))
+    assert jnp.allclose(m[metrics.PERMUTED_DISTANCES], m[metrics.LAYER_DISTANCES])
+    assert jnp.allclose(m[metrics.UPDATE_NORMS], 0)
+    assert m[metrics.GRAD_NORMS].shape == (LAYERS,)
+    with pytest.raises(AssertionError):
+        metrics.compute(("not a metric",), w, w, w_ideal, identity)
+
+
+def test_trial_metrics(tmp_path) -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    p = sgd.defaults(lr=LR)
+    s = sgd.init(feedforward.init(shapes, jrnd.PRNGKey(0), False), p)
+    metric_set = (metrics.GRAD_NORMS, metrics.UPDATE_NORMS, metrics.PERMUTED_DISTANCES)
+    summary = trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        2,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        s,
+        p,
+        subdir=(str(tmp_path),),
+        training_steps=100,
+        verbose=False,
+        metric_set=metric_set,
+    )
+    saving.wait()
+    for name in metric_set:
+        arr = np.load(tmp_path / "metrics" / f"{name}.npy")
+        assert arr.shape == (100, LAYERS) and np.all(np.isfinite(arr))
+    # `layer_distances` are still saved as they always were:
+    assert not (tmp_path / "metrics" / f"{metrics.LAYER_DISTANCES}.npy").exists()
+    assert summary.weight_distances is not None
+    for i in range(LAYERS):
+        saved = np.load(tmp_path / "weight_distances" / f"layer_{i}.npy")
+        assert np.allclose(saved, summary.weight_distances[:, i])
+        layer = tmp_path / "weights" / f"layer_{i}"
+        final = [np.load(layer / kind / "final.npy") for kind in ["weights", "biases"]]
+        ideal = [
+            np.load(layer / kind / "ideal_orig.npy") for kind in ["weights", "biases"]
+        ]
+        l1 = sum([np.sum(np.abs(a - b)) for a, b in zip(final, ideal)])
+        assert np.isclose(saved[-1], l1, rtol=1e-5)
+
+
+def test_profiling() -> None:
+    assert profiling.span("off") is profiling.NULL
+    profiling.enable()
+    square = jit(lambda x: x * x)  # fresh, so it has to compile
+    try:
+        for _ in range(3):
+            with profiling.span("square"):
+                profiling.block(square(jnp.arange(4.0)))
+        assert profiling.CALLS["square"] == 3
+        table = profiling.summary()
+        assert "square" in table and "compile" in table
+    finally:
+        profiling.disable()
+        profiling.reset()
+
+
+def test_profiling_trace(tmp_path) -> None:
+    square = jit(lambda x: x * x)
+    profiling.at_step(1)  # disabled: never starts a trace
+    assert not profiling.TRACING
+    profiling.enable(trace_dir=str(tmp_path), trace_steps=(1, 2))
+    try:
+        for i in range(4):
+            profiling.at_step(i)
+            assert profiling.TRACING == (i == 1)
+            profiling.block(square(jnp.arange(4.0)))
+        captured = [f for _, _, files in os.walk(tmp_path) for f in files]
+        assert any([f.endswith(".xplane.pb") for f in captured])
+        # A trial shorter than the window leaves the trace running for `finish`:
+        profiling.at_step(1)
+        assert profiling.TRACING
+        profiling.finish()
+        assert not profiling.TRACING
+        profiling.finish()  # (& a second `finish` is a no-op)
+    finally:
+        profiling.finish()
+        profiling.disable()
+        profiling.reset()
+
+
+def test_tracing() -> None:
+    @tracing.count(1)
+    def scale(x: Array, f: Callable) -> Array:
+        return f(x)
+
+    scale = jit(scale, static_argnums=1)
+
+    name = f"{scale.__module__}.test_tracing.<locals>.scale"
+    x = jnp.arange(4, dtype=jnp.float32)
+    double = lambda y: 2 * y
+    tracing.reset()
+    try:
+        scale(x, double)
+        scale(x, double)
+        assert tracing.TRACES[name] == 1
+        scale(x, lambda y: 2 * y)  # same code, new identity: retraced
+        assert tracing.TRACES[name] == 2
+        # (& recompiled: compiles are counted under the same name as traces)
+        assert tracing.COMPILES[name] == 2
+        assert f"     2 traces       2 compiles  {name}" in tracing.summary()
+        tracing.benchmark(2)
+        with pytest.raises(RuntimeError, match="static #1"):
+            scale(x, lambda y: 2 * y)  # a third trace: refused
+        assert feedforward.forward_pass(jnn.gelu) is feedforward.forward_pass(jnn.gelu)
+    finally:
+        tracing.benchmark(None)
+        tracing.reset()
+
+
+def test_data(tmp_path) -> None:
+    w_ideal = feedforward.init(
+        tuple([NDIM for _ in range(LAYERS + 1)]), jrnd.PRNGKey(0), True
+    )
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    batches = data.stream(jrnd.PRNGKey(1), w_ideal, 2, NDIM, forward_pass, 3)
+    seen = [(b.x[i], b.y[i]) for b, i in [next(batches) for _ in range(7)]]
+    for x, y in seen:
+        assert x.shape == (2, NDIM)
+        assert jnp.allclose(y, forward_pass(w_ideal, x), atol=1e-5)
+    assert len({float(x[0, 0]) for x, _ in seen}) == 7  # fresh across blocks
+
+    examples = np.arange(5 * NDIM, dtype=np.float32).reshape(5, NDIM)
+    data.save(str(tmp_path), examples, -examples)
+    batches = data.finite(str(tmp_path), 2, 3)
+    for step in range(7):
+        b, i = next(batches)
+        assert b.x.shape == (3, 2, NDIM)
+        k = 2 * (step % 2)  # (the fifth example doesn't fill a batch)
+        assert np.array_equal(np.asarray(b.x[i]), examples[k : k + 2])
+        assert np.array_equal(np.asarray(b.y[i]), -examples[k : k + 2])
+
+
+def test_parallel() -> None:
+    # (only one device here, but the collectives & sharding still have to line up)
+    mesh = parallel.mesh()
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(0), True)
+    w = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [4, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    p = sgd.defaults()
+    s = sgd.init(w, p)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    args = (w, forward_pass, x, y, sgd.update, p, s, w_ideal, power)
+    expected = jit(training.step_global, static_argnums=(1, 4))(*args)
+    actual = jit(parallel.step_global, static_argnums=(0, 2, 5))(mesh, *args)
+    close = lambda a, b: bool(jnp.allclose(a, b, rtol=1e-5, atol=1e-6))
+    assert tree_reduce(operator.and_, tree_map(close, expected, actual))
+    square = parallel.across_trials(mesh, lambda z: z * z)
+    assert jnp.array_equal(jit(square)(jnp.arange(4.0)), jnp.arange(4.0) ** 2)
+
+
+def test_sweep(tmp_path) -> None:
+    queue = str(tmp_path / f"sweep{sweep.EXTENSION}")
+    cells = [f"1-layer/2-dimensional/0.01-distance/trial-{i}" for i in range(24)]
+    # A dead worker's claim, long since stale:
+    assert sweep.claim(queue, cells[:1], "dead") == cells[0]
+    old = os.stat(sweep.path(queue, cells[0], ".claim")).st_mtime - sweep.STALE_SECS
+    os.utime(sweep.path(queue, cells[0], ".claim"), (old, old))
+    assert sweep.status(queue, cells).stale == {cells[0]: "dead"}
+    # A worker presumed dead that finishes after all leaves the new owner's claim be:
+    other = str(tmp_path / f"other{sweep.EXTENSION}")
+    assert sweep.claim(other, cells[:1], "slow") == cells[0]
+    assert sweep.claim(other, cells[:1], "next", stale_secs=0.0) == cells[0]
+    sweep.finish(other, cells[0], "slow")
+    assert sweep.owner(other, cells[0]) == "next"
+    sweep.finish(other, cells[0], "next")
+    assert sweep.owner(other, cells[0]) is None
+    assert sweep.status(other, cells[:1]).done == cells[:1]
+    script = (
+        "import sys, time; from metaoptimizer import sweep\n"
+        "def work(cell):\n"
+        "    time.sleep(0.01)\n"
+        "    with open(sys.argv[2], 'a') as f: f.write(cell + '\\n')\n"
+        "sweep.run(sys.argv[1], sys.argv[3:], work, heartbeat_secs=0.01)\n"
+    )
+    out = str(tmp_path / "out.txt")
+    env = {**environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    workers = [
+        subprocess.Popen([sys.executable, "-c", script, queue, out, *cells], env=env)
+        for _ in range(4)
+    ]
+    assert all(w.wait(timeout=120) == 0 for w in workers)
+    with open(out) as f:
+        assert sorted(f.read().split()) == sorted(cells)  # each exactly once
+    s = sweep.status(queue, cells)
+    assert len(s.done) == len(cells) and not (s.pending or s.claimed or s.stale)
+
+
+def test_sweep_in_process(tmp_path, capsys) -> None:
+    queue = str(tmp_path / f"sweep{sweep.EXTENSION}")
+    cells = ["a", "b", "c", "d", "e"]
+
+    def work(cell: str) -> None:
+        if cell == "a":
+            # Re-issued mid-`work` (as if this worker had gone quiet for too long):
+            assert sweep.claim(queue, ["a"], "thief", stale_secs=0.0) == "a"
+            time.sleep(0.1)
+
+    assert sweep.run(queue, cells[:2], work, "me", heartbeat_secs=0.01) == ["a", "b"]
+    assert "`a` was re-issued from me" in capsys.readouterr().out
+    assert sweep.claim(queue, ["c"], "other") == "c"
+    assert sweep.claim(queue, ["d"], "dead") == "d"
+    old = os.stat(sweep.path(queue, "d", ".claim")).st_mtime - sweep.STALE_SECS
+    os.utime(sweep.path(queue, "d", ".claim"), (old, old))
+    assert sweep.status(queue, cells) == sweep.Status(
+        pending=["e"], claimed={"c": "other"}, stale={"d": "dead"}, done=["a", "b"]
+    )
+    # Cells known to be done are never looked at again:
+    known: Set[str] = set()
+    assert sweep.claim(queue, ["a", "b"], "me", done=known) is None
+    assert known == {"a", "b"}
+    for suffix in [".done", ".claim"]:  # (so on disk, `a` looks pending again)
+        os.remove(sweep.path(queue, "a", suffix))
+    assert sweep.claim(queue, ["a", "b", "e"], "me", done=known) == "e"
+
+
+def test_stopping() -> None:
+    chunk = lambda *xs: jnp.array(xs, dtype=jnp.float32)
+    nan = stopping.Criteria()
+    s = stopping.check(stopping.init(), chunk(3, 2, 1), None, nan)
+    assert int(s.reason) == stopping.NONE and int(s.steps) == 3
+    s = stopping.check(s, chunk(1, jnp.nan, 1), None, nan)
+    assert int(s.reason) == stopping.NON_FINITE and int(s.steps) == 5
+    assert stopping.check(s, chunk(1, 1, 1), None, nan) == s  # stays stopped
+
+    exploded = stopping.Criteria(max_loss=100.0)
+    s = stopping.check(stopping.init(), chunk(1, 1000, jnp.inf), None, exploded)
+    assert int(s.reason) == stopping.EXPLODED and int(s.steps) == 2
+
+    plateau = stopping.Criteria(patience=2, min_improvement=0.1)
+    s = stopping.init()
+    for i, mean in enumerate([10, 5, 4.9, 4.8]):
+        assert int(s.reason) == stopping.NONE, f"stopped before chunk {i}"
+        s = stopping.check(s, chunk(mean, mean), None, plateau)
+    assert int(s.reason) == stopping.PLATEAU and int(s.steps) == 8
+
+    close = stopping.Criteria(min_distance=0.5)
+    d = lambda x: jnp.array(x, dtype=jnp.float32)
+    s = stopping.check(stopping.init(), chunk(1, 1), d(0.6), close)
+    assert int(s.reason) == stopping.NONE
+    s = stopping.check(s, chunk(1, 1), d(0.4), close)
+    assert int(s.reason) == stopping.CONVERGED and int(s.steps) == 4
+
+
+def test_scheduler() -> None:
+    assert scheduler.budgets(100, 1000) == [100, 300, 900, 1000]
+    configs = [scheduler.Config("sgd", 0.001 * i, 0.1, 1) for i in range(1, 10)]
+    calls = []
+
+    def run(
+        c: scheduler.Config, steps: int, resume: Optional[trial.Progress]
+    ) -> trial.Summary:
+        calls.append((c.lr, steps, resume))
+        loss = 1.0 / c.lr / steps  # (higher learning rates are better here)
+        return trial.Summary(
+            losses=np.full([steps], loss),
+            weight_distances=None,
+            converged=None,
+            steps=steps,
+            stop_reason="",
+            progress=cast(trial.Progress, steps),  # (stand-in: checked below)
+        )
+
+    ranked = scheduler.successive_halving(configs, run, 100, 900, verbose=False)
+    assert len(ranked) == 9 and ranked[0].config == configs[-1]
+    assert ranked[0].steps == 900
+    # 9 at 100 steps, 3 resumed to 300, 1 to 900, each from where it left off:
+    assert [s for _, s, _ in calls] == [100] * 9 + [300] * 3 + [900]
+    assert [r for _, s, r in calls if s == 900] == [300]
+    assert all(r == 100 for _, s, r in calls if s == 300)
+
+
+def test_hyperband() -> None:
+    rungs = scheduler.budgets(100, 900)
+    assert rungs == [100, 300, 900]
+    sampled: List[int] = []
+    first_steps: Dict[float, int] = {}
+
+    def sample(n: int) -> List[scheduler.Config]:
+        sampled.append(n)
+        offset = sum(sampled[:-1])
+        return [scheduler.Config("sgd", offset + i + 1.0, 0.1, 1) for i in range(n)]
+
+    def run(
+        c: scheduler.Config, steps: int, resume: Optional[trial.Progress]
+    ) -> trial.Summary:
+        first_steps.setdefault(c.lr, steps)
+        distance = np.nan if c.lr == 1.0 else 1.0 / c.lr / steps
+        return trial.Summary(
+            losses=np.full([steps], 1.0 / c.lr / steps),
+            weight_distances=np.full([steps, LAYERS], distance),
+            converged=None,
+            steps=steps,
+            stop_reason="",
+            progress=cast(trial.Progress, steps),
+        )
+
+    ranked = scheduler.hyperband(sample, run, 100, 900, verbose=False)
+    # Bracket `s` starts `ceil(R / (s + 1) * eta^s)` configurations at `rungs[-1 - s]`:
+    expected = [ceil(3 / (s + 1) * 3**s) for s in reversed(range(3))]
+    assert sampled == expected == [9, 5, 3]
+    for b, s in enumerate(reversed(range(3))):
+        lrs = [sum(sampled[:b]) + i + 1.0 for i in range(sampled[b])]
+        assert {first_steps[lr] for lr in lrs} == {rungs[-1 - s]}
+    # Every bracket's results, merged & best first:
+    assert len(ranked) == sum(sampled)
+    scores = [r.score for r in ranked]
+    assert scores == sorted(scores)
+    assert ranked[0].config.lr == sum(sampled)  # (from the last bracket)
+    # By distance, a non-finite one is worst (& doesn't poison the sort):
+    sampled.clear()
+    first_steps.clear()
+    ranked = scheduler.hyperband(
+        sample, run, 100, 900, score=scheduler.final_distance, verbose=False
+    )
+    assert ranked[-1].config.lr == 1.0 and ranked[-1].score == inf
+    assert all(isfinite(r.score) for r in ranked[:-1])
+
+
+def test_stop_state(tmp_path) -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    p = sgd.defaults(lr=jnp.array(10.0, dtype=jnp.float64))  # (diverges)
+    s = sgd.init(feedforward.init(shapes, jrnd.PRNGKey(0), False), p)
+    summary = trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        1,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        s,
+        p,
+        subdir=(str(tmp_path / "out"),),
+        training_steps=1000,
+        verbose=False,
+        stop=stopping.Criteria(max_loss=10.0),
+    )
+    saving.wait()
+    assert summary.stop_reason and summary.steps < 1000
+    # Everything handed back is as of the step that triggered the stop:
+    progress = summary.progress
+    assert progress.w_hist is not None and progress.opt_params_hist is not None
+    assert len(progress.w_hist) == summary.steps
+    assert all(
+        [
+            a.dtype == jnp.float32 and jnp.array_equal(a, b.astype(jnp.float32))
+            for a, b in zip(progress.w_hist[-1], progress.w.W)
+        ]
+    )
+    assert jnp.array_equal(
+        progress.opt_params_hist[-1].log_lr, progress.opt_params.log_lr
+    )
+
+
+def test_checkpoint(tmp_path) -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    p = sgd.defaults()
+    s = sgd.init(feedforward.init(shapes, jrnd.PRNGKey(0), False), p)
+    d = str(tmp_path / "checkpoints")
+    run = lambda every=100, directory=d, p=p: trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        1,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        s,
+        p,
+        subdir=(str(tmp_path / "out"),),
+        training_steps=400,
+        verbose=False,
+        checkpoint_dir=directory,
+        checkpoint_every=every,
+    )
+    uninterrupted = run()
+    saving.wait()
+    assert len(checkpoint.chain(d)) == 4
+    # As if killed after step 400, but before step 300's snapshot was written:
+    shutil.rmtree(os.path.join(d, f"{checkpoint.PREFIX}300"))
+    assert len(checkpoint.chain(d)) == 2
+    resumed = run()
+    assert resumed.progress.steps == 400
+    assert uninterrupted.losses is not None and resumed.losses is not None
+    assert uninterrupted.weight_distances is not None
+    assert resumed.weight_distances is not None
+    assert np.array_equal(uninterrupted.losses, resumed.losses)
+    assert np.array_equal(uninterrupted.weight_distances, resumed.weight_distances)
+    saving.wait()
+    checkpoint.clear(d)
+    assert checkpoint.chain(d) == []
+
+    # Snapshots that don't line up with the end (every 152 steps, of 400):
+    same = lambda a, b: np.array_equal(a.losses, b.losses) and np.array_equal(
+        a.weight_distances, b.weight_distances
+    )
+    assert same(run(150), uninterrupted)
+    saving.wait()
+    assert len(checkpoint.chain(d)) == 2
+    shutil.rmtree(os.path.join(d, f"{checkpoint.PREFIX}304"))
+    assert same(run(150), uninterrupted)
+    saving.wait()
+    # The same directory, but a different learning rate:
+    with pytest.raises(AssertionError, match="different setup"):
+        run(150, p=sgd.defaults(lr=jnp.array(0.1, dtype=jnp.float64)))
+    checkpoint.clear(d)
+
+    # Resuming a trial that already stopped early just hands it back:
+    diverging = sgd.defaults(lr=jnp.array(10.0, dtype=jnp.float64))
+    stopped = lambda steps, resume: trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        1,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        s,
+        diverging,
+        subdir=(str(tmp_path / "stopped"),),
+        training_steps=steps,
+        verbose=False,
+        stop=stopping.Criteria(max_loss=10.0),
+        resume=resume,
+    )
+    first = stopped(1000, None)
+    assert first.stop_reason and first.steps < 1000
+    again = stopped(2000, first.progress)
+    assert again.stop_reason == first.stop_reason and again.steps == first.steps
+    assert first.losses is not None and again.losses is not None
+    assert np.array_equal(first.losses, again.losses)
+    unchanged = tree_map(jnp.array_equal, again.progress.w, first.progress.w)
+    assert tree_reduce(operator.and_, unchanged)
+    saving.wait()
+
+
+def test_population(tmp_path) -> None:
+    w_ideal = feedforward.init((NDIM, NDIM, NDIM), jrnd.PRNGKey(0), True)
+    p = sgd.defaults(lr=jnp.array(0.01, dtype=jnp.float64))
+    members = population.init(
+        jrnd.PRNGKey(1), w_ideal, sgd.init, p, 8, jnp.array(0.1, dtype=jnp.float64)
+    )
+    fitness = jnp.arange(8, dtype=jnp.float32).at[3].set(jnp.nan)
+    survivors, source = population.exploit_and_explore(
+        jrnd.PRNGKey(2), members, fitness, 0.25
+    )
+    # The worst two (7, & 3, which diverged) copy two of the best (0 & 1):
+    replaced = {3, 7}
+    for i in range(8):
+        j = int(source[i])
+        assert (j in (0, 1)) if i in replaced else (j == i)
+        assert np.array_equal(survivors.w.W[0][i], members.w.W[0][j])
+        same = bool(survivors.opt_params.log_lr[i] == members.opt_params.log_lr[j])
+        assert same != (i in replaced)
+
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    summary = population.run(
+        jrnd.PRNGKey(3),
+        NDIM,
+        1,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        sgd.init,
+        p,
+        training_steps=200,
+        subdir=(str(tmp_path),),
+        size=4,
+        interval=100,
+        verbose=False,
+    )
+    saving.wait()
+    assert summary.losses.shape == (200, 4)
+    assert summary.distances.shape == summary.sources.shape == (2, 4)
+    assert np.all(np.isfinite(summary.losses))
+    assert 0 <= summary.best < 4
+    # Reported hyperparameters are the ones that produced the reported distances:
+    lr = np.load(tmp_path / "optimizer" / "lr.npy")
+    assert lr.shape == (2, 4)
+    assert np.allclose(np.exp(summary.opt_params.log_lr), lr[-1])
+
+
+def test_downhill_engines() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w = feedforward.init(shapes, jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    _, last_dLdw = training.loss_and_grad(w, forward_pass, x, y)
+    for optim in [sgd, momentum, nesterov, rmsprop]:
+        p = optim.defaults(lr=LR)
+        s = optim.init(w, p)
+        out = {
+            engine: training.step_downhill(
+                w, forward_pass, x, y, optim.update, p, s, last_dLdw, engine=engine
+            )
+            for engine in training.DOWNHILL_ENGINES
+        }
+        # Analytic is the reference's math worked out by hand, to the bit:
+        same = lambda a, b: tree_reduce(
+            operator.and_, tree_map(lambda x, y: bool(jnp.array_equal(x, y)), a, b)
+        )
+        assert same(out[training.ANALYTIC], out[training.AUTODIFF])
+        # Fused differs only in updating with this step's gradient:
+        dLdw = out[training.FUSED][4]
+        assert same(out[training.FUSED][2], out[training.ANALYTIC][2])
+        assert same(out[training.FUSED][0], optim.update(p, s, w, dLdw)[1])
+
+
+def test_hypergradient_modes() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w = feedforward.init(shapes, jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    auto = lambda optim: training.hypergradient_mode(optim.defaults(), training.AUTO)
+    assert auto(sgd) == training.FORWARD
+    assert auto(swiss_army_knife) == training.REVERSE
+    for optim in [sgd, rmsprop]:
+        p = optim.defaults(lr=LR)
+        s = optim.init(w, p)
+        out = {
+            mode: training.step_global(
+                w, forward_pass, x, y, optim.update, p, s, w_ideal, power, mode
+            )
+            for mode in [training.REVERSE, training.FORWARD]
+        }
+        # (the loss is float32, so they only agree to its precision)
+        assert tree_reduce(
+            operator.and_,
+            tree_map(
+                lambda a, b: bool(jnp.allclose(a, b, rtol=1e-5, atol=1e-6)),
+                out[training.REVERSE],
+                out[training.FORWARD],
+            ),
+        )
+
+
+def test_implicit() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = (NDIM, NDIM, NDIM)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    w_init = feedforward.init(shapes, jrnd.PRNGKey(0), False)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    p = weight_decay.defaults(
+        lr=jnp.array(0.01, dtype=jnp.float64),
+        weight_decay=jnp.array(0.9, dtype=jnp.float64),
+    )
+
+    # (weight decay's fixed point depends on both hyperparameters)
+    @jit
+    def converged(p: weight_decay.Params) -> Weights:
+        def body(_, w):
+            s = weight_decay.State()
+            return training.step(w, forward_pass, x, y, weight_decay.update, p, s)[0]
+
+        return lax.fori_loop(0, 3000, body, w_init)
+
+    w = converged(p)
+    dLdp, L = implicit.hypergradient(
+        w, forward_pass, x, y, weight_decay.update, p, weight_decay.State()
+    )
+    assert L == training.loss(w, forward_pass, x, y)
+    # Against central differences through the whole (converged) inner loop:
+    eps = 1e-3
+    for field in p._fields:
+        nudged = lambda d: p._replace(**{field: getattr(p, field) + d})
+        above = training.loss(converged(nudged(eps)), forward_pass, x, y)
+        below = training.loss(converged(nudged(-eps)), forward_pass, x, y)
+        expected = (above - below) / (2 * eps)
+        assert jnp.allclose(getattr(dLdp, field), expected, rtol=1e-2)
+
+    w, s, p2, L = implicit.meta_step(
+        w_init,
+        weight_decay.State(),
+        p,
+        w_ideal,
+        jrnd.PRNGKey(3),
+        100,
+        BATCH,
+        forward_pass,
+        weight_decay.update,
+    )
+    assert jnp.isfinite(L)
+    assert not jnp.allclose(p2.log_lr, p.log_lr)
+
+
+def test_quantized() -> None:
+    # Not a whole number of blocks, with zeros & a wide range of magnitudes:
+    x = jrnd.normal(jrnd.PRNGKey(0), [7, 100], dtype=jnp.float64)
+    x = (x * jnp.exp(3 * x)).at[0].set(0)
+    q = quantized.quantize(x)
+    assert q.codes.dtype == jnp.int8 and q.codes.shape == x.shape
+    y = quantized.dequantize(q)
+    assert jnp.all(y[0] == 0)
+    # Companded, so big numbers in a block don't wipe out small ones:
+    big = jnp.abs(x) > 1e-3 * jnp.max(jnp.abs(x))
+    assert jnp.all(jnp.abs(y - x)[big] <= 0.2 * jnp.abs(x)[big])
+
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w = feedforward.init(shapes, jrnd.PRNGKey(1), False)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(2), True)
+    x = jrnd.normal(jrnd.PRNGKey(3), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    p = rmsprop.defaults(lr=LR)
+    update, init = quantized.wrap(rmsprop.update), quantized.init(rmsprop.init)
+    assert quantized.wrap(rmsprop.update) is update  # (same static argument)
+    s = init(w, p)
+    assert quantized.nbytes(s) < quantized.nbytes(rmsprop.init(w, p)) / 4
+    full = training.step(w, forward_pass, x, y, rmsprop.update, p, rmsprop.init(w, p))
+    eight = training.step(w, forward_pass, x, y, update, p, s)
+    assert all([jnp.allclose(a, b) for a, b in zip(full[0].W, eight[0].W)])
+    # Meta-gradients (through integer codes) in every mode:
+    for mode in [training.REVERSE, training.FORWARD]:
+        out = training.step_global(
+            w, forward_pass, x, y, update, p, s, w_ideal, power, mode
+        )
+        assert jnp.isfinite(out[2].log_lr)
+    _, last_dLdw = training.loss_and_grad(w, forward_pass, x, y)
+    downhill = training.step_downhill(w, forward_pass, x, y, update, p, s, last_dLdw)
+    assert jnp.isfinite(downhill[2].log_lr)
+
+
+def test_true_weights() -> None:
+    w = feedforward.init((NDIM, NDIM, NDIM), jrnd.PRNGKey(0), False)
+    dLdw = feedforward.init((NDIM, NDIM, NDIM), jrnd.PRNGKey(1), False)
+    for optim in [nesterov, swiss_army_knife]:
+        p = optim.defaults(lr=jnp.array(0.1, dtype=jnp.float64))
+        s = optim.init(w, p)
+        unchanged = tree_map(jnp.array_equal, optim.true_weights(p, s, w), w)
+        assert tree_reduce(operator.and_, unchanged)
+        assert "actual" not in s._fields  # (no copy of the weights to carry around)
+        for _ in range(3):
+            # Stepping back from the lookahead by the overstep gives the true weights:
+            no_overstep = p._replace(log_overstep=jnp.log(0.0))
+            _, stepped = optim.update(no_overstep, s, w, dLdw)
+            s, lookahead = optim.update(p, s, w, dLdw)
+            close = tree_map(jnp.allclose, optim.true_weights(p, s, lookahead), stepped)
+            assert tree_reduce(operator.and_, close)
+            w = lookahead
+
+
+def test_granular() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    w = feedforward.init((NDIM, 2 * NDIM, NDIM), jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init((NDIM, 2 * NDIM, NDIM), jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    p = swiss_army_knife.defaults(lr=LR)
+    s = swiss_army_knife.init(w, p)
+    update, init = granular.wrap(swiss_army_knife.update), granular.init(
+        swiss_army_knife.init
+    )
+    _, dLdw = training.loss_and_grad(w, forward_pass, x, y, power)
+    reference = training.meta_step(
+        w, dLdw, swiss_army_knife.update, p, s, w_ideal, training.REVERSE
+    )
+    for granularity in [granular.PER_LAYER, granular.PER_UNIT]:
+        expanded = granular.expand(p, w, granularity)
+        if granularity == granular.PER_LAYER:
+            assert expanded.log_lr[0].shape == ()
+        else:
+            # Broadcasts against its array of weights (`W` first, then `B`):
+            assert expanded.log_lr[0].shape == (2 * NDIM, 1)
+            assert expanded.log_lr[layers(w)].shape == (2 * NDIM,)
+        # Same values everywhere, so the same step...
+        out = training.meta_step(
+            w, dLdw, update, expanded, init(w, expanded), w_ideal, training.REVERSE
+        )
+        assert all([jnp.allclose(a, b) for a, b in zip(out[0].W, reference[0].W)])
+        # ...& each global meta-gradient is the sum of its per-layer/per-unit parts:
+        for field, before, after in zip(p._fields, expanded, out[2]):
+            d = sum([jnp.sum(a - b) for a, b in zip(before, after)])
+            assert jnp.allclose(d, getattr(p, field) - getattr(reference[2], field))
+
+
+def test_granular_trial(tmp_path) -> None:
+    widths = (NDIM, 2 * NDIM, NDIM)
+    w = feedforward.init(widths, jrnd.PRNGKey(0), False)
+    assert weights.sizes(w) == list(widths)
+    p = granular.expand(rmsprop.defaults(lr=LR), w, granular.PER_UNIT)
+    trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        BATCH,
+        2,
+        feedforward.forward_pass(jnn.gelu),
+        granular.wrap(rmsprop.update),
+        granular.init(rmsprop.init)(w, p),
+        p,
+        subdir=(str(tmp_path),),
+        training_steps=100,
+        verbose=False,
+        widths=widths,
+    )
+    saving.wait()
+    # One learning rate per unit of every array of weights (`W`s first, then `B`s):
+    saved = results.optimizer(str(tmp_path))
+    units = [x.shape[0] for x in tree_leaves(w)]
+    assert len(units) == 4
+    for i, n in enumerate(units):
+        lr = np.load(tmp_path / "optimizer" / f"lr_{i}.npy")
+        assert lr.shape == (100, n) and np.all(np.isfinite(lr))
+        assert np.array_equal(saved[f"lr_{i}"], lr)
+
+
+def test_line_search() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w = feedforward.init(shapes, jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [BATCH, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    for optim in [sgd, momentum, rmsprop]:
+        p = optim.defaults(lr=LR)
+        s = optim.init(w, p)
+        plain = training.step(w, forward_pass, x, y, optim.update, p, s, power)
+        args = (w, forward_pass, x, y, optim.update, p, s, power)
+        kept = line_search.step(*args, line_search.SCALES, False)
+        assert all([jnp.array_equal(a, b) for a, b in zip(kept[0].W, plain[0].W)])
+        w_new, s_new, L, found = line_search.step(*args)
+        assert found.losses.shape == line_search.SCALES.shape
+        # The optimizer's own step (a scale of 1) is one of the candidates:
+        i = int(jnp.argmax(line_search.SCALES == 1))
+        own = training.loss(plain[0], forward_pass, x, y, power)
+        assert jnp.allclose(found.losses[i], own)
+        best = training.loss(w_new, forward_pass, x, y, power)
+        assert jnp.allclose(best, jnp.min(found.losses))
+
+
+def test_example_grads() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    w = feedforward.init(shapes, jrnd.PRNGKey(0), False)
+    w_ideal = feedforward.init(shapes, jrnd.PRNGKey(1), True)
+    x = jrnd.normal(jrnd.PRNGKey(2), [6, NDIM], dtype=jnp.float32)
+    y = forward_pass(w_ideal, x)
+    _, dLdw = training.loss_and_grad(w, forward_pass, x, y)
+    g = training.example_grads(w, forward_pass, x, y)
+    summed = tree_map(lambda a, b: jnp.allclose(jnp.sum(a, axis=0), b), g, dLdw)
+    assert tree_reduce(operator.and_, summed)
+    # One example at a time (a budget too small for even one) or all at once:
+    assert training.example_chunk(w, 6, 1) == 1
+    assert training.example_chunk(w, 6) == 6
+    four = 4 * (NDIM + 1) * NDIM * LAYERS * 8
+    assert training.example_chunk(w, 6, four) == 3
+    # A prime batch is padded up to whole chunks, not split into chunks of one:
+    assert training.example_chunk(w, 7, four) == 4
+    norms = [
+        training.map_example_grads(metrics.sq_norms, w, forward_pass, x, y, budget=b)
+        for b in [1, four, training.EXAMPLE_GRAD_BYTES]
+    ]
+    odd = training.map_example_grads(
+        metrics.sq_norms, w, forward_pass, x[:5], y[:5], budget=four
+    )
+    assert jnp.allclose(odd, norms[2][:5])
+    assert jnp.allclose(norms[0], norms[1])
+    assert norms[0].shape == (6, LAYERS) and jnp.allclose(norms[0], norms[1])
+    everything = tuple(metrics.PER_EXAMPLE)
+    m = metrics.compute(everything, w, w, w_ideal, [], dLdw, norms[0])
+    assert jnp.all(m[metrics.MAX_EXAMPLE_GRAD_NORMS] >= m[metrics.EXAMPLE_GRAD_NORMS])
+    assert jnp.all(m[metrics.GRAD_VARIANCES] > 0)
+    ratio = m[metrics.GRAD_VARIANCES] / m[metrics.GRAD_SIGNALS]
+    assert jnp.allclose(m[metrics.NOISE_SCALES], ratio)
+    # The same example over & over: no noise at all
+    same = jnp.broadcast_to(x[:1], x.shape)
+    _, dLdw = training.loss_and_grad(w, forward_pass, same, y[:1].repeat(6, 0))
+    sq = training.map_example_grads(
+        metrics.sq_norms, w, forward_pass, same, y[:1].repeat(6, 0)
+    )
+    m = metrics.compute(everything, w, w, w_ideal, [], dLdw, sq)
+    assert jnp.allclose(m[metrics.NOISE_SCALES], 0, atol=1e-4)
+
+
+def test_trial_example_metrics(tmp_path) -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+    p = sgd.defaults(lr=LR)
+    s = sgd.init(feedforward.init(shapes, jrnd.PRNGKey(0), False), p)
+    run = lambda batch, metric_set, out: trial.run(
+        jrnd.PRNGKey(1),
+        NDIM,
+        batch,
+        LAYERS,
+        forward_pass,
+        sgd.update,
+        s,
+        p,
+        subdir=(str(tmp_path / out),),
+        training_steps=100,
+        verbose=False,
+        metric_set=metric_set,
+    )
+    run(4, metrics.PER_EXAMPLE, "four")
+    saving.wait()
+    for name in metrics.PER_EXAMPLE:
+        arr = np.load(tmp_path / "four" / "metrics" / f"{name}.npy")
+        assert arr.shape == (100, LAYERS) and np.all(np.isfinite(arr))
+    # One example per batch has no spread to measure:
+    with pytest.raises(AssertionError, match="batch of at least 2"):
+        run(1, (metrics.NOISE_SCALES,), "one")
+
+
+def test_padding() -> None:
+    forward_pass = feedforward.forward_pass(jnn.gelu)
+    power = jnp.array(2.0, dtype=jnp.float32)
+    assert [padding.bucket(n) for n in [1, 2, 3, 4, 5]] == [1, 2, 4, 4, 8]
+    # Two grid cells, different batches & widths, in the same bucket:
+    grid = [(3, (2, 3, 2)), (4, (3, 2, 3))]
+    padded_batch, padded_sizes = 4, (4, 4, 4)
+    cells, references = [], []
+    for i, (batch, sizes) in enumerate(grid):
+        w = feedforward.init(sizes, jrnd.PRNGKey(i), False)
+        w_ideal = feedforward.init(sizes, jrnd.PRNGKey(10 + i), True)
+        x = jrnd.normal(jrnd.PRNGKey(20 + i), [batch, sizes[0]], dtype=jnp.float32)
+        y = forward_pass(w_ideal, x)
+        p = rmsprop.defaults(lr=LR)
+        s = rmsprop.init(w, p)
+        # The real, unpadded step:
+        reference = training.step_global(
+            w, forward_pass, x, y, rmsprop.update, p, s, w_ideal, power
+        )
+        # & for `opt_params` & permutations, the same step without any padding
+        # but with the same (greedy) matching as padded layers (see `padding`):
+        no_padding = padding.mask(batch, sizes, batch, sizes)
+        matched = padding.step_global(
+            w, forward_pass, x, y, rmsprop.update, p, s, w_ideal, no_padding, power
+        )
+        references.append((*reference[:2], reference[4], *matched[2:4]))
+        w_padded = padding.pad_weights(w, padded_sizes)
+        cells.append(
+            (
+                w_padded,
+                rmsprop.init(w_padded, p),
+                p,
+                padding.pad_weights(w_ideal, padded_sizes),
+                padding.pad(x, (padded_batch, padded_sizes[0])),
+                padding.pad(y, (padded_batch, padded_sizes[-1])),
+                padding.mask(batch, sizes, padded_batch, padded_sizes),
+            )
+        )
+    tracing.reset()
+    out = padding.cells(*saving.stack(cells), power, forward_pass, rmsprop.update)
+    for i, (_, sizes) in enumerate(grid):
+        w, s, p, perm, L = tree_map(lambda x: x[i], out)
+        ref_w, ref_s, ref_L, ref_p, ref_perm = references[i]
+        # Loss, weights & optimizer state don't depend on matching, so exactly as if
+        # there were no padding at all:
+        assert jnp.allclose(L, ref_L)
+        unpadded = padding.unpad_weights(w, sizes)
+        assert weights.sizes(unpadded) == list(sizes)
+        close = tree_map(lambda a, b: jnp.allclose(a, b), unpadded, ref_w)
+        assert tree_reduce(operator.and_, close)
+        cut = lambda a, b: jnp.allclose(a[tuple([slice(0, n) for n in b.shape])], b)
+        assert tree_reduce(operator.and_, tree_map(cut, s, ref_s))
+        assert tree_reduce(operator.and_, tree_map(jnp.allclose, p, ref_p))
+        # Padding stays zero, & padded units only match padded units:
+        w_again = padding.pad_weights(unpadded, padded_sizes)
+        assert tree_reduce(operator.and_, tree_map(jnp.array_equal, w, w_again))
+        assert jnp.array_equal(perm[0][: sizes[1]], ref_perm[0])
+    # Another grid in the same bucket reuses the compiled step:
+    traces = dict(tracing.TRACES)
+    padding.cells(*saving.stack(cells[::-1]), power, forward_pass, rmsprop.update)
+    assert tracing.TRACES == traces
+    # Padded layers are matched greedily, never by an 8! search for 5 real units:
+    a, b = [
+        jrnd.normal(jrnd.PRNGKey(30 + i), [8, 4], dtype=jnp.float32) for i in range(2)
+    ]
+    real = jnp.arange(8) < 5
+    normalized = lambda x: x / (jnp.linalg.norm(x, axis=1, keepdims=True) + 1e-8)
+    assert jnp.array_equal(
+        permutations.find_permutation(a, b, real),
+        permutations.find_permutation_greedy(normalized(a), normalized(b), real),
+    )
@@ -0,0 +1,90 @@
+from metaoptimizer import feedforward, saving, scheduler, stopping, store, trial
+from metaoptimizer.scheduler import Config
+
+from beartype.typing import List, Optional
+from importlib import import_module
+from jax import nn as jnn, numpy as jnp, random as jrnd
+import numpy as np
+import os
+
+
+# The learning-rate/batch-size grid that's commented out in `plot-convergence.py`,
+# searched with Hyperband (see `metaoptimizer.scheduler`) instead of exhaustively.
+
+DIRECTORY = ["tuning"]
+STORE = os.path.join(*DIRECTORY) + store.EXTENSION
+
+NDIM = 3
+LAYERS = 2
+NONLINEARITY = jnn.gelu
+POWER = jnp.array(2.0, dtype=jnp.float32)
+MIN_STEPS = 100
+MAX_STEPS = 2700
+OPTIMIZERS = ["sgd", "adam"]
+GRID = [
+    Config(optimizer, float(0.0001 * 2**lg_lr), float(0.01 * 2**lg_dist), 2**lg_batch)
+    for optimizer in OPTIMIZERS
+    for lg_lr in range(8)
+    for lg_dist in range(8)
+    for lg_batch in range(4)
+]
+SEED = 42
+
+forward_pass = feedforward.forward_pass(NONLINEARITY)
+shapes = tuple([NDIM for _ in range(LAYERS + 1)])
+w_example = feedforward.init(shapes, jrnd.PRNGKey(42), False)
+rng = np.random.default_rng(SEED)
+
+
+def sample(n: int) -> List[Config]:
+    return [GRID[i] for i in rng.choice(len(GRID), min(n, len(GRID)), replace=False)]
+
+
+def run(
+    config: Config, training_steps: int, resume: Optional[trial.Progress]
+) -> trial.Summary:
+    optim = import_module(f"metaoptimizer.optimizers.{config.optimizer}")
+    opt_params = optim.defaults(lr=jnp.array(config.lr, dtype=jnp.float64))
+    directory = (
+        config.optimizer,
+        f"{config.lr}-learning-rate",
+        f"{config.distance}-distance",
+        f"batch-of-{config.batch}",
+    )
+    print(f"  {'/'.join(directory)} to step {training_steps}")
+    return trial.run(
+        jrnd.PRNGKey(SEED),
+        NDIM,
+        config.batch,
+        LAYERS,
+        forward_pass,
+        optim.update,
+        optim.init(w_example, opt_params),
+        opt_params,
+        NONLINEARITY,
+        training_steps,
+        directory,
+        POWER,
+        jnp.array(config.distance, dtype=jnp.float64),
+        "    ",
+        # Only what scoring needs (everything tracked is held until promotion):
+        track_permutations=False,
+        track_opt_params_hist=False,
+        track_w_hist=False,
+        track_b_hist=False,
+        verbose=False,
+        store=STORE,
+        # (diverged configs drop out early: see `scheduler`)
+        stop=stopping.Criteria(),
+        resume=resume,
+    )
+
+
+if __name__ == "__main__":
+    results = scheduler.hyperband(sample, run, MIN_STEPS, MAX_STEPS)
+    saving.wait()
+    print()
+    print("Best configurations (by final loss):")
+    for r in results[:10]:
+        stopped = f" (stopped: {r.stop_reason})" if r.stop_reason else ""
+        print(f"  {r.score:.3g} after {r.steps} steps: {r.config}{stopped}")